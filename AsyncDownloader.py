@@ -0,0 +1,219 @@
+import asyncio
+import datetime
+import json
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from BarStorage import BarDataStorage
+from FrameDecoder import FrameDecoder
+from Metrics import Metrics
+from HuobiClient import HUOBI_WS_URL, extend_klines, kline_topic, request_windows
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ParallelBarDownloader(object):
+    """
+    fetch 1min bars for many tickers over several websocket connections at once
+
+    the request windows of every ticker go into one shared queue that all connections pull from, so a
+    slow connection simply takes fewer windows. at most connection_queue_size requests are in flight on
+    each connection and at most max_in_flight across all of them. needs the optional websockets package.
+    """
+
+    def __init__(
+            self,
+            tickers,  # type: List[str]
+            start_date,  # type: datetime.date
+            end_date,  # type: datetime.date
+            connections=4,  # type: int
+            connection_queue_size=5,  # type: int
+            max_in_flight=16,  # type: int
+            request_size=300,  # type: int
+            url=HUOBI_WS_URL,  # type: str
+            response_timeout=60.0,  # type: float
+            retries=2,  # type: int
+            storages=None,  # type: Optional[Dict[str, BarDataStorage]]
+            metrics=None  # type: Optional[Metrics]
+    ):
+        """
+        :param metrics: gets bars, requests and bytes counters, the 'round_trip' latency of every request
+            and the window progress, no sinks by default
+        """
+        self.tickers = list(tickers)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.connections = connections
+        self.connection_queue_size = connection_queue_size
+        self.max_in_flight = max_in_flight
+        self.request_size = request_size
+        self.url = url
+        self.response_timeout = response_timeout
+        self.retries = retries
+
+        self.storages = storages if storages is not None else {}  # type: Dict[str, BarDataStorage]
+        for ticker in self.tickers:
+            if ticker not in self.storages:
+                self.storages[ticker] = BarDataStorage(ticker=ticker, bar_span=datetime.timedelta(minutes=1))
+
+        self.stats = {
+            'requests': 0,
+            'bars': 0,
+            'bytes': 0,
+            'retries': 0,
+            'failures': 0,
+            'seconds': 0.0
+        }
+        self.failed = []  # type: List[Tuple[str, int, int]]
+        self.decoder = FrameDecoder()
+        self.metrics = metrics if metrics is not None else Metrics(name='download')
+
+    def run(self):
+        # type: () -> Dict[str, BarDataStorage]
+        """
+        blocking entry point for code that is not running an event loop
+        """
+        return asyncio.run(self.download())
+
+    async def download(self):
+        # type: () -> Dict[str, BarDataStorage]
+        queue = asyncio.Queue()
+        for request_from, request_to in request_windows(self.start_date, self.end_date, self.request_size):
+            # ticker innermost so every connection works on all tickers at the same time
+            for ticker in self.tickers:
+                queue.put_nowait((ticker, request_from, request_to, 0))
+
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        started = time.perf_counter()
+        self._window_count = queue.qsize()
+
+        workers = [asyncio.ensure_future(self._connection(queue, in_flight)) for _ in range(self.connections)]
+        joined = asyncio.ensure_future(queue.join())
+        try:
+            pending = set(workers)
+            while not joined.done():
+                done, pending = await asyncio.wait(pending | {joined}, return_when=asyncio.FIRST_COMPLETED)
+                pending.discard(joined)
+                if not joined.done() and not pending:
+                    errors = [worker.exception() for worker in workers if not worker.cancelled()]
+                    raise DownloadError('all connections closed with {} windows left: {}'.format(
+                        queue.qsize(), [str(error) for error in errors if error is not None]))
+        finally:
+            for worker in workers + [joined]:
+                worker.cancel()
+            await asyncio.gather(*workers, joined, return_exceptions=True)
+
+        self.stats['seconds'] = time.perf_counter() - started
+        self.metrics.close()
+        print(self.summary())
+        return self.storages
+
+    def throughput(self):
+        # type: () -> Dict[str, float]
+        seconds = self.stats['seconds'] or float('nan')
+        return {
+            'bars_per_second': self.stats['bars'] / seconds,
+            'requests_per_second': self.stats['requests'] / seconds,
+            'megabytes_per_second': self.stats['bytes'] / seconds / 1e6
+        }
+
+    def summary(self):
+        # type: () -> str
+        throughput = self.throughput()
+        return '{} bars in {} requests over {} connections in {:.2f}s, {:.0f} bars/s, {:.1f} requests/s, ' \
+               '{} retries, {} failed'.format(
+                    self.stats['bars'], self.stats['requests'], self.connections, self.stats['seconds'],
+                    throughput['bars_per_second'], throughput['requests_per_second'],
+                    self.stats['retries'], self.stats['failures'])
+
+    async def _connection(self, queue, in_flight):
+        # type: (asyncio.Queue, asyncio.Semaphore) -> None
+        import websockets
+
+        async with websockets.connect(self.url, max_size=None) as socket:
+            waiting = {}  # type: Dict[str, asyncio.Future]
+            slots = asyncio.Semaphore(self.connection_queue_size)
+            reader = asyncio.ensure_future(self._reader(socket, waiting))
+            requests = set()
+            try:
+                while True:
+                    item = await queue.get()
+                    if reader.done():
+                        # connection is gone, leave the window to the others
+                        queue.put_nowait(item)
+                        queue.task_done()
+                        break
+                    await slots.acquire()
+                    await in_flight.acquire()
+                    request = asyncio.ensure_future(self._request(socket, waiting, queue, item, slots, in_flight))
+                    requests.add(request)
+                    request.add_done_callback(requests.discard)
+                reader.result()
+            finally:
+                reader.cancel()
+                for request in list(requests):
+                    request.cancel()
+
+    async def _reader(self, socket, waiting):
+        # type: (object, Dict[str, asyncio.Future]) -> None
+        try:
+            async for message in socket:
+                self.stats['bytes'] += len(message)
+                self.metrics.incr('bytes', len(message))
+                ping, result = self.decoder.decode(message)
+                if ping is not None:
+                    await socket.send(json.dumps({'pong': ping}))
+                    continue
+                future = waiting.pop(result.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(result)
+        finally:
+            for future in waiting.values():
+                if not future.done():
+                    future.set_exception(DownloadError('connection closed'))
+
+    async def _request(self, socket, waiting, queue, item, slots, in_flight):
+        ticker, request_from, request_to, attempt = item
+        request_id = str(uuid.uuid1())
+        future = asyncio.get_running_loop().create_future()
+        waiting[request_id] = future
+        sent_at = time.perf_counter()
+        try:
+            await socket.send(json.dumps({
+                'req': kline_topic(ticker),
+                'id': request_id,
+                'from': request_from,
+                'to': request_to
+            }))
+            result = await asyncio.wait_for(future, self.response_timeout)
+            self.metrics.observe('round_trip', time.perf_counter() - sent_at)
+            if result.get('status') != 'ok':
+                raise DownloadError(str(result.get('err-msg', result)))
+
+            extend_klines(self.storages[ticker], result['data'])
+            self.stats['requests'] += 1
+            self.stats['bars'] += len(result['data'])
+            self.metrics.incr('requests')
+            self.metrics.incr('bars', len(result['data']))
+            self.metrics.progress(self.stats['requests'], self._window_count, 'windows')
+            self.metrics.tick()
+        except asyncio.CancelledError:
+            waiting.pop(request_id, None)
+            queue.put_nowait(item)
+            raise
+        except Exception as error:
+            waiting.pop(request_id, None)
+            if attempt < self.retries:
+                self.stats['retries'] += 1
+                queue.put_nowait((ticker, request_from, request_to, attempt + 1))
+            else:
+                self.stats['failures'] += 1
+                self.failed.append((ticker, request_from, request_to))
+                print('Giving up on {} {}..{}: {}'.format(ticker, request_from, request_to, error))
+        finally:
+            slots.release()
+            in_flight.release()
+            queue.task_done()
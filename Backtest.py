@@ -0,0 +1,261 @@
+import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from BarStorage import BarDataStorage, from_epoch
+from DataStructure import Instruction, OrderState, OrderType, Report, TradeSide
+from Indicators import IndicatorEngine
+from Ledger import Ledger
+from OrderManager import OrderManager
+
+BUY_SIDES = (TradeSide.LongOpen, TradeSide.ShortClose)
+SELL_SIDES = (TradeSide.ShortOpen, TradeSide.LongClose)
+# change of the net position per unit filled
+POSITION_SIGN = {
+    TradeSide.LongOpen: 1,
+    TradeSide.ShortClose: 1,
+    TradeSide.ShortOpen: -1,
+    TradeSide.LongClose: -1
+}  # type: Dict[TradeSide, int]
+
+
+class BarBacktest(object):
+    """
+    replays one BarDataStorage bar by bar, calling strategy(backtest, i) after bar i has closed
+
+    instructions submitted from the strategy are matched against the following bars:
+    a buy limit fills once the bar low reaches it, a sell limit once the bar high does, at the limit
+    or at the bar open if the bar opened through it. LimitOrder rests until filled or canceled, FAK
+    fills what it can in the next bar and cancels the rest, FOK fills completely in the next bar or
+    is canceled. with max_participation set, the orders filled in a bar share at most that fraction
+    of the bar volume.
+
+    the bar columns are plain python lists on the backtest (time, open_price, ..., notional), a
+    strategy indexing them with i stays well above a million bars per second. bars without open
+    orders cost one strategy call and nothing else. fills are booked into ledger, which is marked at the
+    last close of every run.
+
+    with an IndicatorEngine its values over the storage are lists by indicator name in indicators,
+    computed once through the engine's cache, the same values live trading gets from engine.on_bar.
+    """
+
+    def __init__(
+            self,
+            storage,  # type: BarDataStorage
+            strategy,  # type: Callable[[BarBacktest, int], None]
+            max_participation=None,  # type: Optional[float]
+            on_report=None,  # type: Optional[Callable[[Report], None]]
+            indicators=None  # type: Optional[IndicatorEngine]
+    ):
+        self.storage = storage
+        self.ticker = storage.ticker
+        self.strategy = strategy
+        self.max_participation = max_participation
+        self.on_report = on_report
+
+        self.time = storage.time.tolist()  # type: List[int]
+        self.open_price = storage.open_price.tolist()  # type: List[float]
+        self.high_price = storage.high_price.tolist()  # type: List[float]
+        self.low_price = storage.low_price.tolist()  # type: List[float]
+        self.close_price = storage.close_price.tolist()  # type: List[float]
+        self.volume = storage.volume.tolist()  # type: List[float]
+        self.notional = storage.notional.tolist()  # type: List[float]
+        self.indicators = {
+            name: values.tolist() for name, values in indicators.compute(storage).items()
+        } if indicators is not None else {}  # type: Dict[str, List[float]]
+
+        self.position = 0
+        self.reports = []  # type: List[Report]
+        self.orders = OrderManager()
+        self.ledger = Ledger()
+        self.open_orders = []  # type: List[Instruction]
+        self._cancels = []  # type: List[Instruction]
+        self._index = -1
+
+    @classmethod
+    def from_replay(cls, replay, strategy, ticker=None, period='1min', **kwargs):
+        """
+        backtest over the bars a BarDataReplay has downloaded or loaded
+        """
+        return cls(replay.storage(ticker, period), strategy, **kwargs)
+
+    def __len__(self):
+        return len(self.time)
+
+    def submit(self, instruction):
+        # type: (Instruction) -> Instruction
+        """
+        queue an order, it is matched from the next bar on
+        """
+        if instruction.Type not in (OrderType.LimitOrder, OrderType.FOK, OrderType.FAK):
+            raise ValueError('cannot backtest {} orders, submit LimitOrder, FOK or FAK'.format(instruction.Type))
+        if instruction.Side not in POSITION_SIGN:
+            raise ValueError('invalid trade side {}'.format(instruction.Side))
+
+        self.orders.add(instruction)
+        self.open_orders.append(instruction)
+        return instruction
+
+    def cancel(self, instruction):
+        # type: (Instruction) -> Instruction
+        """
+        cancel an open order before the next bar is matched, returns the cancel instruction
+        """
+        self._cancels.append(instruction)
+        return self.orders.canceling(instruction.OrderID, self._now())
+
+    def _now(self):
+        # type: () -> Optional[datetime.datetime]
+        return from_epoch(self.time[self._index]) if self._index >= 0 else None
+
+    def _report(self, order, amount, price, trade_time):
+        # type: (Instruction, int, float, datetime.datetime) -> None
+        notional = amount * price
+        self.orders.filled(order.OrderID, amount, notional, trade_time)
+        self.position += POSITION_SIGN[order.Side] * amount
+
+        report = Report(self.ticker, order.Side, amount, notional, trade_time, order.OrderID, order.Note)
+        self.reports.append(report)
+        self.ledger.on_report(report)
+        if self.on_report is not None:
+            self.on_report(report)
+
+    def _match(self, i):
+        trade_time = from_epoch(self.time[i])
+
+        if self._cancels:
+            for order in self._cancels:
+                if order.State not in (OrderState.Filled, OrderState.Canceled):
+                    self.orders.canceled(order.OrderID, trade_time)
+            self._cancels = []
+
+        open_price = self.open_price[i]
+        high_price = self.high_price[i]
+        low_price = self.low_price[i]
+        budget = None if self.max_participation is None else int(self.volume[i] * self.max_participation)
+
+        still_open = []
+        for order in self.open_orders:
+            if order.State in (OrderState.Filled, OrderState.Canceled):
+                continue
+
+            limit_price = order.LimitPrice
+            if order.Side in BUY_SIDES:
+                price = min(limit_price, open_price) if low_price <= limit_price else None
+            else:
+                price = max(limit_price, open_price) if high_price >= limit_price else None
+
+            remaining = order.Amount - order.FilledAmount
+            amount = 0
+            if price is not None:
+                amount = remaining if budget is None else min(remaining, budget)
+                if order.Type is OrderType.FOK and amount < remaining:
+                    amount = 0
+            if amount > 0:
+                self._report(order, amount, price, trade_time)
+                if budget is not None:
+                    budget -= amount
+
+            if amount == remaining:
+                continue
+            if order.Type is OrderType.LimitOrder:
+                still_open.append(order)
+            else:
+                self.orders.canceled(order.OrderID, trade_time)
+        self.open_orders = still_open
+
+    def run(self, start=0, stop=None):
+        # type: (int, Optional[int]) -> List[Report]
+        """
+        replay bars [start, stop) and return every report so far
+        """
+        stop = len(self) if stop is None else stop
+        strategy = self.strategy
+        for i in range(start, stop):
+            self._index = i
+            if self.open_orders or self._cancels:
+                self._match(i)
+            strategy(self, i)
+        if stop > start:
+            self.ledger.mark(self.ticker, self.close_price[stop - 1])
+        return self.reports
+
+
+class SignalResult(object):
+    """
+    outcome of run_signals, arrays are per bar of the storage
+    """
+
+    def __init__(self, storage, position, trade_index, trade_amount, trade_price, cash, note=''):
+        self.storage = storage
+        self.position = position  # held after each bar
+        self.trade_index = trade_index  # bar every trade was filled in
+        self.trade_amount = trade_amount  # signed, positive is buying
+        self.trade_price = trade_price
+        self.cash = cash  # after each bar, starting from zero
+        self.note = note
+
+    @property
+    def equity(self):
+        # type: () -> np.ndarray
+        """
+        cash plus the position marked at the close of each bar
+        """
+        return self.cash + self.position * self.storage.close_price
+
+    def reports(self):
+        # type: () -> List[Report]
+        """
+        the trades as Reports, a trade through zero is a close followed by an open
+        """
+        before = self.position[self.trade_index] - self.trade_amount
+        buying = self.trade_amount > 0
+        closing = np.where(np.sign(before) == -np.sign(self.trade_amount),
+                           np.minimum(np.abs(before), np.abs(self.trade_amount)), 0)
+        opening = np.abs(self.trade_amount) - closing
+
+        # closes before opens of the same bar
+        index = np.concatenate((self.trade_index, self.trade_index))
+        amount = np.concatenate((closing, opening))
+        price = np.concatenate((self.trade_price, self.trade_price))
+        sides = np.concatenate((
+            np.where(buying, TradeSide.ShortClose.value, TradeSide.LongClose.value),
+            np.where(buying, TradeSide.LongOpen.value, TradeSide.ShortOpen.value)
+        ))
+        order = np.argsort(index, kind='stable')
+        order = order[amount[order] > 0]
+
+        return Report.from_arrays(
+            self.storage.ticker,
+            [TradeSide(side) for side in sides[order].tolist()],
+            amount[order],
+            amount[order] * price[order],
+            self.storage.time[index[order]],
+            ['signal-{}'.format(i) for i in index[order].tolist()],
+            self.note
+        )
+
+
+def run_signals(storage, position, slippage=0.0, note=''):
+    # type: (BarDataStorage, np.ndarray, float, str) -> SignalResult
+    """
+    vectorized backtest of a target position per bar
+
+    position[i] is the position wanted once bar i has closed, the difference is traded at the open
+    of bar i + 1 and pays slippage as a fraction of that price. no limit matching or volume caps,
+    those need the bar by bar BarBacktest.
+    """
+    position = np.asarray(position)
+    assert len(position) == len(storage), 'one target position per bar'
+
+    # the position actually held during and after bar i is the target of bar i - 1
+    held = np.concatenate(([0], position[:-1])).astype(np.int64)
+    trades = np.diff(held, prepend=0)
+    trade_index = np.flatnonzero(trades)
+    trade_amount = trades[trade_index]
+    trade_price = storage.open_price[trade_index] * (1 + slippage * np.sign(trade_amount))
+
+    cash_flow = np.zeros(len(storage))
+    np.add.at(cash_flow, trade_index, -trade_amount * trade_price)
+    return SignalResult(storage, held, trade_index, trade_amount, trade_price, np.cumsum(cash_flow), note)
@@ -0,0 +1,225 @@
+import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from BarStorage import EPOCH, BarDataStorage, bar_offset, bar_start, from_epoch
+from DataStructure import BarData, TickData, TradeData
+
+
+def _seconds(value):
+    # type: (object) -> float
+    """
+    epoch seconds of a datetime, naive means utc as everywhere else in the bar code
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            return (value - EPOCH).total_seconds()
+        return value.timestamp()
+    return float(value)
+
+
+def aggregate_trades(time, price, volume, bar_span=datetime.timedelta(minutes=1), ticker=None):
+    # type: (np.ndarray, np.ndarray, np.ndarray, datetime.timedelta, Optional[str]) -> BarDataStorage
+    """
+    bars of one span from time sorted trades in a single vectorized pass, spans without trades get no bar
+    :param time: epoch seconds, may be fractional
+    """
+    time = np.asarray(time, dtype=np.float64)
+    price = np.asarray(price, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+
+    storage = BarDataStorage(ticker=ticker, bar_span=bar_span, capacity=1)
+    if len(time) == 0:
+        return storage
+
+    # day and week bars start on huobi's boundaries, not the epoch's
+    bar_starts = bar_start(np.floor(time), bar_span).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(bar_starts[1:] != bar_starts[:-1]) + 1))
+    stops = np.concatenate((starts[1:], [len(time)]))
+
+    storage.extend(
+        time=bar_starts[starts],
+        open_price=price[starts],
+        high_price=np.maximum.reduceat(price, starts),
+        low_price=np.minimum.reduceat(price, starts),
+        close_price=price[stops - 1],
+        volume=np.add.reduceat(volume, starts),
+        notional=np.add.reduceat(price * volume, starts)
+    )
+    return storage
+
+
+class BarAggregator(object):
+    """
+    builds bars of several spans at once from a stream of TradeData or TickData
+
+    finished bars are appended to storages[span] and passed to on_bar, the bar still being built for
+    every span is available from partial(). trades older than the open bar of a span are dropped for
+    that span and counted in late_count.
+    """
+
+    # start, open, high, low, close, volume, notional
+    _START, _OPEN, _HIGH, _LOW, _CLOSE, _VOLUME, _NOTIONAL = range(7)
+
+    def __init__(
+            self,
+            ticker,  # type: str
+            bar_spans=(datetime.timedelta(seconds=1), datetime.timedelta(minutes=1)),  # type: Sequence[datetime.timedelta]
+            on_bar=None  # type: Optional[Callable[[BarData], None]]
+    ):
+        for bar_span in bar_spans:
+            assert bar_span.total_seconds() >= 1 and bar_span.total_seconds() % 1 == 0, \
+                'bar spans must be whole seconds'
+
+        self.ticker = ticker
+        self.bar_spans = list(bar_spans)
+        self.on_bar = on_bar
+        self.late_count = 0
+
+        self.storages = {
+            bar_span: BarDataStorage(ticker=ticker, bar_span=bar_span) for bar_span in self.bar_spans
+        }  # type: Dict[datetime.timedelta, BarDataStorage]
+        self._spans = [int(bar_span.total_seconds()) for bar_span in self.bar_spans]
+        # bar_start's offsets looked up once, update runs per trade
+        self._offsets = [bar_offset(bar_span) for bar_span in self.bar_spans]
+        self._bars = [None] * len(self.bar_spans)  # type: List[Optional[list]]
+        self._last_total_volume = None  # type: Optional[float]
+        self._last_total_notional = None  # type: Optional[float]
+
+    def _finish(self, i):
+        bar = self._bars[i]
+        self._bars[i] = None
+        self.storages[self.bar_spans[i]].append(
+            bar[self._START], bar[self._OPEN], bar[self._HIGH], bar[self._LOW], bar[self._CLOSE],
+            bar[self._VOLUME], bar[self._NOTIONAL]
+        )
+        if self.on_bar is not None:
+            self.on_bar(self._to_bar_data(i, bar))
+
+    def _to_bar_data(self, i, bar):
+        return BarData(
+            ticker=self.ticker,
+            high_price=bar[self._HIGH],
+            low_price=bar[self._LOW],
+            open_price=bar[self._OPEN],
+            close_price=bar[self._CLOSE],
+            bar_start_time=from_epoch(bar[self._START]),
+            bar_span=self.bar_spans[i],
+            volume=bar[self._VOLUME],
+            notional=bar[self._NOTIONAL]
+        )
+
+    def update(self, time, price, volume, notional=None):
+        # type: (float, float, float, Optional[float]) -> None
+        """
+        add one trade, time in epoch seconds
+        """
+        if notional is None:
+            notional = price * volume
+
+        for i, span in enumerate(self._spans):
+            offset = self._offsets[i]
+            start = int((time - offset) // span * span + offset)
+            bar = self._bars[i]
+
+            if bar is not None and start != bar[self._START]:
+                if start < bar[self._START]:
+                    self.late_count += 1
+                    continue
+                self._finish(i)
+                bar = None
+
+            if bar is None:
+                self._bars[i] = [start, price, price, price, price, volume, notional]
+            else:
+                if price > bar[self._HIGH]:
+                    bar[self._HIGH] = price
+                if price < bar[self._LOW]:
+                    bar[self._LOW] = price
+                bar[self._CLOSE] = price
+                bar[self._VOLUME] += volume
+                bar[self._NOTIONAL] += notional
+
+    def on_trade(self, trade_data):
+        # type: (TradeData) -> None
+        self.update(_seconds(trade_data.trade_time), trade_data.price, trade_data.volume)
+
+    def on_tick(self, tick_data):
+        # type: (TickData) -> None
+        """
+        ticks carry running totals, the volume of a tick is the change since the previous one
+        """
+        volume, notional = 0.0, 0.0
+        if self._last_total_volume is not None:
+            volume = tick_data.total_volume - self._last_total_volume
+            notional = tick_data.total_notional - self._last_total_notional
+        self._last_total_volume = tick_data.total_volume
+        self._last_total_notional = tick_data.total_notional
+
+        self.update(_seconds(tick_data.time), tick_data.last_price, volume, notional)
+
+    def on_trades(self, time, price, volume):
+        # type: (np.ndarray, np.ndarray, np.ndarray) -> None
+        """
+        batched update from time sorted arrays, e.g. replaying a historical trade file
+        :param time: epoch seconds, may be fractional
+        """
+        time = np.asarray(time, dtype=np.float64)
+        price = np.asarray(price, dtype=np.float64)
+        volume = np.asarray(volume, dtype=np.float64)
+        if len(time) == 0:
+            return
+
+        for i, bar_span in enumerate(self.bar_spans):
+            span = self._spans[i]
+            bar = self._bars[i]
+            start = 0
+            if bar is not None:
+                # trades before the open bar are late, those inside it extend it one by one
+                start = int(np.searchsorted(time, bar[self._START], side='left'))
+                self.late_count += start
+                stop = int(np.searchsorted(time, bar[self._START] + span, side='left'))
+                if stop > start:
+                    chunk_price = price[start:stop]
+                    bar[self._HIGH] = max(bar[self._HIGH], float(chunk_price.max()))
+                    bar[self._LOW] = min(bar[self._LOW], float(chunk_price.min()))
+                    bar[self._CLOSE] = float(chunk_price[-1])
+                    bar[self._VOLUME] += float(volume[start:stop].sum())
+                    bar[self._NOTIONAL] += float((chunk_price * volume[start:stop]).sum())
+                start = stop
+                if start == len(time):
+                    continue
+                self._finish(i)
+
+            bars = aggregate_trades(time[start:], price[start:], volume[start:], bar_span, self.ticker)
+            # everything but the last bar is finished, the last one stays open
+            finished = bars[:-1]
+            if len(finished):
+                self.storages[bar_span].merge(finished)
+                if self.on_bar is not None:
+                    for bar_data in finished:
+                        self.on_bar(bar_data)
+
+            last = bars.bar(-1)
+            self._bars[i] = [
+                int(bars.time[-1]), last.open_price, last.high_price, last.low_price, last.close_price,
+                last.volume, last.notional
+            ]
+
+    def partial(self, bar_span):
+        # type: (datetime.timedelta) -> Optional[BarData]
+        """
+        the bar of this span still being built, None before the first trade
+        """
+        i = self.bar_spans.index(bar_span)
+        bar = self._bars[i]
+        return None if bar is None else self._to_bar_data(i, list(bar))
+
+    def flush(self):
+        """
+        finish every open bar, e.g. at the end of a replay
+        """
+        for i, bar in enumerate(self._bars):
+            if bar is not None:
+                self._finish(i)
@@ -0,0 +1,345 @@
+import datetime
+import json
+import os
+import struct
+import zlib
+import threading
+from typing import Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from BarStorage import BarDataStorage, PERIOD_SPANS, period_name, to_epoch
+from BlockFile import BlockReader, encode_ticker, read_blocks, write_blocks
+
+MAGIC = b'HBAR'
+VERSION = 1
+
+# fixed width, little endian records, 56 bytes per bar
+RECORD_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('notional', '<f8')
+])
+
+# magic, version, record size, bar span in seconds, record count, first time, last time, ticker
+HEADER_FORMAT = '<4sHHIQqq16s'
+HEADER_SIZE = 64
+
+INDEX_FILE = 'index.json'
+PARTITIONS = ('day', 'month')
+
+
+class BarArchiveError(Exception):
+    pass
+
+
+def write_partition(file_path, ticker, bar_span, records):
+    # type: (str, str, datetime.timedelta, np.ndarray) -> str
+    """
+    :return: crc32 of the file as 8 hex digits
+    """
+    header = struct.pack(
+        HEADER_FORMAT,
+        MAGIC,
+        VERSION,
+        RECORD_DTYPE.itemsize,
+        int(bar_span.total_seconds()),
+        len(records),
+        int(records['time'][0]) if len(records) else 0,
+        int(records['time'][-1]) if len(records) else 0,
+        encode_ticker(ticker)
+    ).ljust(HEADER_SIZE, b'\0')
+
+    body = np.ascontiguousarray(records, dtype=RECORD_DTYPE).tobytes()
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+    os.replace(temp_path, file_path)
+    return '{:08x}'.format(zlib.crc32(body, zlib.crc32(header)))
+
+
+def read_header(file_path):
+    # type: (str) -> Dict
+    with open(file_path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+
+    if len(raw) != HEADER_SIZE:
+        raise BarArchiveError('truncated header in ' + file_path)
+
+    magic, version, record_size, span, count, first, last, ticker = struct.unpack_from(HEADER_FORMAT, raw)
+
+    if magic != MAGIC:
+        raise BarArchiveError(file_path + ' is not a bar archive')
+    if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise BarArchiveError('unsupported archive version {} in {}'.format(version, file_path))
+
+    return {
+        'ticker': ticker.rstrip(b'\0').decode('ascii'),
+        'bar_span': datetime.timedelta(seconds=span),
+        'count': count,
+        'first': first,
+        'last': last
+    }
+
+
+def open_partition(file_path):
+    # type: (str) -> np.ndarray
+    """
+    memory map the records of one partition file read only, nothing is read until it is touched
+    """
+    header = read_header(file_path)
+    if header['count'] == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(file_path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(header['count'],))
+
+
+class BarArchive(object):
+    """
+    binary bar archive, one file of fixed width records per ticker, period and day or month
+
+    with block_rows set the files are block compressed instead, see BlockFile: about a fifth of the size
+    for 1min bars, reads decompress the blocks a range touches on a thread pool.
+
+    layout is <root>/<ticker>/<period>/<YYYYMMDD|YYYYMM>.bar (.bbar when block compressed) plus an
+    index.json holding the time range,
+    record count and crc32 of every file, so readers only open the partitions a query overlaps. partitions
+    never overlap in time, the overlapping ones are found by bisecting their first and last times and
+    the rows within a partition by bisecting its time column.
+    """
+
+    def __init__(
+            self,
+            root,  # type: str
+            ticker,  # type: str
+            period='1min',  # type: str
+            partition=None,  # type: Optional[str]
+            block_rows=None  # type: Optional[int]
+    ):
+        """
+        :param partition: 'day' or 'month', None for what an existing archive was written with or day
+        :param block_rows: rows per compressed block, None for what an existing archive was written with
+            or fixed width records. asking an existing archive for another partition or block_rows
+            raises BarArchiveError
+        """
+        assert partition is None or partition in PARTITIONS, 'partition must be one of ' + str(PARTITIONS)
+        encode_ticker(ticker)
+
+        self.root = root
+        self.ticker = ticker
+        self.period = period
+        self.directory = os.path.join(root, ticker, period)
+        self.index = self._load_index()  # type: Dict
+        self._bounds = None  # type: Optional[Tuple[List[str], np.ndarray, np.ndarray]]
+
+        if self.index['partitions']:
+            # an existing archive keeps the layout it was written with
+            if partition is not None and partition != self.index['partition']:
+                raise BarArchiveError('{} is partitioned by {}, not {}'.format(
+                    self.directory, self.index['partition'], partition))
+            if block_rows is not None and block_rows != self.index.get('block_rows'):
+                raise BarArchiveError('{} has block_rows {}, not {}'.format(
+                    self.directory, self.index.get('block_rows'), block_rows))
+            partition = self.index['partition']
+            block_rows = self.index.get('block_rows')
+        self.partition = partition or 'day'
+        self.index['partition'] = self.partition
+        self.block_rows = block_rows
+        self.index['block_rows'] = block_rows
+
+    @property
+    def bar_span(self):
+        # type: () -> datetime.timedelta
+        return PERIOD_SPANS.get(self.period, datetime.timedelta(seconds=self.index.get('span', 60)))
+
+    def _load_index(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                return json.load(f)
+        return {'ticker': self.ticker, 'period': self.period, 'partition': None, 'partitions': {}}
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(index_path + '.tmp', index_path)
+
+    def _partition_keys(self, time):
+        # type: (np.ndarray) -> np.ndarray
+        unit = 'D' if self.partition == 'day' else 'M'
+        return time.astype('datetime64[s]').astype('datetime64[' + unit + ']')
+
+    def _file_name(self, key):
+        # type: (np.datetime64) -> str
+        fmt = '%Y%m%d' if self.partition == 'day' else '%Y%m'
+        return key.astype(datetime.date).strftime(fmt) + ('.bar' if self.block_rows is None else '.bbar')
+
+    def records(self, file_name, start=None, end=None):
+        # type: (str, Optional[int], Optional[int]) -> np.ndarray
+        """
+        records of one partition with start <= time < end epoch seconds, memory mapped for fixed width
+        files, decompressed for block compressed ones
+        """
+        file_path = os.path.join(self.directory, file_name)
+        if self.block_rows is not None:
+            return BlockReader(file_path, RECORD_DTYPE).read(start, end)
+        records = open_partition(file_path)
+        lo = 0 if start is None else int(np.searchsorted(records['time'], start, side='left'))
+        hi = len(records) if end is None else int(np.searchsorted(records['time'], end, side='left'))
+        return records[lo:hi]
+
+    def _partition_bounds(self):
+        # type: () -> Tuple[List[str], np.ndarray, np.ndarray]
+        """
+        file names in time order with their first and last times, rebuilt after a write
+        """
+        if self._bounds is None:
+            partitions = self.index['partitions']
+            names = sorted(partitions, key=lambda file_name: partitions[file_name]['first'])
+            self._bounds = (
+                names,
+                np.array([partitions[file_name]['first'] for file_name in names], dtype=np.int64),
+                np.array([partitions[file_name]['last'] for file_name in names], dtype=np.int64)
+            )
+        return self._bounds
+
+    def partitions(self, start=None, end=None):
+        # type: (Optional[datetime.datetime], Optional[datetime.datetime]) -> List[str]
+        """
+        file names of the partitions holding bars with start <= time < end in time order, all by default
+        """
+        names, firsts, lasts = self._partition_bounds()
+        lo = 0 if start is None else int(np.searchsorted(lasts, to_epoch(start), side='left'))
+        hi = len(names) if end is None else int(np.searchsorted(firsts, to_epoch(end), side='left'))
+        return names[lo:hi]
+
+    def write(self, storage):
+        # type: (BarDataStorage) -> List[str]
+        """
+        write the storage into its partitions, rows already archived for the same time are replaced
+        :return: paths of the partition files written
+        """
+        if not len(storage):
+            return []
+
+        records = np.empty(len(storage), dtype=RECORD_DTYPE)
+        for name in RECORD_DTYPE.names:
+            records[name] = storage.column(name)
+
+        keys = self._partition_keys(records['time'])
+        # storage is sorted so partitions are contiguous runs
+        bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = np.concatenate(([0], bounds))
+        stops = np.concatenate((bounds, [len(records)]))
+
+        os.makedirs(self.directory, exist_ok=True)
+        written = []
+        for start, stop in zip(starts, stops):
+            file_name = self._file_name(keys[start])
+            file_path = os.path.join(self.directory, file_name)
+            chunk = records[start:stop]
+
+            if file_name in self.index['partitions'] and os.path.exists(file_path):
+                merged = BarDataStorage(ticker=self.ticker, bar_span=storage.bar_span)
+                existing = self.records(file_name)
+                merged.extend(*(existing[name] for name in RECORD_DTYPE.names))
+                merged.extend(*(chunk[name] for name in RECORD_DTYPE.names))
+                chunk = np.empty(len(merged), dtype=RECORD_DTYPE)
+                for name in RECORD_DTYPE.names:
+                    chunk[name] = merged.column(name)
+                del existing
+
+            if self.block_rows is None:
+                checksum = write_partition(file_path, self.ticker, storage.bar_span, chunk)
+            else:
+                checksum = write_blocks(file_path, self.ticker, storage.bar_span, chunk, self.block_rows)
+            self.index['partitions'][file_name] = {
+                'first': int(chunk['time'][0]),
+                'last': int(chunk['time'][-1]),
+                'count': len(chunk),
+                'crc32': checksum
+            }
+            written.append(file_path)
+
+        self._bounds = None
+        self.index['span'] = int(storage.bar_span.total_seconds())
+        self._save_index()
+        return written
+
+    def read(self, start=None, end=None, exclude=(), threads=True):
+        # type: (Optional[datetime.datetime], Optional[datetime.datetime], Collection[str], bool) -> List[np.ndarray]
+        """
+        records with start <= time < end as one memory mapped view per partition, no data is copied. a
+        block compressed archive decompresses only the blocks overlapping the range instead
+        :param exclude: partition file names to leave out, e.g. ones that failed Integrity.verify_archive
+        :param threads: decompress blocks on BlockFile.decode_pool()
+        """
+        start = None if start is None else to_epoch(start)
+        end = None if end is None else to_epoch(end)
+        file_names = [file_name for file_name in self.partitions(start, end) if file_name not in exclude]
+
+        if self.block_rows is not None:
+            readers = [
+                (BlockReader(os.path.join(self.directory, file_name), RECORD_DTYPE), start, end)
+                for file_name in file_names
+            ]
+            return [records for records in read_blocks(readers, threads) if len(records)]
+
+        views = []
+        for file_name in file_names:
+            meta = self.index['partitions'][file_name]
+            records = open_partition(os.path.join(self.directory, file_name))
+            # only the partitions at either end of the range are cut, and only they have their times read
+            lo = 0 if start is None or meta['first'] >= start else \
+                int(np.searchsorted(records['time'], start, side='left'))
+            hi = len(records) if end is None or meta['last'] < end else \
+                int(np.searchsorted(records['time'], end, side='left'))
+            if hi > lo:
+                views.append(records[lo:hi])
+
+        return views
+
+    def load(self, start=None, end=None, exclude=(), threads=True):
+        # type: (Optional[datetime.datetime], Optional[datetime.datetime], Collection[str], bool) -> BarDataStorage
+        views = self.read(start, end, exclude, threads)
+        storage = BarDataStorage(
+            ticker=self.ticker,
+            bar_span=self.bar_span,
+            capacity=max(sum(len(view) for view in views), 1)
+        )
+        for view in views:
+            storage.extend(*(view[name] for name in RECORD_DTYPE.names))
+        return storage
+
+    @classmethod
+    def for_storage(cls, root, storage, partition=None, block_rows=None):
+        # type: (str, BarDataStorage, Optional[str], Optional[int]) -> BarArchive
+        return cls(root, storage.ticker, period_name(storage.bar_span), partition, block_rows)
+
+
+_archives = {}  # type: Dict[str, Tuple[Optional[int], BarArchive]]
+_archives_lock = threading.Lock()
+
+
+def open_archive(root, ticker, period='1min'):
+    # type: (str, str, str) -> BarArchive
+    """
+    BarArchive kept between calls, its index.json is only parsed again after it changed on disk, so
+    many small queries over a long history do not each pay for reading the index of every partition
+    """
+    directory = os.path.abspath(os.path.join(root, ticker, period))
+    index_path = os.path.join(directory, INDEX_FILE)
+    mtime = os.stat(index_path).st_mtime_ns if os.path.exists(index_path) else None
+    with _archives_lock:
+        cached = _archives.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        archive = BarArchive(root, ticker, period)
+        _archives[directory] = (mtime, archive)
+        return archive
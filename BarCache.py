@@ -0,0 +1,148 @@
+import datetime
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from BarArchive import BarArchive
+from BarStorage import BarDataStorage, PERIOD_SPANS, bar_start
+
+COVERAGE_FILE = 'coverage.json'
+
+Interval = Tuple[int, int]
+
+
+def merge_intervals(intervals):
+    # type: (Iterable[Interval]) -> List[Interval]
+    """
+    union of half open [start, end) epoch second intervals, sorted and non overlapping
+    """
+    merged = []  # type: List[List[int]]
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_intervals(start, end, covered):
+    # type: (int, int, List[Interval]) -> List[Interval]
+    """
+    parts of [start, end) not in the merged intervals covered
+    """
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in covered:
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def epoch_windows(start, end, request_size=300, bar_span=datetime.timedelta(minutes=1)):
+    # type: (int, int, int, datetime.timedelta) -> List[Interval]
+    """
+    (from, to) kline requests of at most request_size bars for every bar starting in [start, end), from
+    and to are bar starts, so day and week windows start where huobi's bars do
+    """
+    span = int(bar_span.total_seconds())
+    first = bar_start(start + span - 1, bar_span)
+    last = bar_start(end - 1, bar_span)
+    windows = []
+    while first <= last:
+        to = min(first + span * (request_size - 1), last)
+        windows.append((first, to))
+        first = to + span
+    return windows
+
+
+class BarCache(object):
+    """
+    local bar cache on top of BarArchive that remembers which time ranges have already been fetched
+
+    the coverage index is a list of merged [start, end) epoch second intervals per ticker and period,
+    kept in coverage.json next to the archive partitions. a range that was fetched but had no trades
+    is covered all the same, so it is never asked for again.
+    """
+
+    def __init__(self, root, partition=None):
+        # type: (str, Optional[str]) -> None
+        self.root = root
+        self.partition = partition
+        self._coverage = {}  # type: Dict[Tuple[str, str], List[Interval]]
+
+    def _coverage_path(self, ticker, period):
+        # type: (str, str) -> str
+        return os.path.join(self.root, ticker, period, COVERAGE_FILE)
+
+    def archive(self, ticker, period):
+        # type: (str, str) -> BarArchive
+        return BarArchive(self.root, ticker, period, self.partition)
+
+    def coverage(self, ticker, period):
+        # type: (str, str) -> List[Interval]
+        key = (ticker, period)
+        if key not in self._coverage:
+            path = self._coverage_path(ticker, period)
+            intervals = []
+            if os.path.exists(path):
+                with open(path) as f:
+                    intervals = [tuple(interval) for interval in json.load(f)['intervals']]
+            self._coverage[key] = merge_intervals(intervals)
+        return self._coverage[key]
+
+    def missing(self, ticker, period, start, end):
+        # type: (str, str, int, int) -> List[Interval]
+        """
+        [start, end) epoch second ranges not fetched yet
+        """
+        return subtract_intervals(start, end, self.coverage(ticker, period))
+
+    def gap_windows(self, ticker, period, start, end, request_size=300):
+        # type: (str, str, int, int, int) -> List[Interval]
+        """
+        the minimal kline requests, at most request_size bars each, that fill every gap of [start, end)
+        """
+        windows = []
+        for gap_start, gap_end in self.missing(ticker, period, start, end):
+            windows += epoch_windows(gap_start, gap_end, request_size, PERIOD_SPANS[period])
+        return windows
+
+    def mark_covered(self, ticker, period, intervals):
+        # type: (str, str, Iterable[Interval]) -> None
+        """
+        record [start, end) ranges as fetched, bars that have not closed yet are left out
+        """
+        closed = bar_start(int(time.time()), PERIOD_SPANS[period])
+        intervals = [(start, min(end, closed)) for start, end in intervals]
+
+        coverage = merge_intervals(self.coverage(ticker, period) + intervals)
+        self._coverage[(ticker, period)] = coverage
+
+        path = self._coverage_path(ticker, period)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'ticker': ticker, 'period': period, 'intervals': coverage}, f)
+        os.replace(path + '.tmp', path)
+
+    def store(self, storage, period, intervals):
+        # type: (BarDataStorage, str, Iterable[Interval]) -> None
+        """
+        merge the bars into the archive in place, then mark intervals as covered
+        """
+        if len(storage):
+            self.archive(storage.ticker, period).write(storage)
+        self.mark_covered(storage.ticker, period, intervals)
+
+    def load(self, ticker, period, start=None, end=None):
+        # type: (str, str, Optional[int], Optional[int]) -> BarDataStorage
+        return self.archive(ticker, period).load(start, end)
@@ -0,0 +1,154 @@
+import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from BarArchive import BarArchive
+from BarStorage import BarDataStorage, PERIOD_SPANS, bar_start, period_name, to_epoch
+
+PYRAMID_PERIODS = ('5min', '15min', '60min', '1day')
+
+
+def resample(storage, bar_span, start=None):
+    # type: (BarDataStorage, datetime.timedelta, Optional[int]) -> BarDataStorage
+    """
+    coarser bars from finer ones in one vectorized pass, bar_span must be a multiple of the storage span.
+    bars start where huobi's do, days at midnight UTC+8 (see BarStorage.bar_start), so resampled and
+    downloaded bars of a period share their start times
+    :param start: only resample bars at or after this epoch second
+    """
+    span = int(bar_span.total_seconds())
+    assert span % int(storage.bar_span.total_seconds()) == 0, 'can only resample to a multiple of the bar span'
+
+    time = storage.time
+    first = 0 if start is None else int(np.searchsorted(time, start, side='left'))
+    time = time[first:]
+
+    coarse = BarDataStorage(ticker=storage.ticker, bar_span=bar_span, capacity=1)
+    if len(time) == 0:
+        return coarse
+
+    bucket = bar_start(time, bar_span)
+    starts = np.concatenate(([0], np.flatnonzero(bucket[1:] != bucket[:-1]) + 1))
+    stops = np.concatenate((starts[1:], [len(time)]))
+
+    coarse.extend(
+        time=bucket[starts],
+        open_price=storage.open_price[first:][starts],
+        high_price=np.maximum.reduceat(storage.high_price[first:], starts),
+        low_price=np.minimum.reduceat(storage.low_price[first:], starts),
+        close_price=storage.close_price[first:][stops - 1],
+        volume=np.add.reduceat(storage.volume[first:], starts),
+        notional=np.add.reduceat(storage.notional[first:], starts)
+    )
+    return coarse
+
+
+class BarPyramid(object):
+    """
+    the same bars at several resolutions, every level resampled from the one below it
+
+    queries are answered from the level of the requested period alone. update() folds new base bars in
+    and only recomputes the coarse bars they fall into.
+    """
+
+    def __init__(self, base, periods=PYRAMID_PERIODS, levels=None):
+        # type: (BarDataStorage, Sequence[str], Optional[Dict[str, BarDataStorage]]) -> None
+        """
+        :param levels: already built levels by period, e.g. loaded from an archive, the rest are resampled
+        """
+        self.base_period = period_name(base.bar_span)
+        self.periods = sorted(set(periods) - {self.base_period}, key=lambda period: PERIOD_SPANS[period])
+        for period in self.periods:
+            assert period in PERIOD_SPANS, 'unsupported period ' + period
+
+        self.levels = {self.base_period: base}  # type: Dict[str, BarDataStorage]
+        for period in self.periods:
+            if levels is not None and period in levels:
+                self.levels[period] = levels[period]
+            else:
+                self.levels[period] = resample(self.levels[self._source(period)], PERIOD_SPANS[period])
+
+    @property
+    def ticker(self):
+        # type: () -> str
+        return self.levels[self.base_period].ticker
+
+    def _chain(self):
+        # type: () -> List[str]
+        return [self.base_period] + self.periods
+
+    def _source(self, period):
+        # type: (str) -> str
+        """
+        finest level below period whose span divides it, e.g. 1day from 60min but 15min from 5min
+        """
+        chain = self._chain()
+        span = PERIOD_SPANS[period]
+        for lower in reversed(chain[:chain.index(period)]):
+            if span % PERIOD_SPANS[lower] == datetime.timedelta(0):
+                return lower
+        return self.base_period
+
+    def build(self):
+        for period in self.periods:
+            self.levels[period] = resample(self.levels[self._source(period)], PERIOD_SPANS[period])
+
+    def update(self, new_bars):
+        # type: (BarDataStorage) -> None
+        """
+        merge new base period bars and refresh the coarse bars they touch
+        """
+        if not len(new_bars):
+            return
+
+        self.levels[self.base_period].merge(new_bars)
+        changed_from = int(new_bars.time[0])
+        for period in self.periods:
+            bucket_start = bar_start(changed_from, PERIOD_SPANS[period])
+            # same bar start times, so the storage's last write wins replaces the stale bars
+            self.levels[period].merge(
+                resample(self.levels[self._source(period)], PERIOD_SPANS[period], start=bucket_start)
+            )
+
+    def query(self, start=None, end=None, period='1min'):
+        # type: (Optional[datetime.datetime], Optional[datetime.datetime], str) -> BarDataStorage
+        """
+        bars of one period with start <= bar_start_time < end, views into the level, nothing is resampled
+        """
+        if period not in self.levels:
+            raise KeyError('no {} level in this pyramid, levels are {}'.format(period, self._chain()))
+        return self.levels[period].slice(start, end)
+
+    def to_archive(self, root, partition=None):
+        # type: (str, Optional[str]) -> List[str]
+        """
+        write every level into the archive next to the base bars, one period directory per level
+        :param partition: None keeps what levels already archived use and partitions new ones by month
+        """
+        written = []
+        for period, storage in self.levels.items():
+            archive = BarArchive(root, self.ticker, period, partition)
+            if partition is None and not archive.partitions():
+                archive = BarArchive(root, self.ticker, period, 'month')
+            written += archive.write(storage)
+        return written
+
+    @classmethod
+    def from_archive(cls, root, ticker, start=None, end=None, base_period='1min', periods=PYRAMID_PERIODS):
+        # type: (str, str, Optional[datetime.datetime], Optional[datetime.datetime], str, Sequence[str]) -> BarPyramid
+        """
+        load archived levels instead of resampling them, levels missing from the archive are built
+        """
+        base = BarArchive(root, ticker, base_period).load(start, end)
+
+        levels = {}
+        for period in periods:
+            archive = BarArchive(root, ticker, period)
+            if period != base_period and archive.partitions():
+                # the range may start mid bar of a coarse level, take that whole bar
+                level_start = None
+                if start is not None:
+                    level_start = bar_start(to_epoch(start), PERIOD_SPANS[period])
+                levels[period] = archive.load(level_start, end)
+        return cls(base, periods, levels)
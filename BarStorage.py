@@ -0,0 +1,346 @@
+import datetime
+import threading
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+
+from DataStructure import BarData
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# huobi kline periods, 1mon and 1year are left out since they have no fixed span
+PERIOD_SPANS = {
+    '1min': datetime.timedelta(minutes=1),
+    '5min': datetime.timedelta(minutes=5),
+    '15min': datetime.timedelta(minutes=15),
+    '30min': datetime.timedelta(minutes=30),
+    '60min': datetime.timedelta(hours=1),
+    '4hour': datetime.timedelta(hours=4),
+    '1day': datetime.timedelta(days=1),
+    '1week': datetime.timedelta(weeks=1)
+}
+
+# huobi starts days at midnight beijing time (utc+8) and weeks on monday at that midnight, not on the
+# epoch's utc midnight and thursday. the intraday spans divide 8 hours so they line up with the epoch
+EXCHANGE_UTC_OFFSET = datetime.timedelta(hours=8)
+# epoch second of a bar start modulo the span, by period
+PERIOD_OFFSETS = {
+    '1day': -int(EXCHANGE_UTC_OFFSET.total_seconds()) % 86400,
+    # the first monday after the epoch is 1970-01-05
+    '1week': (4 * 86400 - int(EXCHANGE_UTC_OFFSET.total_seconds())) % (7 * 86400)
+}
+
+
+def period_name(bar_span):
+    # type: (datetime.timedelta) -> str
+    for name, span in PERIOD_SPANS.items():
+        if span == bar_span:
+            return name
+    return str(int(bar_span.total_seconds())) + 's'
+
+
+def bar_offset(bar_span):
+    # type: (datetime.timedelta) -> int
+    """
+    where bars of this span start, as epoch seconds modulo the span
+    """
+    return PERIOD_OFFSETS.get(period_name(bar_span), 0)
+
+
+def bar_start(time, bar_span):
+    # type: (Union[int, np.ndarray], datetime.timedelta) -> Union[int, np.ndarray]
+    """
+    start of the bar of this span that epoch second time falls into, for an int or an array of them
+    """
+    span = int(bar_span.total_seconds())
+    offset = bar_offset(bar_span)
+    return (time - offset) // span * span + offset
+
+
+def to_epoch(value):
+    # type: (Union[datetime.datetime, datetime.date, int, float]) -> int
+    """
+    convert a bar time to epoch seconds, naive datetime is taken as utc like utcfromtimestamp
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            return int((value - EPOCH).total_seconds())
+        return int(value.timestamp())
+    if isinstance(value, datetime.date):
+        return int((datetime.datetime.combine(value, datetime.time()) - EPOCH).total_seconds())
+    return int(value)
+
+
+def from_epoch(value):
+    # type: (int) -> datetime.datetime
+    return EPOCH + datetime.timedelta(seconds=int(value))
+
+
+class BarDataStorage(object):
+    """
+    columnar bar container, one numpy array per field instead of one BarData object per bar
+
+    rows can be appended in any order, the storage is sorted by time and de-duplicated
+    (last write wins, like the dict it replaces) lazily on the first read after a write.
+    replaced_count counts the rows a later write for the same time has replaced.
+    """
+
+    COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume', 'notional')
+
+    def __init__(
+            self,
+            ticker=None,  # type: Optional[str]
+            bar_span=datetime.timedelta(minutes=1),  # type: datetime.timedelta
+            capacity=1024  # type: int
+    ):
+        self.ticker = ticker
+        self.bar_span = bar_span
+
+        self._lock = threading.RLock()
+        self._size = 0
+        self._consolidated = True
+        self.replaced_count = 0
+        self._columns = {
+            name: np.empty(capacity, dtype=np.int64 if name == 'time' else np.float64) for name in self.COLUMNS
+        }
+
+    @classmethod
+    def from_arrays(cls, ticker, bar_span, time, open_price, high_price, low_price, close_price, volume, notional):
+        storage = cls(ticker=ticker, bar_span=bar_span, capacity=max(len(time), 1))
+        storage.extend(time, open_price, high_price, low_price, close_price, volume, notional)
+        return storage
+
+    def _reserve(self, count):
+        # type: (int) -> None
+        capacity = len(self._columns['time'])
+        if self._size + count <= capacity:
+            return
+
+        while capacity < self._size + count:
+            capacity = max(capacity * 2, 1024)
+
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def _consolidate(self):
+        if self._consolidated:
+            return
+
+        time = self._columns['time'][:self._size]
+        order = np.argsort(time, kind='stable')
+        time = time[order]
+        # keep the last row of every run of equal timestamps
+        keep = np.ones(len(time), dtype=bool)
+        keep[:-1] = time[1:] != time[:-1]
+        order = order[keep]
+
+        # fresh arrays rather than in place, a slice view must never write into its parent
+        for name, column in list(self._columns.items()):
+            self._columns[name] = column[:self._size][order]
+
+        self.replaced_count += self._size - len(order)
+        self._size = len(order)
+        self._consolidated = True
+
+    def append(self, bar_start_time, open_price, high_price, low_price, close_price, volume, notional):
+        with self._lock:
+            self._reserve(1)
+            time = to_epoch(bar_start_time)
+            i = self._size
+            if i and time <= self._columns['time'][i - 1]:
+                self._consolidated = False
+            self._columns['time'][i] = time
+            self._columns['open'][i] = open_price
+            self._columns['high'][i] = high_price
+            self._columns['low'][i] = low_price
+            self._columns['close'][i] = close_price
+            self._columns['volume'][i] = volume
+            self._columns['notional'][i] = notional
+            self._size += 1
+
+    def append_bar(self, bar_data):
+        # type: (BarData) -> None
+        self.append(
+            bar_data.bar_start_time,
+            bar_data.open_price,
+            bar_data.high_price,
+            bar_data.low_price,
+            bar_data.close_price,
+            bar_data.volume,
+            bar_data.notional
+        )
+
+    def extend(self, time, open_price, high_price, low_price, close_price, volume, notional):
+        """
+        append many rows at once
+        :param time: epoch seconds, array like
+        """
+        time = np.asarray(time, dtype=np.int64)
+        count = len(time)
+        if count == 0:
+            return
+
+        with self._lock:
+            self._reserve(count)
+            start, stop = self._size, self._size + count
+            columns = self._columns
+            if (start and time[0] <= columns['time'][start - 1]) or (count > 1 and np.any(time[1:] <= time[:-1])):
+                self._consolidated = False
+            columns['time'][start:stop] = time
+            columns['open'][start:stop] = open_price
+            columns['high'][start:stop] = high_price
+            columns['low'][start:stop] = low_price
+            columns['close'][start:stop] = close_price
+            columns['volume'][start:stop] = volume
+            columns['notional'][start:stop] = notional
+            self._size = stop
+
+    def merge(self, other):
+        # type: (BarDataStorage) -> None
+        self.extend(*(other.column(name) for name in self.COLUMNS))
+
+    def column(self, name):
+        # type: (str) -> np.ndarray
+        """
+        sorted, de-duplicated view of one column, do not write into it
+        """
+        with self._lock:
+            self._consolidate()
+            return self._columns[name][:self._size]
+
+    @property
+    def time(self):
+        return self.column('time')
+
+    @property
+    def open_price(self):
+        return self.column('open')
+
+    @property
+    def high_price(self):
+        return self.column('high')
+
+    @property
+    def low_price(self):
+        return self.column('low')
+
+    @property
+    def close_price(self):
+        return self.column('close')
+
+    @property
+    def volume(self):
+        return self.column('volume')
+
+    @property
+    def notional(self):
+        return self.column('notional')
+
+    @property
+    def start_time(self):
+        # type: () -> Optional[datetime.datetime]
+        return from_epoch(self.time[0]) if len(self) else None
+
+    @property
+    def end_time(self):
+        # type: () -> Optional[datetime.datetime]
+        return from_epoch(self.time[-1]) if len(self) else None
+
+    def __len__(self):
+        with self._lock:
+            self._consolidate()
+            return self._size
+
+    def bar(self, i):
+        # type: (int) -> BarData
+        with self._lock:
+            self._consolidate()
+            if i < 0:
+                i += self._size
+            if not 0 <= i < self._size:
+                raise IndexError('bar index out of range')
+            columns = self._columns
+            return BarData(
+                ticker=self.ticker,
+                high_price=float(columns['high'][i]),
+                low_price=float(columns['low'][i]),
+                open_price=float(columns['open'][i]),
+                close_price=float(columns['close'][i]),
+                bar_start_time=from_epoch(columns['time'][i]),
+                bar_span=self.bar_span,
+                volume=float(columns['volume'][i]),
+                notional=float(columns['notional'][i])
+            )
+
+    def index_of(self, bar_start_time):
+        # type: (Union[datetime.datetime, int]) -> int
+        """
+        :return: row of the bar starting at bar_start_time, -1 if there is none
+        """
+        time = self.time
+        epoch = to_epoch(bar_start_time)
+        i = int(np.searchsorted(time, epoch))
+        return i if i < len(time) and time[i] == epoch else -1
+
+    def get(self, bar_start_time, default=None):
+        # type: (Union[datetime.datetime, int], Optional[BarData]) -> Optional[BarData]
+        i = self.index_of(bar_start_time)
+        return self.bar(i) if i >= 0 else default
+
+    def __contains__(self, bar_start_time):
+        return self.index_of(bar_start_time) >= 0
+
+    def slice(self, start=None, end=None):
+        # type: (Optional[datetime.datetime], Optional[datetime.datetime]) -> BarDataStorage
+        """
+        bars with start <= bar_start_time < end, backed by views of this storage
+        """
+        time = self.time
+        lo = 0 if start is None else int(np.searchsorted(time, to_epoch(start), side='left'))
+        hi = len(time) if end is None else int(np.searchsorted(time, to_epoch(end), side='left'))
+        return self[lo:hi]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            with self._lock:
+                self._consolidate()
+                view = BarDataStorage(ticker=self.ticker, bar_span=self.bar_span, capacity=0)
+                view._columns = {name: column[:self._size][item] for name, column in self._columns.items()}
+                view._size = len(view._columns['time'])
+                # a strided slice is still sorted, a reversed one is not
+                view._consolidated = item.step is None or item.step > 0
+                return view
+        if isinstance(item, (datetime.datetime, datetime.date)):
+            bar_data = self.get(item)
+            if bar_data is None:
+                raise KeyError(item)
+            return bar_data
+        return self.bar(int(item))
+
+    def bars(self):
+        # type: () -> List[BarData]
+        """
+        every bar as a BarData, built in bulk
+        """
+        with self._lock:
+            self._consolidate()
+            columns = {name: column[:self._size] for name, column in self._columns.items()}
+        return BarData.from_arrays(
+            self.ticker, self.bar_span, columns['time'], columns['open'], columns['high'], columns['low'],
+            columns['close'], columns['volume'], columns['notional']
+        )
+
+    def __iter__(self):
+        # type: () -> Iterator[BarData]
+        chunk = 4096
+        for start in range(0, len(self), chunk):
+            for bar_data in self[start:start + chunk].bars():
+                yield bar_data
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._consolidated = True
+            self.replaced_count = 0
@@ -0,0 +1,305 @@
+import concurrent.futures
+import datetime
+import os
+import struct
+import threading
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b'HBLK'
+VERSION = 1
+
+# magic, version, rows per block, bar span in seconds, record count, first time, last time,
+# offset of the block index, ticker
+HEADER_FORMAT = '<4sHIIQqqQ16s'
+HEADER_SIZE = 64
+# bytes of the ticker field, here and in BarArchive's header
+TICKER_SIZE = 16
+
+# one row per block, offset and size of its compressed bytes in the file
+BLOCK_INDEX_DTYPE = np.dtype([
+    ('first', '<i8'),
+    ('last', '<i8'),
+    ('offset', '<u8'),
+    ('size', '<u4'),
+    ('rows', '<u4')
+])
+
+DEFAULT_BLOCK_ROWS = 4096
+DEFAULT_LEVEL = 6
+
+# how a column of a block is encoded, one byte in front of it with a second for the decimal scale
+XOR = 0  # bits of every float xor the previous one's
+DELTA = 1  # integers as zigzag differences
+DECIMAL_DELTA = 2  # floats that are exact decimals, as DELTA of value * 10 ** scale
+MAX_SCALE = 8
+
+
+class BlockFileError(Exception):
+    pass
+
+
+def _shuffle(values):
+    # type: (np.ndarray) -> bytes
+    """
+    byte planes of 8 byte values one after the other, the mostly equal high bytes end up in long runs
+    """
+    return np.ascontiguousarray(values).view(np.uint8).reshape(len(values), 8).T.tobytes()
+
+
+def _unshuffle(raw, count):
+    # type: (bytes, int) -> np.ndarray
+    planes = np.frombuffer(raw, dtype=np.uint8).reshape(8, count)
+    values = np.empty((count, 8), dtype=np.uint8)
+    # plane by plane is faster than copying the transpose in one go
+    for i in range(8):
+        values[:, i] = planes[i]
+    return values.view('<u8').ravel()
+
+
+def _zigzag_delta(values):
+    # type: (np.ndarray) -> np.ndarray
+    delta = np.diff(values, prepend=np.int64(0))
+    return ((delta << 1) ^ (delta >> 63)).view('<u8')
+
+
+def _undo_zigzag_delta(encoded):
+    # type: (np.ndarray) -> np.ndarray
+    delta = (encoded >> np.uint64(1)).view('<i8') ^ -(encoded & np.uint64(1)).view('<i8')
+    return np.cumsum(delta)
+
+
+def _decimal_scale(column):
+    # type: (np.ndarray) -> Optional[int]
+    """
+    smallest scale that turns every value into an integer and back bit for bit, prices and amounts
+    quoted to a fixed number of decimals have one
+    """
+    if not np.all(np.isfinite(column)):
+        return None
+    for scale in range(MAX_SCALE + 1):
+        factor = 10.0 ** scale
+        scaled = np.rint(column * factor)
+        if np.abs(scaled).max(initial=0) >= 2 ** 53:
+            return None
+        # compared as bits through the integers decode_column sees, -0.0 would come back as 0.0
+        if np.array_equal((scaled.astype(np.int64) / factor).view('<u8'), column.view('<u8')):
+            return scale
+    return None
+
+
+def encode_column(column):
+    # type: (np.ndarray) -> bytes
+    column = np.ascontiguousarray(column)
+    scale = 0
+    if column.dtype.kind == 'i':
+        codec, encoded = DELTA, _zigzag_delta(column.astype(np.int64))
+    else:
+        scale = _decimal_scale(column)
+        if scale is not None:
+            codec, encoded = DECIMAL_DELTA, _zigzag_delta(np.rint(column * 10.0 ** scale).astype(np.int64))
+        else:
+            codec, scale = XOR, 0
+            bits = column.view('<u8')
+            encoded = bits ^ np.concatenate((np.zeros(1, dtype='<u8'), bits[:-1]))
+    return bytes((codec, scale)) + _shuffle(encoded)
+
+
+def decode_column(raw, count, dtype):
+    # type: (bytes, int, np.dtype) -> np.ndarray
+    codec, scale = raw[0], raw[1]
+    encoded = _unshuffle(raw[2:], count)
+    if codec == DELTA:
+        return _undo_zigzag_delta(encoded).astype(dtype)
+    if codec == DECIMAL_DELTA:
+        return _undo_zigzag_delta(encoded) / 10.0 ** scale
+    if codec == XOR:
+        return np.bitwise_xor.accumulate(encoded).view(dtype)
+    raise BlockFileError('unknown column codec {}'.format(codec))
+
+
+def encode_block(records):
+    # type: (np.ndarray) -> bytes
+    """
+    every column on its own: integers as deltas, floats as deltas of exact decimals when they are,
+    else as the xor of each value's bits with the previous one's. byte shuffled so the mostly zero
+    high bytes line up, write_blocks compresses the lot
+    """
+    return b''.join(encode_column(records[name]) for name in records.dtype.names)
+
+
+def decode_block(raw, count, dtype):
+    # type: (bytes, int, np.dtype) -> np.ndarray
+    records = np.empty(count, dtype=dtype)
+    width = 2 + count * 8
+    for i, name in enumerate(dtype.names):
+        records[name] = decode_column(raw[i * width:(i + 1) * width], count, dtype[name])
+    return records
+
+
+def encode_ticker(ticker):
+    # type: (str) -> bytes
+    """
+    the ticker as it goes into a file header, struct would cut a longer one off without a word
+    """
+    encoded = ticker.encode('ascii')
+    if len(encoded) > TICKER_SIZE:
+        raise ValueError('ticker {} is longer than {} bytes'.format(ticker, TICKER_SIZE))
+    return encoded
+
+
+def write_blocks(file_path, ticker, bar_span, records, block_rows=DEFAULT_BLOCK_ROWS, level=DEFAULT_LEVEL):
+    # type: (str, str, datetime.timedelta, np.ndarray, int, int) -> str
+    """
+    records sorted by time, cut into blocks of block_rows rows that are compressed on their own
+
+    layout is a 64 byte header, the blocks, then the block index with the time range, offset and size
+    of every block, so a reader finds the blocks of a time range without decompressing any other
+    :return: crc32 of the file as 8 hex digits
+    """
+    blocks = []
+    index = np.empty((len(records) + block_rows - 1) // block_rows, dtype=BLOCK_INDEX_DTYPE)
+    offset = HEADER_SIZE
+    for i, start in enumerate(range(0, len(records), block_rows)):
+        block = records[start:start + block_rows]
+        compressed = zlib.compress(encode_block(block), level)
+        index[i] = (block['time'][0], block['time'][-1], offset, len(compressed), len(block))
+        blocks.append(compressed)
+        offset += len(compressed)
+
+    header = struct.pack(
+        HEADER_FORMAT,
+        MAGIC,
+        VERSION,
+        block_rows,
+        int(bar_span.total_seconds()),
+        len(records),
+        int(records['time'][0]) if len(records) else 0,
+        int(records['time'][-1]) if len(records) else 0,
+        offset,
+        encode_ticker(ticker)
+    ).ljust(HEADER_SIZE, b'\0')
+
+    checksum = zlib.crc32(header)
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        for compressed in blocks:
+            f.write(compressed)
+            checksum = zlib.crc32(compressed, checksum)
+        f.write(index.tobytes())
+    os.replace(temp_path, file_path)
+    return '{:08x}'.format(zlib.crc32(index.tobytes(), checksum))
+
+
+_pool = None  # type: Optional[concurrent.futures.ThreadPoolExecutor]
+_pool_lock = threading.Lock()
+
+
+def decode_pool():
+    # type: () -> concurrent.futures.ThreadPoolExecutor
+    """
+    threads shared by every reader, zlib and numpy let go of the gil while they work
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='block-decode'
+            )
+    return _pool
+
+
+class BlockReader(object):
+    """
+    header and block index of a block file, blocks are only read and decompressed when asked for
+    """
+
+    def __init__(self, file_path, dtype):
+        # type: (str, np.dtype) -> None
+        self.file_path = file_path
+        self.dtype = dtype
+        with open(file_path, 'rb') as f:
+            raw = f.read(HEADER_SIZE)
+            if len(raw) != HEADER_SIZE:
+                raise BlockFileError('truncated header in ' + file_path)
+
+            magic, version, block_rows, span, count, first, last, index_offset, ticker = \
+                struct.unpack_from(HEADER_FORMAT, raw)
+            if magic != MAGIC:
+                raise BlockFileError(file_path + ' is not a block file')
+            if version != VERSION:
+                raise BlockFileError('unsupported block file version {} in {}'.format(version, file_path))
+
+            f.seek(index_offset)
+            block_count = (count + block_rows - 1) // block_rows
+            self.index = np.frombuffer(f.read(block_count * BLOCK_INDEX_DTYPE.itemsize), dtype=BLOCK_INDEX_DTYPE)
+            if len(self.index) != block_count:
+                raise BlockFileError('truncated block index in ' + file_path)
+
+        self.ticker = ticker.rstrip(b'\0').decode('ascii')
+        self.bar_span = datetime.timedelta(seconds=span)
+        self.block_rows = block_rows
+        self.count = count
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return self.count
+
+    def blocks(self, start=None, end=None):
+        # type: (Optional[int], Optional[int]) -> Tuple[int, int]
+        """
+        [lo, hi) range of the blocks holding times start <= time < end
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.index['last'], start, side='left'))
+        hi = len(self.index) if end is None else int(np.searchsorted(self.index['first'], end, side='left'))
+        return lo, max(lo, hi)
+
+    def read_block(self, i, start=None, end=None):
+        # type: (int, Optional[int], Optional[int]) -> np.ndarray
+        entry = self.index[i]
+        with open(self.file_path, 'rb') as f:
+            f.seek(int(entry['offset']))
+            compressed = f.read(int(entry['size']))
+        records = decode_block(zlib.decompress(compressed), int(entry['rows']), self.dtype)
+        if start is not None and entry['first'] < start:
+            records = records[int(np.searchsorted(records['time'], start, side='left')):]
+        if end is not None and entry['last'] >= end:
+            records = records[:int(np.searchsorted(records['time'], end, side='left'))]
+        return records
+
+    def read(self, start=None, end=None, threads=True):
+        # type: (Optional[int], Optional[int], bool) -> np.ndarray
+        """
+        records with start <= time < end, only the blocks overlapping the range are decompressed
+        :param threads: decompress the blocks on decode_pool()
+        """
+        return read_blocks([(self, start, end)], threads)[0]
+
+
+def read_blocks(ranges, threads=True):
+    # type: (Sequence[Tuple[BlockReader, Optional[int], Optional[int]]], bool) -> List[np.ndarray]
+    """
+    the records of every (reader, start, end), one array each. the blocks of all of them are
+    decompressed together so a range over many files keeps every thread busy
+    """
+    tasks = []
+    for j, (reader, start, end) in enumerate(ranges):
+        lo, hi = reader.blocks(start, end)
+        tasks += [(j, reader, i, start, end) for i in range(lo, hi)]
+
+    if threads and len(tasks) > 1:
+        blocks = list(decode_pool().map(lambda task: task[1].read_block(*task[2:]), tasks))
+    else:
+        blocks = [reader.read_block(i, start, end) for _, reader, i, start, end in tasks]
+
+    parts = [[] for _ in ranges]  # type: List[List[np.ndarray]]
+    for task, block in zip(tasks, blocks):
+        parts[task[0]].append(block)
+    return [
+        np.concatenate(part) if len(part) > 1 else part[0] if part else np.empty(0, dtype=reader.dtype)
+        for part, (reader, _, _) in zip(parts, ranges)
+    ]
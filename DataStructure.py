@@ -1,10 +1,11 @@
 import datetime
 import re
 import sys
+import time
 import uuid
 import warnings
 from enum import Enum
-from typing import Optional
+from typing import List, Optional, Sequence
 
 
 class OrderType(Enum):
@@ -80,7 +81,32 @@ class PythonTerminalStyle(Enum):
     CWHITEBG2 = '\33[107m'  # type: Enum
 
 
+def _to_list(values):
+    # type: (object) -> list
+    """
+    plain python scalars from an array or list, attribute access on numpy scalars is slow
+    """
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+
+def _to_datetimes(values):
+    # type: (object) -> List[datetime.datetime]
+    """
+    naive utc datetimes from epoch seconds or datetime64, numpy does the conversion in one go
+    """
+    import numpy as np
+
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        values = np.round(values * 1e6).astype('int64').astype('datetime64[us]')
+    elif values.dtype.kind != 'M':
+        values = values.astype('int64').astype('datetime64[s]')
+    return values.astype('datetime64[us]').tolist()
+
+
 class TradeData:
+    __slots__ = ('ticker', 'trade_time', 'price', 'volume', 'side')
+
     def __init__(
             self,
             ticker,
@@ -94,8 +120,26 @@ class TradeData:
         self.volume = trade_volume
         self.side = None
 
+    @classmethod
+    def from_arrays(cls, ticker, trade_time, trade_price, trade_volume):
+        # type: (str, object, object, object) -> List[TradeData]
+        """
+        build many trades at once
+        :param trade_time: epoch seconds or datetime64, array like
+        """
+        times = _to_datetimes(trade_time)
+        return [
+            cls(ticker, time, price, volume)
+            for time, price, volume in zip(times, _to_list(trade_price), _to_list(trade_volume))
+        ]
+
 
 class BarData:
+    __slots__ = (
+        'ticker', 'high_price', 'low_price', 'open_price', 'close_price', 'bar_start_time', 'bar_span', 'volume',
+        'notional'
+    )
+
     def __init__(
             self,
             ticker,  # type: str
@@ -118,8 +162,30 @@ class BarData:
         self.volume = volume
         self.notional = notional
 
+    @classmethod
+    def from_arrays(cls, ticker, bar_span, bar_start_time, open_price, high_price, low_price, close_price, volume,
+                    notional):
+        # type: (str, datetime.timedelta, object, object, object, object, object, object, object) -> List[BarData]
+        """
+        build many bars at once, e.g. from BarDataStorage columns
+        :param bar_start_time: epoch seconds or datetime64, array like
+        """
+        times = _to_datetimes(bar_start_time)
+        return [
+            cls(ticker, high, low, open_, close, time, bar_span, bar_volume, bar_notional)
+            for time, open_, high, low, close, bar_volume, bar_notional in zip(
+                times, _to_list(open_price), _to_list(high_price), _to_list(low_price), _to_list(close_price),
+                _to_list(volume), _to_list(notional)
+            )
+        ]
+
 
 class TickData:
+    __slots__ = (
+        'ticker', 'last_price', 'bid_price', 'ask_price', 'bid_amount', 'ask_amount', 'total_volume',
+        'total_notional', 'time'
+    )
+
     def __init__(
             self,
             ticker,  # type: str
@@ -155,8 +221,30 @@ class TickData:
         self.total_notional = total_notional
         self.time = time
 
+    @classmethod
+    def from_arrays(cls, ticker, last_price, bid_price, ask_price, bid_amount, ask_amount, total_volume,
+                    total_notional, time):
+        # type: (str, object, object, object, object, object, object, object, object) -> List[TickData]
+        """
+        build many ticks at once
+        :param time: epoch seconds or datetime64, array like
+        """
+        return [
+            cls(ticker, *fields)
+            for fields in zip(
+                _to_list(last_price), _to_list(bid_price), _to_list(ask_price), _to_list(bid_amount),
+                _to_list(ask_amount), _to_list(total_volume), _to_list(total_notional), _to_datetimes(time)
+            )
+        ]
+
 
 class Instruction:
+    # names are mangled inside the class body, so these match the self.__name attributes below
+    __slots__ = (
+        '__ticker', '__side', '__type', '__amount', '__limit_price', '__order_id', '__note', '__state',
+        '__filled_amount', '__filled_notional', '__stop_datetime', '__start_datetime', '__estimated_margin_cost',
+        '__average_price'
+    )
 
     def __init__(
             self,
@@ -193,6 +281,22 @@ class Instruction:
         self.__estimated_margin_cost = 0.0  # type: float
         self.__average_price = 0.0  # type: float
 
+    @classmethod
+    def from_arrays(cls, ticker, side, order_type, amount, limit_price, order_id=None, note=''):
+        # type: (str, Sequence[TradeSide], OrderType, object, object, Optional[Sequence[str]], str) -> List[Instruction]
+        """
+        build many orders of one ticker and type at once, e.g. the orders of a vectorized signal
+        :param order_id: one per order, new ids by default
+        """
+        amounts = _to_list(amount)
+        order_ids = [None] * len(amounts) if order_id is None else order_id
+        return [
+            cls(ticker, order_side, order_type, order_amount, order_price, order_order_id, note)
+            for order_side, order_amount, order_price, order_order_id in zip(
+                side, amounts, _to_list(limit_price), order_ids
+            )
+        ]
+
     def filled(
             self,
             amount,  # type: int
@@ -321,6 +425,7 @@ class Instruction:
 
 
 class Report:
+    __slots__ = ('__ticker', '__side', '__amount', '__notional', '__trade_time', '__order_id', '__note', '__margin')
 
     def __init__(
             self,
@@ -343,6 +448,20 @@ class Report:
 
         self.__margin = None
 
+    @classmethod
+    def from_arrays(cls, ticker, side, amount, notional, trade_time, order_id, note=''):
+        # type: (str, Sequence[TradeSide], object, object, object, Sequence[str], str) -> List[Report]
+        """
+        build many reports of one ticker at once, e.g. fills coming out of a vectorized backtest
+        :param trade_time: epoch seconds or datetime64, array like
+        """
+        return [
+            cls(ticker, report_side, report_amount, report_notional, time, report_order_id, note)
+            for report_side, report_amount, report_notional, time, report_order_id in zip(
+                side, _to_list(amount), _to_list(notional), _to_datetimes(trade_time), order_id
+            )
+        ]
+
     def set_margin(self, margin):
         # type: (float) -> None
         self.__margin = margin
@@ -397,12 +516,15 @@ class Report:
 
 
 class ProgressBar(object):
+    """
+    redraws in place at most once per min_interval seconds, for counters and rates see Metrics
+    """
 
     DEFAULT = 'Progress: %(bar)s %(percent)3d%%'
     FULL = '%(bar)s %(current)d/%(total)d (%(percent)3d%%) %(remaining)d to go'
 
     def __init__(self, total, width=40, fmt=DEFAULT, symbol='=',
-                 output=sys.stderr):
+                 output=sys.stderr, min_interval=0.1):
         assert len(symbol) == 1
 
         self.total = total
@@ -412,8 +534,15 @@ class ProgressBar(object):
         self.fmt = re.sub(r'(?P<name>%\(.+?\))d', r'\g<name>%dd' % len(str(total)), fmt)
 
         self.current = 0
+        self.min_interval = min_interval
+        self._last_draw = None  # type: Optional[float]
+
+    def __call__(self, force=False):
+        now = time.monotonic()
+        if not force and self._last_draw is not None and now - self._last_draw < self.min_interval:
+            return
+        self._last_draw = now
 
-    def __call__(self):
         percent = self.current / float(self.total)
         size = int(self.width * percent)
         remaining = self.total - self.current
@@ -426,9 +555,10 @@ class ProgressBar(object):
             'percent': percent * 100,
             'remaining': remaining
         }
-        print('\r' + self.fmt % args)
+        self.output.write('\r' + self.fmt % args)
+        self.output.flush()
 
     def done(self):
         self.current = self.total
-        self()
-        print('')
+        self(force=True)
+        self.output.write('\n')
@@ -0,0 +1,103 @@
+import time
+from typing import Optional
+
+
+class AdaptiveWindow(object):
+    """
+    AIMD control of how many requests may be in flight, plus a retransmission timeout from the round trips
+
+    like tcp it starts in slow start, every response growing the window by increase, until the first
+    shrink sets the threshold. above the threshold every response grows it by increase / window, so
+    about increase per window's worth of responses. an error, a timeout or a round trip more than
+    rtt_limit times the fastest one seen (the server queueing our requests up) shrinks it by the factor
+    decrease, at most once per round trip so one burst of failures does not collapse it to minimum.
+    the timeout follows RFC 6298, smoothed round trip plus four deviations, between min_timeout and
+    max_timeout.
+    """
+
+    def __init__(
+            self,
+            initial=5,  # type: int
+            minimum=1,  # type: int
+            maximum=32,  # type: int
+            increase=1.0,  # type: float
+            decrease=0.5,  # type: float
+            rtt_limit=4.0,  # type: Optional[float]
+            min_timeout=1.0,  # type: float
+            max_timeout=60.0  # type: float
+    ):
+        assert 1 <= minimum <= initial <= maximum, 'need 1 <= minimum <= initial <= maximum'
+        assert 0 < decrease < 1, 'decrease must be a factor below 1'
+
+        self.size = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.rtt_limit = rtt_limit
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+        self.smoothed_rtt = None  # type: Optional[float]
+        self.rtt_deviation = 0.0
+        self.min_rtt = None  # type: Optional[float]
+        self.error_rate = 0.0  # moving average over roughly the last 20 outcomes
+
+        self.threshold = float(maximum)  # slow start below this
+        self.success_count = 0
+        self.error_count = 0
+        self.timeout_count = 0
+        self._last_decrease = float('-inf')
+
+    @property
+    def window(self):
+        # type: () -> int
+        return int(self.size)
+
+    @property
+    def timeout(self):
+        # type: () -> float
+        if self.smoothed_rtt is None:
+            return self.max_timeout
+        return min(max(self.smoothed_rtt + 4 * self.rtt_deviation, self.min_timeout), self.max_timeout)
+
+    def _shrink(self):
+        now = time.monotonic()
+        if now - self._last_decrease < (self.smoothed_rtt or 0.0):
+            return
+        self._last_decrease = now
+        self.size = max(float(self.minimum), self.size * self.decrease)
+        self.threshold = self.size
+
+    def on_success(self, rtt):
+        # type: (float) -> None
+        self.success_count += 1
+        self.error_rate *= 0.95
+
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+            self.rtt_deviation = rtt / 2
+        else:
+            self.rtt_deviation = 0.75 * self.rtt_deviation + 0.25 * abs(self.smoothed_rtt - rtt)
+            self.smoothed_rtt = 0.875 * self.smoothed_rtt + 0.125 * rtt
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+
+        if self.rtt_limit is not None and rtt > self.rtt_limit * max(self.min_rtt, 1e-3):
+            self._shrink()
+        elif self.size < self.threshold:
+            self.size = min(float(self.maximum), self.size + self.increase)
+        else:
+            self.size = min(float(self.maximum), self.size + self.increase / self.size)
+
+    def on_error(self):
+        self.error_count += 1
+        self.error_rate = self.error_rate * 0.95 + 0.05
+        self._shrink()
+
+    def on_timeout(self):
+        self.timeout_count += 1
+        self.error_rate = self.error_rate * 0.95 + 0.05
+        self._shrink()
+        if self.smoothed_rtt is not None:
+            # back the timeout off like a retransmission, round trips will pull it back in
+            self.smoothed_rtt = min(self.smoothed_rtt * 2, self.max_timeout)
@@ -0,0 +1,184 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Callable, Iterator, Optional, Tuple
+
+MAGIC = b'HJRN'
+VERSION = 1
+
+# magic, version, padding, created in epoch nanoseconds
+HEADER_FORMAT = '<4sHHq'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# frame length, receive time in epoch nanoseconds, then the frame as it came off the socket
+RECORD_FORMAT = '<Iq'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+_record = struct.Struct(RECORD_FORMAT)
+
+BUFFER_SIZE = 1 << 20
+
+
+class FrameJournalError(Exception):
+    pass
+
+
+def _check_header(raw, file_path):
+    # type: (bytes, str) -> None
+    if len(raw) < HEADER_SIZE:
+        raise FrameJournalError('truncated header in ' + file_path)
+    magic, version, _, _ = struct.unpack_from(HEADER_FORMAT, raw)
+    if magic != MAGIC:
+        raise FrameJournalError(file_path + ' is not a frame journal')
+    if version != VERSION:
+        raise FrameJournalError('unsupported frame journal version {} in {}'.format(version, file_path))
+
+
+def _complete_end(file_path):
+    # type: (str) -> int
+    """
+    offset just past the last whole record, a crash can leave half of one at the end. hops from record
+    header to record header through a memory map, the frames themselves are never read
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+            _check_header(f.read(), file_path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            _check_header(view[:HEADER_SIZE], file_path)
+            size = len(view)
+            offset = HEADER_SIZE
+            unpack_from = _record.unpack_from
+            while offset + RECORD_SIZE <= size:
+                end = offset + RECORD_SIZE + unpack_from(view, offset)[0]
+                if end > size:
+                    break
+                offset = end
+            return offset
+
+
+class FrameJournal(object):
+    """
+    append only capture of raw websocket frames, each with the time it was received
+
+    append() is all the socket thread does per frame: two writes into a large buffer, no decompressing
+    or parsing. the buffer goes to disk once flush_interval seconds have passed since the last time,
+    checked on append, and on flush() or close(). a crash loses at most that much, reopening cuts a
+    torn last record off before appending. appends and close() share a lock, a frame that comes in
+    after close() is dropped and counted in late_count rather than written to a closed file.
+    """
+
+    def __init__(self, file_path, flush_interval=1.0):
+        # type: (str, float) -> None
+        self.file_path = file_path
+        self.flush_interval_ns = int(flush_interval * 1e9)
+        self.frame_count = 0
+        self.byte_count = 0
+        self.late_count = 0
+        self._lock = threading.Lock()
+
+        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            end = _complete_end(file_path)
+            self._file = open(file_path, 'r+b', buffering=BUFFER_SIZE)
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(file_path, 'wb', buffering=BUFFER_SIZE)
+            self._file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, time.time_ns()))
+        self._last_flush = time.time_ns()
+
+    def append(self, frame, received=None):
+        # type: (bytes, Optional[int]) -> None
+        """
+        :param received: epoch nanoseconds, now by default
+        """
+        now = time.time_ns() if received is None else received
+        with self._lock:
+            if self._file.closed:
+                self.late_count += 1
+                return
+            write = self._file.write
+            write(_record.pack(len(frame), now))
+            write(frame)
+            self.frame_count += 1
+            self.byte_count += len(frame)
+            if now - self._last_flush > self.flush_interval_ns:
+                self._file.flush()
+                self._last_flush = now
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_journal(file_path):
+    # type: (str) -> Iterator[Tuple[int, bytes]]
+    """
+    (received epoch nanoseconds, frame) of every whole record, straight from a memory map
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+            _check_header(f.read(), file_path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            _check_header(view[:HEADER_SIZE], file_path)
+            size = len(view)
+            offset = HEADER_SIZE
+            unpack_from = _record.unpack_from
+            while offset + RECORD_SIZE <= size:
+                length, received = unpack_from(view, offset)
+                start = offset + RECORD_SIZE
+                offset = start + length
+                if offset > size:
+                    break
+                yield received, view[start:offset]
+
+
+class ReplaySocket(object):
+    """
+    stands in for the websocket during a replay, what would have been sent (pongs, requests) is counted
+    """
+
+    def __init__(self, url=''):
+        # type: (str) -> None
+        self.url = url
+        self.sent_count = 0
+
+    def send(self, data):
+        self.sent_count += 1
+
+    def close(self):
+        pass
+
+
+def replay_journal(file_path, on_frame, pacing=None):
+    # type: (str, Callable[[bytes], None], Optional[float]) -> int
+    """
+    every frame of a journal through on_frame, as fast as it is called back or at the recorded pace
+    :param pacing: None for full speed, 1.0 for the gaps between the receive times, 2.0 for half of them
+    :return: the number of frames
+    """
+    count = 0
+    first_received = None
+    started = time.perf_counter()
+    for received, frame in read_journal(file_path):
+        if pacing is not None:
+            if first_received is None:
+                first_received = received
+            delay = (received - first_received) / 1e9 / pacing - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        on_frame(frame)
+        count += 1
+    return count
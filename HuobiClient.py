@@ -1,70 +1,490 @@
+import argparse
+import collections
+import concurrent.futures
+import contextlib
 import datetime
-import gzip
+import io
+import multiprocessing
+import queue
+import sys
 import uuid
 import threading
 import functools
 import json
 import os
-from typing import Dict
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import websocket
 
-from DataStructure import BarData, ProgressBar
+from BarArchive import BarArchive, PARTITIONS, open_archive
+from BarCache import BarCache, epoch_windows
+from BarStorage import BarDataStorage, PERIOD_SPANS
+from FlowControl import AdaptiveWindow
+from FrameDecoder import FrameDecoder, kline_columns
+from FrameJournal import FrameJournal, ReplaySocket, replay_journal
+from Integrity import IntegrityIndex, IntegrityReport, check_bars, check_storage, load_verified
+from Metrics import Metrics, QueueSink, TerminalSink
 
+HUOBI_WS_URL = "wss://api.huobi.pro/ws"
 HTTP_PROXY = (None, None)  # ('127.0.0.1', 1080) or (None, None)
 LOCAL_TIMEZONE = None
-
-
-def main():
-    pass
+ARCHIVE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')
+
+CSV_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+CSV_DTYPES = {
+    'Time': str,
+    'Ticker': str,
+    'High': 'float64',
+    'Low': 'float64',
+    'Open': 'float64',
+    'Close': 'float64',
+    'Volume': 'float64',
+    'Notional': 'float64'
+}
+
+
+def date_chunks(start_date, end_date, days):
+    # type: (datetime.date, datetime.date, int) -> List[Tuple[datetime.date, datetime.date]]
+    """
+    start_date..end_date cut into ranges of at most days days, both ends inclusive
+    """
+    chunks = []
+    while start_date <= end_date:
+        stop_date = min(start_date + datetime.timedelta(days=days - 1), end_date)
+        chunks.append((start_date, stop_date))
+        start_date = stop_date + datetime.timedelta(days=1)
+    return chunks
+
+
+def backfill_job(ticker, period, start_date, end_date, options, progress=None):
+    # type: (str, str, datetime.date, datetime.date, Dict[str, Any], Any) -> Dict[str, Any]
+    """
+    one ticker, period and date range, run in a pool worker: download and decode, then write the csv or
+    hand the columns back for the parent to archive, the archive index only takes one writer at a time
+    :param options: url, timezone, proxy, format, output, request_size and queue_size, see main
+    :param progress: queue the request_data metrics snapshots go to as they are taken
+    """
+    key = '{} {} {}'.format(ticker, period, start_date)
+    result = {
+        'key': key, 'ticker': ticker, 'period': period, 'start_date': start_date, 'end_date': end_date,
+        'bars': 0, 'failed_requests': 0, 'error': None, 'integrity': None, 'path': None, 'columns': None,
+        'seconds': 0.0
+    }
+    started = time.perf_counter()
+    metrics = Metrics([QueueSink(progress, key)] if progress is not None else [], interval=0.5, name=key)
+    try:
+        # the client's own progress prints would interleave across workers
+        with contextlib.redirect_stdout(io.StringIO()):
+            # spawned workers do not inherit module settings of the parent, they come in with options
+            replay = BarDataReplay(ticker, start_date, end_date, url=options['url'], periods=(period,),
+                                   timezone=options['timezone'], proxy=options['proxy'])
+            replay.request_data(request_size=options['request_size'], queue_size=options['queue_size'],
+                                metrics=metrics)
+            storage = replay.bar_data_storage
+            if options['format'] == 'csv':
+                file_path = os.path.join(options['output'], replay.file_name('.csv'))
+                result['path'] = replay.to_csv(file_path, record_integrity=True)
+            else:
+                result['columns'] = {name: storage.column(name) for name in storage.COLUMNS}
+        result['bars'] = len(storage)
+        result['failed_requests'] = len(replay.failed_requests)
+        result['integrity'] = replay.check()
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def main(argv=None):
+    # type: (Optional[Sequence[str]]) -> int
+    """
+    backfill klines of many tickers and periods into csv files or the binary archive
+
+        python HuobiClient.py eosusdt btcusdt --start 2019-01-01 --end 2019-03-31 --periods 1min 60min
+
+    every ticker, period and --chunk-days days is a job for a process pool, so the gzip, json and csv
+    work of different jobs runs on different cores. the exit status is 1 when a job failed or gave up
+    on some of its requests.
+    """
+    parser = argparse.ArgumentParser(description='backfill huobi klines')
+    parser.add_argument('tickers', nargs='+', help='e.g. eosusdt btcusdt')
+    parser.add_argument('--start', type=datetime.date.fromisoformat, required=True, help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', type=datetime.date.fromisoformat, help='last day, the start day by default')
+    parser.add_argument('--periods', nargs='+', default=['1min'], choices=list(PERIOD_SPANS), metavar='PERIOD',
+                        help='kline periods, 1min by default')
+    parser.add_argument('--format', choices=('csv', 'archive'), default='csv', help='output format')
+    parser.add_argument('--output', help='directory to write to, the module directory for csv and {} for '
+                                         'archive by default'.format(ARCHIVE_ROOT))
+    parser.add_argument('--partition', choices=PARTITIONS, help='archive partitioning, day for a new archive')
+    parser.add_argument('--block-rows', type=int, help='block compress the archive, rows per block, e.g. 4096')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--chunk-days', type=int, default=7, help='days per job')
+    parser.add_argument('--url', default=HUOBI_WS_URL, help='websocket endpoint')
+    parser.add_argument('--utc', action='store_true', help='days run utc midnight to midnight, not local')
+    parser.add_argument('--proxy', help='http proxy as host:port')
+    parser.add_argument('--request-size', type=int, default=300, help='bars per request')
+    parser.add_argument('--queue-size', type=int, default=5, help='requests in flight per job to start with')
+    args = parser.parse_args(argv)
+
+    end_date = args.end or args.start
+    if end_date < args.start:
+        parser.error('--end is before --start')
+    output = args.output or (ARCHIVE_ROOT if args.format == 'archive' else os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs(output, exist_ok=True)
+    proxy = (None, None)
+    if args.proxy:
+        host, port = args.proxy.rsplit(':', 1)
+        proxy = (host, int(port))
+
+    options = {
+        'url': args.url,
+        'timezone': datetime.timezone.utc if args.utc else LOCAL_TIMEZONE,
+        'proxy': proxy,
+        'format': args.format,
+        'output': output,
+        'request_size': args.request_size,
+        'queue_size': args.queue_size
+    }
+    jobs = [
+        (ticker, period, chunk_start, chunk_end)
+        for ticker in args.tickers for period in args.periods
+        for chunk_start, chunk_end in date_chunks(args.start, end_date, args.chunk_days)
+    ]
+    total = sum(
+        ((chunk_end - chunk_start).days + 1) * 86400 // int(PERIOD_SPANS[period].total_seconds())
+        for _, period, chunk_start, chunk_end in jobs
+    )
+    print('Backfilling {} jobs with {} workers into {}'.format(len(jobs), args.workers, output), file=sys.stderr)
+
+    metrics = Metrics([TerminalSink(rates=('bars', 'bytes'))], interval=0.5, name='backfill')
+    job_counters = {}  # type: Dict[str, Dict[str, float]]
+    results = []  # type: List[Dict[str, Any]]
+
+    def drain(progress):
+        while True:
+            try:
+                key, snapshot = progress.get_nowait()
+            except queue.Empty:
+                break
+            job_counters[key] = snapshot['counters']
+
+    started = time.perf_counter()
+    with multiprocessing.Manager() as manager, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        progress = manager.Queue()
+        futures = {pool.submit(backfill_job, *job, options=options, progress=progress): job for job in jobs}
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=0.2)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # the worker itself died, e.g. BrokenProcessPool
+                    ticker, period, chunk_start, _ = futures[future]
+                    result = {'key': '{} {} {}'.format(ticker, period, chunk_start), 'bars': 0, 'failed_requests': 0,
+                              'integrity': None, 'columns': None, 'error': '{}: {}'.format(type(e).__name__, e)}
+                if result['columns'] is not None:
+                    storage = BarDataStorage.from_arrays(
+                        result['ticker'], PERIOD_SPANS[result['period']],
+                        *(result['columns'][name] for name in BarDataStorage.COLUMNS)
+                    )
+                    archive = BarArchive(output, result['ticker'], result['period'], args.partition, args.block_rows)
+                    archive.write(storage)
+                    result['columns'] = None
+                results.append(result)
+
+            drain(progress)
+            # the job totals replace the counters, rates and the progress line come out of them
+            metrics.sum_counters(job_counters.values())
+            metrics.progress(int(metrics.counters.get('bars', 0)), total, 'bars')
+            metrics.gauge('jobs_done', len(results))
+            metrics.tick()
+    metrics.close()
+    seconds = time.perf_counter() - started
+
+    bars = sum(result['bars'] for result in results)
+    failed = [result for result in results if result['error'] or result['failed_requests']]
+    print('{} bars in {}/{} jobs, {:.1f}s, {:.0f} bars/s, {:.1f} MB received, {} retries, {} timeouts'.format(
+        bars, len(results) - len(failed), len(jobs), seconds, bars / seconds if seconds else 0.0,
+        metrics.counters.get('bytes', 0) / 1e6, int(metrics.counters.get('retries', 0)),
+        int(metrics.counters.get('timeouts', 0))
+    ))
+    for result in sorted(results, key=lambda result: result['key']):
+        report = result['integrity']
+        if report is not None and not (report.ok and report.complete):
+            print('{}: {}'.format(result['key'], report.summary()))
+    for result in failed:
+        print('FAILED {}: {}'.format(
+            result['key'], result['error'] or '{} requests given up on'.format(result['failed_requests'])
+        ))
+    return 1 if failed else 0
+
+
+def request_range(start_date, end_date, timezone=None):
+    # type: (datetime.date, datetime.date, Optional[datetime.tzinfo]) -> Tuple[int, int]
+    """
+    [start, end) epoch seconds from the start of start_date to the end of end_date
+    :param timezone: the days' timezone, LOCAL_TIMEZONE by default
+    """
+    timezone = LOCAL_TIMEZONE if timezone is None else timezone
+    start_datetime = datetime.datetime.combine(start_date, time=datetime.time(), tzinfo=timezone)
+    stop_datetime = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time(), tzinfo=timezone)
+    return int(start_datetime.timestamp()), int(stop_datetime.timestamp())
+
+
+def request_windows(start_date, end_date, request_size=300, bar_span=datetime.timedelta(minutes=1), timezone=None):
+    # type: (datetime.date, datetime.date, int, datetime.timedelta, Optional[datetime.tzinfo]) -> List[Tuple[int, int]]
+    """
+    (from, to) epoch second pairs of the kline requests covering start_date..end_date, both inclusive
+    """
+    start, stop = request_range(start_date, end_date, timezone)
+    return epoch_windows(start, stop, request_size, bar_span)
+
+
+def query(ticker, start, end, period='1min', root=None):
+    # type: (str, Union[datetime.datetime, int], Union[datetime.datetime, int], str, Optional[str]) -> BarDataStorage
+    """
+    archived bars with start <= time < end, naive datetimes are utc. only the partitions overlapping the
+    range are opened and only the matching rows copied, see BarArchive
+    :param root: archive root, ARCHIVE_ROOT by default
+    """
+    return open_archive(root or ARCHIVE_ROOT, ticker, period).load(start, end)
+
+
+def kline_topic(ticker, period='1min'):
+    # type: (str, str) -> str
+    return "market.{}.kline.{}".format(ticker, period)
+
+
+def extend_klines(storage, data):
+    # type: (BarDataStorage, List[Dict]) -> np.ndarray
+    """
+    append the 'data' list of a kline response to the storage
+    :return: the times of the bars appended
+    """
+    columns = kline_columns(data)
+    storage.extend(**columns)
+    return columns['time']
+
+
+class RequestTracker(object):
+    """
+    book keeping of in flight requests, the socket thread marks responses and wakes up the sender
+
+    every answered request, processed or failed, is queued for the sender to collect with
+    completions(). requests the sender gives up waiting for are expired, a response that still
+    comes in after that is ignored here.
+    """
+
+    def __init__(self, queue_size, metrics=None):
+        # type: (int, Optional[Metrics]) -> None
+        """
+        :param metrics: gets the round trip time of every request as the 'round_trip' latency
+        """
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.sent_count = 0
+        self.pending_count = 0
+        self.processed_count = 0
+        self.failed_count = 0
+        self.expired_count = 0
+        self.aborted = False
+
+        self._status = {}  # type: Dict[str, str]
+        self._sent_at = {}  # type: Dict[str, float]
+        self._completions = collections.deque()  # type: collections.deque
+        self._condition = threading.Condition()
+
+    @property
+    def response_count(self):
+        # type: () -> int
+        return self.processed_count + self.failed_count
+
+    def sent(self, request_id):
+        # type: (str) -> None
+        with self._condition:
+            self._status[request_id] = 'Sent'
+            self._sent_at[request_id] = time.perf_counter()
+            self.sent_count += 1
+            self.pending_count += 1
+
+    def processed(self, request_id, summary=None):
+        # type: (str, object) -> Optional[float]
+        """
+        :param summary: handed to the sender with the completion
+        :return: the round trip time, None if the request was not waited for any more
+        """
+        with self._condition:
+            if self._status.get(request_id) != 'Sent':
+                return None
+            self._status[request_id] = 'Processed'
+            rtt = time.perf_counter() - self._sent_at.pop(request_id)
+            if self.metrics is not None:
+                self.metrics.observe('round_trip', rtt)
+            self.pending_count -= 1
+            self.processed_count += 1
+            self._completions.append((request_id, rtt, summary))
+            self._condition.notify_all()
+            return rtt
+
+    def failed(self, request_id, response):
+        # type: (str, Dict) -> None
+        """
+        an error response, completions() hands it to the sender with no round trip time
+        """
+        with self._condition:
+            if self._status.get(request_id) != 'Sent':
+                return
+            self._status[request_id] = 'Failed'
+            self._sent_at.pop(request_id)
+            self.pending_count -= 1
+            self.failed_count += 1
+            self._completions.append((request_id, None, response))
+            self._condition.notify_all()
+
+    def expire(self, timeout):
+        # type: (float) -> List[str]
+        """
+        stop waiting for requests sent more than timeout seconds ago
+        :return: their ids
+        """
+        with self._condition:
+            deadline = time.perf_counter() - timeout
+            expired = [request_id for request_id, sent_at in self._sent_at.items() if sent_at < deadline]
+            for request_id in expired:
+                self._status[request_id] = 'Expired'
+                del self._sent_at[request_id]
+            self.pending_count -= len(expired)
+            self.expired_count += len(expired)
+            return expired
+
+    def completions(self):
+        # type: () -> List[Tuple[str, Optional[float], object]]
+        """
+        (request_id, round trip time or None if it failed, summary or error response) since the last call
+        """
+        completions = []
+        while self._completions:
+            completions.append(self._completions.popleft())
+        return completions
+
+    def abort(self):
+        with self._condition:
+            self.aborted = True
+            self._condition.notify_all()
+
+    def wait_for_response(self, response_count, timeout):
+        # type: (int, float) -> bool
+        """
+        block until more than response_count responses, processed or failed, have come in
+        :return: False on timeout or abort
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.aborted or self.response_count > response_count, timeout
+            ) and not self.aborted
 
 
 class BarDataReplay(object):
-    def __init__(self, ticker, start_date, end_date):
-        # type: (str, datetime.date, datetime.date) -> None
-
-        self.ticker = ticker
+    def __init__(self, ticker, start_date, end_date, url=HUOBI_WS_URL, periods=('1min',), timezone=None, proxy=None):
+        # type: (Union[str, Sequence[str]], datetime.date, datetime.date, str, Sequence[str], Optional[datetime.tzinfo], Optional[Tuple[Optional[str], Optional[int]]]) -> None
+        """
+        :param ticker: one ticker or a list of them, all fetched over the same connection
+        :param periods: kline periods to fetch for every ticker, see BarStorage.PERIOD_SPANS
+        :param timezone: the timezone start_date and end_date are days in, LOCAL_TIMEZONE by default
+        :param proxy: (host, port) of an http proxy, HTTP_PROXY by default
+        """
+
+        self.tickers = [ticker] if isinstance(ticker, str) else list(ticker)
+        self.periods = list(periods)
+        self.ticker = self.tickers[0]
         self.start_date = start_date
         self.end_date = end_date
+        self.timezone = timezone
+        self.proxy = proxy
+
+        for period in self.periods:
+            assert period in PERIOD_SPANS, 'unsupported kline period ' + period
 
         self.connected = False
-        self._requests_status = {}
-        self.bar_data_storage = {}  # type: Dict[datetime.datetime, BarData]
+        self._connected_event = threading.Event()
+        self.tracker = RequestTracker(queue_size=5)
+        self.decoder = FrameDecoder()
+        self.metrics = None  # type: Optional[Metrics]
+        # raw frames are captured here while request_data runs with a journal
+        self.journal = None  # type: Optional[FrameJournal]
+        self.bar_data_storages = {
+            (ticker, period): BarDataStorage(ticker=ticker, bar_span=PERIOD_SPANS[period])
+            for ticker in self.tickers for period in self.periods
+        }  # type: Dict[Tuple[str, str], BarDataStorage]
+        self._topics = {kline_topic(ticker, period): (ticker, period) for ticker, period in self.bar_data_storages}
+        # the first ticker and period, what single ticker callers have always used
+        self.bar_data_storage = self.bar_data_storages[(self.ticker, self.periods[0])]
+        # last IntegrityReport of every storage, see check()
+        self.integrity = {}  # type: Dict[Tuple[str, str], IntegrityReport]
+        # bars that came in more than once in the last request_data or replay, see check()
+        self.duplicate_counts = {}  # type: Dict[Tuple[str, str], int]
+        self._received = {}  # type: Dict[Tuple[str, str], List[np.ndarray]]
+        self._new_socket(url)
+
+    def _new_socket(self, url):
+        # type: (str) -> None
         # websocket.enableTrace(True)
         self.socket = websocket.WebSocketApp(
-            url="wss://api.huobi.pro/ws",
+            url=url,
             on_open=functools.partial(self._on_open, self),
             on_message=functools.partial(self._on_message, self),
             on_error=self._on_error,
             on_close=functools.partial(self._on_close, self)
         )
 
-        self.socket_thread = threading.Thread(target=self._socket_thread, args=[HTTP_PROXY])
+        # websocket-client only notices close() at its next 10 second select timeout, a daemon thread
+        # keeps that from holding up the exit of a process, e.g. a pool worker
+        self.socket_thread = threading.Thread(target=self._socket_thread, daemon=True)
 
-    def _socket_thread(self, proxy):
+    def _socket_thread(self):
+        proxy = HTTP_PROXY if self.proxy is None else self.proxy
 
         if proxy != (None, None):
             print('Using proxy ' + proxy[0] + ': ' + str(proxy[1]))
 
         self.socket.run_forever(
             http_proxy_host=proxy[0],
-            http_proxy_port=proxy[1]
+            http_proxy_port=proxy[1],
+            proxy_type='http'
         )
 
     @staticmethod
     def _on_open(self, socket):
+        if socket is not self.socket:
+            return
         self.connected = socket.sock.connected
+        if self.connected:
+            self._connected_event.set()
 
     @staticmethod
-    def _on_close(self, socket):
-        print(socket.connected)
-        self.connected = socket.sock.connected
+    def _on_close(self, socket, *args):
+        if socket is not self.socket:
+            # the connection of an earlier request_data closing late
+            return
+        self.connected = False
+        self._connected_event.clear()
+        self.tracker.abort()
 
     @staticmethod
     def _on_message(self, socket, message):
-        result = gzip.decompress(message).decode('utf-8')
-        if "ping" in result:
-            socket.send(json.dumps({"pong": datetime.datetime.now().timestamp()}))
+        journal = self.journal
+        if journal is not None:
+            journal.append(message)
+        ping, result = self.decoder.decode(message)
+        if self.metrics is not None:
+            self.metrics.incr('frames')
+            self.metrics.incr('bytes', len(message))
+        if ping is not None:
+            socket.send(json.dumps({"pong": ping}))
         else:
             self._log_bar_data(result)
 
@@ -73,157 +493,475 @@ class BarDataReplay(object):
         print(error)
         socket.close()
 
-    def _log_bar_data(self, message):
-        result = json.loads(message)
-
-        assert result['status'] == 'ok', 'bad message'
-
-        for tick_dict in result['data']:
-            bar_data = BarData(
-                ticker=self.ticker,
-                high_price=tick_dict['high'],
-                low_price=tick_dict['low'],
-                open_price=tick_dict['open'],
-                close_price=tick_dict['close'],
-                bar_start_time=datetime.datetime.utcfromtimestamp(tick_dict['id']),
-                bar_span=datetime.timedelta(minutes=1),
-                volume=tick_dict['amount'],
-                notional=tick_dict['vol']
-            )
-
-            self.bar_data_storage[bar_data.bar_start_time] = bar_data
-
-        self._requests_status[result['id']] = 'Processed'
-
-    def request_data(self, request_size=300, queue_size=5):
-        # type: (int, int) -> None
-
-        print('Requesting data from ' + self.socket.url)
+    def storage(self, ticker=None, period=None):
+        # type: (Optional[str], Optional[str]) -> BarDataStorage
+        return self.bar_data_storages[(ticker or self.ticker, period or self.periods[0])]
+
+    def _log_bar_data(self, result):
+        # type: (Dict) -> None
+        if result.get('status') != 'ok':
+            self.tracker.failed(result.get('id'), result)
+            return
+
+        # responses are routed by topic, requests for different keys are interleaved on the socket
+        data = result['data']
+        key = self._topics[result['rep']]
+        times = extend_klines(self.bar_data_storages[key], data)
+        received = self._received.get(key)
+        if received is not None:
+            received.append(times)
+
+        # what the sender needs to spot truncated windows, without holding on to the bars
+        summary = (len(data), data[0]['id'], data[-1]['id']) if data else (0, None, None)
+        if self.tracker.processed(result['id'], summary) is not None and self.metrics is not None:
+            self.metrics.incr('bars', len(data))
+
+    def request_data(self, request_size=300, queue_size=5, connect_timeout=30.0, response_timeout=60.0, cache=None,
+                     metrics=None, max_queue_size=32, retries=3, ranges=None, journal=None):
+        # type: (int, int, Optional[float], Optional[float], Optional[BarCache], Optional[Metrics], int, int, Optional[Dict[Tuple[str, str], List[Tuple[int, int]]]], Union[None, str, FrameJournal]) -> None
+        """
+        requests are pipelined through an AdaptiveWindow: the number in flight starts at queue_size and
+        grows by AIMD up to max_queue_size while responses come back quickly, shrinking on errors,
+        timeouts and round trips far above the fastest one. a request not answered within the window's
+        timeout, or answered with an error, is sent again up to retries times. a window that comes
+        back empty is split in two once, one that comes back short but gapless has the missing head
+        or tail asked for again.
+
+        :param queue_size: requests in flight to start with
+        :param connect_timeout: seconds to wait for the socket to open
+        :param response_timeout: longest a request is waited for, and longest without any response at all
+            before giving up with TimeoutError
+        :param cache: only request what the cache has not covered yet, store the new bars in it and
+            fill the storages with the whole start_date..end_date range from it
+        :param metrics: progress, bars, frames, bytes and round trip latencies go here, by default to a
+            progress line on stderr redrawn at most twice a second
+        :param max_queue_size: most requests in flight, equal to queue_size for a fixed window
+        :param retries: times a timed out or failed request is sent again before it is given up on
+        :param ranges: only request these [start, end) epoch second ranges per (ticker, period) instead of
+            start_date..end_date, see refetch_gaps
+        :param journal: append every frame received to this FrameJournal, or to one opened at this path
+            and closed again at the end, replay() feeds it back without a network
+        """
+
+        requests = self._interleaved_requests(request_size, cache, ranges)
+        if self.socket_thread.ident is not None:
+            # a thread only starts once, a later request_data gets a new connection
+            self._new_socket(self.socket.url)
+            self._connected_event.clear()
+        print('Requesting {} windows from {}'.format(len(requests), self.socket.url))
+        self.metrics = metrics if metrics is not None else Metrics([TerminalSink()], interval=0.5, name='request_data')
+        self.window = AdaptiveWindow(
+            initial=queue_size, maximum=max(max_queue_size, queue_size), max_timeout=response_timeout
+        )
+        self.tracker = RequestTracker(self.window.window, self.metrics)
+        self.failed_requests = []  # type: List[Tuple[str, str, int, int]]
+
+        # (ticker, period, from, to, attempt, split), split marks the halves of an empty window
+        todo = collections.deque(request + (0, False) for request in requests)
+        in_flight = {}  # type: Dict[str, Tuple[str, str, int, int, int, bool]]
+        covered = {}  # type: Dict[Tuple[str, str], List[Tuple[int, int]]]
+
+        total = max(sum(
+            (request_to - request_from) // int(PERIOD_SPANS[period].total_seconds()) + 1
+            for _, period, request_from, request_to in requests
+        ), 1)
+
+        def update_progress():
+            # the counter is only read here, bars are counted on the socket thread
+            self.metrics.progress(int(self.metrics.counters.get('bars', 0)), total, 'bars')
+            self.metrics.gauge('window', self.window.window)
+            self.metrics.gauge('timeout', self.window.timeout)
+            self.metrics.tick()
+
+        def retry(item, reason):
+            ticker, period, request_from, request_to, attempt, split = item
+            if attempt < retries:
+                self.metrics.incr('retries')
+                todo.append((ticker, period, request_from, request_to, attempt + 1, split))
+            else:
+                self.failed_requests.append((ticker, period, request_from, request_to))
+                print('Giving up on {} {} {}..{}: {}'.format(ticker, period, request_from, request_to, reason))
+
+        def answered(item, summary):
+            ticker, period, request_from, request_to, attempt, split = item
+            span = int(PERIOD_SPANS[period].total_seconds())
+            count, first, last = summary
+            expected = (request_to - request_from) // span + 1
+
+            if count == 0 and expected > 1 and not split:
+                # an empty window may be a hiccup rather than no trades, ask again in two halves
+                self.metrics.incr('splits')
+                middle = request_from + (expected // 2) * span
+                todo.appendleft((ticker, period, middle, request_to, 0, True))
+                todo.appendleft((ticker, period, request_from, middle - span, 0, True))
+                return
+
+            if 0 < count < expected and (last - first) // span + 1 == count:
+                # no gaps but short, the server cut the window off
+                if last < request_to:
+                    todo.appendleft((ticker, period, last + span, request_to, 0, split))
+                if first > request_from:
+                    todo.appendleft((ticker, period, request_from, first - span, 0, split))
+                self.metrics.incr('truncated')
+                covered.setdefault((ticker, period), []).append((first, last + span))
+                return
+
+            covered.setdefault((ticker, period), []).append((request_from, request_to + span))
+
+        if not requests:
+            self._load_cached(cache)
+            return
+
+        own_journal = isinstance(journal, str)
+        self.journal = FrameJournal(journal) if own_journal else journal
+        self._start_counting()
         self.socket_thread.start()
-
-        pgb = ProgressBar(total=((self.end_date - self.start_date) + datetime.timedelta(days=1)).total_seconds() / 60)
-
-        def update_pgb():
-            while True:
-                progress = len(self.bar_data_storage)
-                if pgb.current != progress:
-                    pgb.current = progress
-                    pgb()
-
-                if pgb.current == pgb.total:
-                    break
-
-        while True:
-            if self.connected:
-                break
-
-        # 300 rows max that's 5 hours of bars for 1-min interval
-        start_datetime = datetime.datetime.combine(self.start_date, time=datetime.time(), tzinfo=LOCAL_TIMEZONE)
-        end_datetime = start_datetime + datetime.timedelta(minutes=request_size)
-        pgb_thread = threading.Thread(target=update_pgb)
-        pgb_thread.start()
-        while True:
-            req = {
-                "req": "market.{}.kline.{}".format(self.ticker, "1min"),
-                "id": str(uuid.uuid1()),
-                "from": int(start_datetime.timestamp()),
-                "to": int(end_datetime.timestamp())
-            }
-
-            self.socket.send(json.dumps(req))
-            self._requests_status[req['id']] = 'Sent'
-
-            while True:
-                pending_count = sum([1 if status == 'Sent' else 0 for status in self._requests_status.values()])
-                if queue_size > pending_count:
+        if not self._connected_event.wait(connect_timeout):
+            self.socket.close()
+            self._close_journal(own_journal)
+            raise TimeoutError('could not connect to {} within {} seconds'.format(self.socket.url, connect_timeout))
+
+        try:
+            last_response = time.monotonic()
+            seen_responses = 0
+            while not self.tracker.aborted:
+                self.tracker.queue_size = self.window.window
+                while todo and self.tracker.pending_count < self.window.window:
+                    item = todo.popleft()
+                    ticker, period, request_from, request_to = item[:4]
+                    req = {
+                        "req": kline_topic(ticker, period),
+                        "id": str(uuid.uuid1()),
+                        "from": request_from,
+                        "to": request_to
+                    }
+                    # registered before sending, the response may come back before send returns
+                    in_flight[req['id']] = item
+                    self.tracker.sent(req['id'])
+                    self.socket.send(json.dumps(req))
+
+                if not todo and not self.tracker.pending_count:
                     break
 
-            start_datetime = end_datetime
-            end_datetime = start_datetime + datetime.timedelta(minutes=request_size)
-
-            if start_datetime >= datetime.datetime.combine(self.end_date + datetime.timedelta(days=1), datetime.time(), tzinfo=LOCAL_TIMEZONE):
-                break
-            elif end_datetime > datetime.datetime.combine(self.end_date + datetime.timedelta(days=1), datetime.time(), tzinfo=LOCAL_TIMEZONE):
-                end_datetime = datetime.datetime.combine(self.end_date + datetime.timedelta(days=1), datetime.time(), tzinfo=LOCAL_TIMEZONE)
-
-        while True:
-            processed_count = sum([1 if status == 'Processed' else 0 for status in self._requests_status.values()])
-            if processed_count == len(self._requests_status):
-                break
-
-        pgb.done()
-
-        self.socket.close()
-        print(str(len(self.bar_data_storage)) + ' bar data received and processed, completed!')
-
-    def to_csv(self, file_path=None):
+                if self.tracker.wait_for_response(seen_responses, min(self.window.timeout / 2, 1.0)):
+                    last_response = time.monotonic()
+                elif self.tracker.pending_count and time.monotonic() - last_response > response_timeout:
+                    raise TimeoutError('no response within {} seconds, {} requests pending'.format(
+                        response_timeout, self.tracker.pending_count))
+
+                seen_responses = self.tracker.response_count
+                for request_id, rtt, result in self.tracker.completions():
+                    item = in_flight.pop(request_id)
+                    if rtt is None:
+                        self.window.on_error()
+                        self.metrics.incr('errors')
+                        retry(item, result.get('err-msg', result))
+                    else:
+                        self.window.on_success(rtt)
+                        answered(item, result)
+
+                for request_id in self.tracker.expire(self.window.timeout):
+                    self.window.on_timeout()
+                    self.metrics.incr('timeouts')
+                    retry(in_flight.pop(request_id), 'no response within {:.1f} seconds'.format(self.window.timeout))
+
+                update_progress()
+        finally:
+            self.socket.close()
+            self._close_journal(own_journal)
+            self.metrics.progress(int(self.metrics.counters.get('bars', 0)), total, 'bars')
+            self.metrics.close()
+
+        if self.tracker.aborted and (todo or self.tracker.pending_count):
+            print('Connection closed with {} requests pending'.format(len(todo) + self.tracker.pending_count))
+        # before the cache is merged back in, that replaces every bar just received by its stored copy
+        self._stop_counting()
+
+        if cache is not None:
+            # only windows that actually came back count as covered, a rerun picks up the rest
+            for (ticker, period), storage in self.bar_data_storages.items():
+                cache.store(storage, period, covered.get((ticker, period), []))
+            self._load_cached(cache)
+
+        for (ticker, period), storage in self.bar_data_storages.items():
+            print('{} {} {} bar data received and processed, completed!'.format(len(storage), ticker, period))
+            print('{} {} integrity: {}'.format(ticker, period, self.check(ticker, period).summary()))
+
+    def _close_journal(self, own_journal):
+        # type: (bool) -> None
+        journal, self.journal = self.journal, None
+        if journal is not None:
+            if own_journal:
+                journal.close()
+            else:
+                journal.flush()
+
+    def replay(self, file_path, pacing=None):
+        # type: (str, Optional[float]) -> int
+        """
+        feed a journal captured by request_data through the same decoding and storing again, no network
+        :param pacing: None as fast as the frames decode, 1.0 at the recorded pace, see replay_journal
+        :return: the number of frames
+        """
+        socket = ReplaySocket(self.socket.url)
+        self._start_counting()
+        count = replay_journal(file_path, functools.partial(self._on_message, self, socket), pacing)
+        self._stop_counting()
+        for (ticker, period), storage in self.bar_data_storages.items():
+            print('{} {} {} bar data replayed from {} frames'.format(len(storage), ticker, period, count))
+        return count
+
+    def _start_counting(self):
+        self._received = {key: [] for key in self.bar_data_storages}
+
+    def _stop_counting(self):
+        received, self._received = self._received, {}
+        for key, times in received.items():
+            times = np.concatenate(times) if times else np.empty(0, dtype=np.int64)
+            self.duplicate_counts[key] = len(times) - len(np.unique(times))
+
+    def check(self, ticker=None, period=None):
+        # type: (Optional[str], Optional[str]) -> IntegrityReport
+        """
+        integrity of a storage over start_date..end_date, missing head and tail included in the gaps,
+        duplicates are the bars the last request_data or replay received more than once
+        """
+        ticker = ticker or self.ticker
+        period = period or self.periods[0]
+        report = check_storage(
+            self.storage(ticker, period), *self.request_range(),
+            duplicate_count=self.duplicate_counts.get((ticker, period), 0)
+        )
+        self.integrity[(ticker, period)] = report
+        return report
+
+    def refetch_gaps(self, **kwargs):
+        # type: (...) -> Dict[Tuple[str, str], List[Tuple[int, int]]]
+        """
+        request the gaps check() finds in every storage again, quiet minutes without trades stay gaps
+        :param kwargs: passed on to request_data
+        :return: the ranges requested
+        """
+        ranges = {}
+        for ticker, period in self.bar_data_storages:
+            gaps = self.check(ticker, period).gaps
+            if gaps:
+                ranges[(ticker, period)] = gaps
+        if ranges:
+            self.request_data(ranges=ranges, **kwargs)
+        return ranges
+
+    def _load_cached(self, cache):
+        # type: (Optional[BarCache]) -> None
+        if cache is None:
+            return
+        start, stop = self.request_range()
+        for (ticker, period), storage in self.bar_data_storages.items():
+            storage.merge(cache.load(ticker, period, start, stop))
+
+    def _interleaved_requests(self, request_size, cache=None, ranges=None):
+        # type: (int, Optional[BarCache], Optional[Dict[Tuple[str, str], List[Tuple[int, int]]]]) -> List[Tuple[str, str, int, int]]
+        """
+        round robin over the request windows of every (ticker, period) so no single key hogs the queue
+        :param cache: leave out what the cache already holds
+        :param ranges: request only these ranges, the cache is not consulted
+        """
+        start, stop = self.request_range()
+        windows = []
+        for ticker, period in self.bar_data_storages:
+            if ranges is not None:
+                key_windows = []
+                for range_start, range_end in ranges.get((ticker, period), []):
+                    key_windows += epoch_windows(range_start, range_end, request_size, PERIOD_SPANS[period])
+            elif cache is None:
+                key_windows = epoch_windows(start, stop, request_size, PERIOD_SPANS[period])
+            else:
+                key_windows = cache.gap_windows(ticker, period, start, stop, request_size)
+            windows.append([(ticker, period) + window for window in key_windows])
+
+        requests = []
+        for i in range(max([len(key_windows) for key_windows in windows] + [0])):
+            requests += [key_windows[i] for key_windows in windows if i < len(key_windows)]
+        return requests
+
+    def request_range(self):
+        # type: () -> Tuple[int, int]
+        """
+        [start, end) epoch seconds of start_date..end_date in this replay's timezone
+        """
+        return request_range(self.start_date, self.end_date, self.timezone)
+
+    def file_name(self, extension, ticker=None, period=None):
+        # type: (str, Optional[str], Optional[str]) -> str
+        """
+        e.g. eosusdt_20190101_20190131.csv, what to_csv writes next to the module by default
+        """
+        ticker = ticker or self.ticker
+        period = period or self.periods[0]
+        # 1min keeps the historical file name
+        name = ticker if period == '1min' else ticker + '_' + period
+        return name + '_' + self.start_date.strftime('%Y%m%d') + '_' + self.end_date.strftime('%Y%m%d') + extension
+
+    def _default_file_path(self, extension, ticker=None, period=None):
+        # type: (str, Optional[str], Optional[str]) -> str
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), self.file_name(extension, ticker, period))
+
+    def to_csv(self, file_path=None, ticker=None, period=None, record_integrity=False):
+        """
+        :param record_integrity: also check the bars and record them in the integrity.json next to the
+            file, so a verifying from_csv does not have to check them again. off by default, a plain
+            export leaves nothing but the csv behind
+        """
 
         if file_path is None:
-            file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.ticker + '_' + self.start_date.strftime('%Y%m%d') + '_' + self.end_date.strftime('%Y%m%d') + '.csv')
+            file_path = self._default_file_path('.csv', ticker, period)
 
-        if self.bar_data_storage:
+        storage = self.storage(ticker, period)
+        if storage:
             print('Dumping data to csv file at ' + file_path)
             import pandas as pd
 
-            bar_data_df = pd.DataFrame()
-            i = 0
-            pgb = ProgressBar(total=len(self.bar_data_storage))
-            key_list = sorted(self.bar_data_storage.keys())
-
-            while i < len(key_list):
-                trade_datetime = key_list[i]
-                bar_data_df.at[trade_datetime, 'Ticker'] = self.bar_data_storage[trade_datetime].ticker
-                bar_data_df.at[trade_datetime, 'High'] = self.bar_data_storage[trade_datetime].high_price
-                bar_data_df.at[trade_datetime, 'Low'] = self.bar_data_storage[trade_datetime].low_price
-                bar_data_df.at[trade_datetime, 'Open'] = self.bar_data_storage[trade_datetime].open_price
-                bar_data_df.at[trade_datetime, 'Close'] = self.bar_data_storage[trade_datetime].close_price
-                bar_data_df.at[trade_datetime, 'Volume'] = self.bar_data_storage[trade_datetime].volume
-                bar_data_df.at[trade_datetime, 'Notional'] = self.bar_data_storage[trade_datetime].notional
-                pgb.current = i
-                pgb()
-                i += 1
-
-            pgb.done()
-            bar_data_df.sort_index(inplace=True)
+            bar_data_df = pd.DataFrame(
+                data={
+                    'Ticker': storage.ticker,
+                    'High': storage.high_price,
+                    'Low': storage.low_price,
+                    'Open': storage.open_price,
+                    'Close': storage.close_price,
+                    'Volume': storage.volume,
+                    'Notional': storage.notional
+                },
+                # formatting the index once up front is much cheaper than to_csv's date_format
+                index=pd.DatetimeIndex(storage.time.astype('datetime64[s]')).strftime(CSV_TIME_FORMAT)
+            )
             bar_data_df.to_csv(file_path, index_label='Time', index=True)
 
+            if record_integrity:
+                directory, file_name = os.path.split(os.path.abspath(file_path))
+                index = IntegrityIndex(directory)
+                index.record(file_name, check_storage(storage))
+                index.save()
+
         return file_path
 
-    def from_csv(self, file_path):
+    def from_csv(self, file_path=None, output='storage', ticker=None, period=None, verify=False):
+        """
+        load bars written by to_csv
+        :param file_path: defaults to the path to_csv writes to
+        :param output: 'storage' merges into the storage of ticker and period, 'arrays' returns a dict of
+            numpy columns and 'frame' returns the DataFrame, neither of the latter two touches any storage
+        :param verify: check the rows unless the integrity.json next to the file knows it unchanged, the
+            report goes to self.integrity and a warning is printed if it is not ok
+        """
+        assert output in ('storage', 'arrays', 'frame'), 'unknown output ' + str(output)
+
         if file_path is None:
-            file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.ticker + '_' + self.start_date.strftime('%Y%m%d') + '_' + self.end_date.strftime('%Y%m%d') + '.csv')
+            file_path = self._default_file_path('.csv', ticker, period)
 
         print('Loading data from csv file at ' + file_path)
 
         import pandas as pd
-        bar_data_df = pd.read_csv(file_path, index_col=0)
-        bar_data_df.index = pd.to_datetime(bar_data_df.index)
-        pgb = ProgressBar(total=len(bar_data_df))
-
-        i = 0
-        while i < len(bar_data_df):
-            trade_datetime = bar_data_df.index[i].to_pydatetime()
-
-            bar_data = BarData(
-                ticker=bar_data_df.at[trade_datetime, 'Ticker'],
-                high_price=bar_data_df.at[trade_datetime, 'High'],
-                low_price=bar_data_df.at[trade_datetime, 'Low'],
-                open_price=bar_data_df.at[trade_datetime, 'Open'],
-                close_price=bar_data_df.at[trade_datetime, 'Close'],
-                bar_start_time=trade_datetime,
-                bar_span=datetime.timedelta(minutes=1),
-                volume=bar_data_df.at[trade_datetime, 'Volume'],
-                notional=bar_data_df.at[trade_datetime, 'Notional']
-            )
-
-            self.bar_data_storage[bar_data.bar_start_time] = bar_data
-
-            pgb.current = i
-            pgb()
-            i += 1
-
-        pgb.done()
+        bar_data_df = pd.read_csv(file_path, dtype=CSV_DTYPES)
+        bar_data_df['Time'] = pd.to_datetime(bar_data_df['Time'], format=CSV_TIME_FORMAT)
+        bar_data_df.set_index('Time', inplace=True)
+
+        if output == 'frame':
+            return bar_data_df
+
+        arrays = {
+            'time': bar_data_df.index.values.astype('datetime64[s]').astype('int64'),
+            'open': bar_data_df['Open'].to_numpy(),
+            'high': bar_data_df['High'].to_numpy(),
+            'low': bar_data_df['Low'].to_numpy(),
+            'close': bar_data_df['Close'].to_numpy(),
+            'volume': bar_data_df['Volume'].to_numpy(),
+            'notional': bar_data_df['Notional'].to_numpy()
+        }
+
+        if verify:
+            directory, file_name = os.path.split(os.path.abspath(file_path))
+            index = IntegrityIndex(directory)
+            report, checked = index.verify(file_name, lambda _: check_bars(
+                arrays['time'], arrays['open'], arrays['high'], arrays['low'], arrays['close'], arrays['volume'],
+                PERIOD_SPANS[period or self.periods[0]]
+            ))
+            if checked:
+                index.save()
+            self.integrity[(ticker or self.ticker, period or self.periods[0])] = report
+            if not report.ok:
+                print('Integrity problems in {}: {}'.format(file_path, report.summary()))
+
+        if output == 'arrays':
+            return arrays
+
+        storage = self.storage(ticker, period)
+        storage.extend(
+            time=arrays['time'],
+            open_price=arrays['open'],
+            high_price=arrays['high'],
+            low_price=arrays['low'],
+            close_price=arrays['close'],
+            volume=arrays['volume'],
+            notional=arrays['notional']
+        )
+        return storage
+
+    def to_archive(self, root=None, partition=None, block_rows=None):
+        # type: (Optional[str], Optional[str], Optional[int]) -> List[str]
+        """
+        write every storage into the binary archive under root, see BarArchive
+        :param partition: 'day' or 'month', one file per ticker and period per partition. None keeps
+            what an existing archive uses, day for a new one
+        :param block_rows: block compress the partitions with this many rows per block, e.g. 4096
+        """
+        if root is None:
+            root = ARCHIVE_ROOT
+
+        print('Dumping data to archive at ' + root)
+        written = []
+        for storage in self.bar_data_storages.values():
+            if storage:
+                written += BarArchive.for_storage(root, storage, partition, block_rows).write(storage)
+        return written
+
+    def from_archive(self, root=None, start=None, end=None, output='storage', ticker=None, period=None,
+                     verify=False):
+        """
+        load archived bars, by default the start_date..end_date range of this replay, its days taken in
+        the replay's timezone, so the same bars come back as were downloaded
+        :param start: datetime or epoch seconds, naive datetimes are utc like query
+        :param output: 'storage' merges into bar_data_storage, 'records' returns the memory mapped record
+            views, one per partition, without copying anything
+        :param verify: leave out partitions whose checksum or integrity check fails, partitions the
+            archive's integrity.json knows unchanged are not checked again, see Integrity.load_verified
+        """
+        assert output in ('storage', 'records'), 'unknown output ' + str(output)
+
+        if root is None:
+            root = ARCHIVE_ROOT
+        default_start, default_end = self.request_range()
+        if start is None:
+            start = default_start
+        if end is None:
+            end = default_end
+
+        print('Loading data from archive at ' + root)
+        storage = self.storage(ticker, period)
+        archive = BarArchive.for_storage(root, storage)
+
+        if output == 'records':
+            return archive.read(start, end)
+
+        if not verify:
+            storage.merge(archive.load(start, end))
+            return storage
+
+        loaded, bad = load_verified(archive, start, end)
+        for file_name, report in sorted(bad.items()):
+            print('Skipping {}: {}'.format(os.path.join(archive.directory, file_name), report.summary()))
+        storage.merge(loaded)
+        return storage
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import asyncio
+import gzip
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from BarStorage import PERIOD_SPANS, bar_start
+
+KLINE_TOPIC = re.compile(r'^market\.(?P<ticker>[a-z0-9]+)\.kline\.(?P<period>\w+)$')
+SUB_TOPIC = re.compile(r'^market\.(?P<ticker>[a-z0-9]+)\.(?P<channel>kline\.\w+|trade\.detail|bbo)$')
+
+
+def synthetic_klines(ticker, period, request_from, request_to, max_bars=300):
+    # type: (str, str, int, int, int) -> List[Dict]
+    """
+    deterministic fake bars for every period start in [request_from, request_to], at most max_bars of them
+    """
+    span = int(PERIOD_SPANS[period].total_seconds())
+    seed = sum(ticker.encode('ascii'))
+    first = bar_start(request_from + span - 1, PERIOD_SPANS[period])
+
+    data = []
+    for bar_time in range(first, request_to + 1, span):
+        if len(data) == max_bars:
+            break
+        base = 5.0 + math.sin((bar_time + seed) / 7200.0) + (seed % 10) * 0.1
+        swing = 0.01 + 0.005 * math.cos(bar_time / 600.0)
+        amount = 1000.0 + (bar_time // span % 97) * 10.0
+        data.append({
+            'id': bar_time,
+            'open': round(base, 4),
+            'close': round(base + swing / 2, 4),
+            'low': round(base - swing, 4),
+            'high': round(base + swing, 4),
+            'amount': amount,
+            'vol': round(amount * base, 4),
+            'count': int(amount // 10)
+        })
+    return data
+
+
+class HuobiStandIn(object):
+    """
+    local websocket server speaking the huobi kline req protocol, gzip frames and pings included,
+    plus kline, trade detail and bbo subs pushing synthetic updates every push_interval seconds
+
+    use start() / stop() to run it on a background thread, or await serve() from a running loop.
+    needs the optional websockets package.
+    """
+
+    def __init__(
+            self,
+            host='127.0.0.1',  # type: str
+            port=0,  # type: int
+            ping_interval=5.0,  # type: Optional[float]
+            max_bars=300,  # type: int
+            push_interval=0.1,  # type: float
+            latency=0.0,  # type: float
+            jitter=0.0,  # type: float
+            seed=None,  # type: Optional[int]
+            compresslevel=6,  # type: int
+            max_pending=None,  # type: Optional[int]
+            drop_rate=0.0  # type: float
+    ):
+        """
+        :param push_interval: seconds between updates on every sub channel
+        :param latency: seconds every req response is held back, requests on one connection still overlap
+        :param jitter: up to this many seconds more or less latency, uniformly drawn per request
+        :param seed: seed of the jitter, for repeatable benchmark runs
+        :param compresslevel: gzip level of every frame, lower keeps the server's share of a benchmark small
+        :param max_pending: throttle like the real server, a connection with this many delayed responses
+            outstanding gets 'too-many-request' errors for further requests
+        :param drop_rate: fraction of requests never answered
+        """
+        self.host = host
+        self.port = port
+        self.ping_interval = ping_interval
+        self.max_bars = max_bars
+        self.push_interval = push_interval
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self.compresslevel = compresslevel
+        self.max_pending = max_pending
+        self.drop_rate = drop_rate
+
+        self.request_count = 0
+        self.connection_count = 0
+        self.throttled_count = 0
+        self.dropped_count = 0
+
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._stop = None  # type: Optional[asyncio.Future]
+        self._ready = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    @property
+    def url(self):
+        # type: () -> str
+        return 'ws://{}:{}'.format(self.host, self.port)
+
+    def respond(self, message):
+        # type: (Dict) -> Dict
+        match = KLINE_TOPIC.match(str(message.get('req', '')))
+        if match is None or match.group('period') not in PERIOD_SPANS:
+            return {
+                'id': message.get('id'),
+                'status': 'error',
+                'err-code': 'bad-request',
+                'err-msg': 'invalid topic ' + str(message.get('req')),
+                'ts': int(time.time() * 1000)
+            }
+
+        return {
+            'id': message.get('id'),
+            'rep': message['req'],
+            'status': 'ok',
+            'data': synthetic_klines(
+                ticker=match.group('ticker'),
+                period=match.group('period'),
+                request_from=int(message['from']),
+                request_to=int(message['to']),
+                max_bars=self.max_bars
+            )
+        }
+
+    def tick(self, topic, now_ms):
+        # type: (str, int) -> Dict
+        """
+        one update for a sub channel at time now_ms
+        """
+        match = SUB_TOPIC.match(topic)
+        ticker, channel = match.group('ticker'), match.group('channel')
+        now = now_ms // 1000
+
+        if channel.startswith('kline.'):
+            period = channel.split('.', 1)[1]
+            start = bar_start(now, PERIOD_SPANS[period])
+            bar = synthetic_klines(ticker, period, start, start)[0]
+            bar['close'] = round(bar['close'] + (now - start) * 1e-4, 4)
+            return bar
+
+        price = synthetic_klines(ticker, '1min', now - now % 60, now - now % 60)[0]['close']
+        if channel == 'bbo':
+            return {
+                'symbol': ticker,
+                'quoteTime': now_ms,
+                'seqId': now_ms,
+                'bid': round(price - 0.0001, 4),
+                'bidSize': 10.0 + now % 7,
+                'ask': round(price + 0.0001, 4),
+                'askSize': 10.0 + now % 5
+            }
+
+        return {
+            'id': now_ms,
+            'ts': now_ms,
+            'data': [{
+                'id': now_ms * 10 + i,
+                'ts': now_ms,
+                'tradeId': now_ms * 10 + i,
+                'amount': 1.0 + i,
+                'price': price,
+                'direction': 'buy' if (now_ms + i) % 2 else 'sell'
+            } for i in range(2)]
+        }
+
+    async def _push(self, socket, topic):
+        while True:
+            now_ms = int(time.time() * 1000)
+            await self._send(socket, {'ch': topic, 'ts': now_ms, 'tick': self.tick(topic, now_ms)})
+            await asyncio.sleep(self.push_interval)
+
+    async def _send(self, socket, payload):
+        # compact separators, like the real server
+        await socket.send(gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), self.compresslevel))
+
+    def delay(self):
+        # type: () -> float
+        return max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+
+    async def _respond_later(self, socket, message, delay):
+        await asyncio.sleep(delay)
+        await self._send(socket, self.respond(message))
+
+    async def _ping(self, socket):
+        while True:
+            await self._send(socket, {'ping': int(time.time() * 1000)})
+            await asyncio.sleep(self.ping_interval)
+
+    async def _handler(self, socket, *args):
+        # newer websockets call handler(connection), older ones handler(connection, path)
+        self.connection_count += 1
+        tasks = {asyncio.ensure_future(self._ping(socket))} if self.ping_interval else set()
+        responding = set()
+        try:
+            async for raw in socket:
+                message = json.loads(raw)
+                if 'pong' in message:
+                    continue
+                if 'sub' in message:
+                    ok = SUB_TOPIC.match(str(message['sub'])) is not None
+                    await self._send(socket, {
+                        'id': message.get('id'),
+                        'status': 'ok' if ok else 'error',
+                        'subbed' if ok else 'err-msg': message['sub'],
+                        'ts': int(time.time() * 1000)
+                    })
+                    if ok:
+                        tasks.add(asyncio.ensure_future(self._push(socket, message['sub'])))
+                    continue
+                self.request_count += 1
+                if self.drop_rate and self._random.random() < self.drop_rate:
+                    self.dropped_count += 1
+                    continue
+                if self.max_pending is not None and len(responding) >= self.max_pending:
+                    self.throttled_count += 1
+                    await self._send(socket, {
+                        'id': message.get('id'),
+                        'status': 'error',
+                        'err-code': 'too-many-request',
+                        'err-msg': 'too many requests in flight',
+                        'ts': int(time.time() * 1000)
+                    })
+                    continue
+                delay = self.delay()
+                if delay > 0:
+                    # answered from its own task so later requests are not held up behind this one
+                    task = asyncio.ensure_future(self._respond_later(socket, message, delay))
+                    tasks.add(task)
+                    responding.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(responding.discard)
+                else:
+                    await self._send(socket, self.respond(message))
+        except Exception:
+            # the client hanging up mid request is not the stand-in's problem
+            pass
+        finally:
+            for task in list(tasks):
+                task.cancel()
+
+    async def serve(self):
+        import websockets
+
+        self._stop = asyncio.get_running_loop().create_future()
+        server = await websockets.serve(self._handler, self.host, self.port, max_size=None)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            await self._stop
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self.serve())
+        finally:
+            self._loop.close()
+
+    def start(self, timeout=10.0):
+        # type: (float) -> str
+        """
+        run the server on a daemon thread
+        :return: the url to connect to
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError('stand in server did not start within {} seconds'.format(timeout))
+        return self.url
+
+    def stop(self):
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(lambda: self._stop.done() or self._stop.set_result(None))
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    stand_in = HuobiStandIn(port=8765)
+    print('Serving huobi stand in at ' + stand_in.url)
+    asyncio.run(stand_in.serve())
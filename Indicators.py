@@ -0,0 +1,535 @@
+import collections
+import math
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from BarStorage import BarDataStorage, period_name, to_epoch
+from DataStructure import BarData
+
+NAN = float('NaN')
+
+
+def _rolling_sum(values, window):
+    # type: (np.ndarray, int) -> np.ndarray
+    """
+    sum of every window values ending at each row, NaN until there are window of them
+    """
+    total = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    out = np.full(len(values), NAN)
+    if len(values) >= window:
+        out[window - 1:] = total[window:] - total[:-window]
+    return out
+
+
+def _rolling_extreme(values, window, ufunc):
+    # type: (np.ndarray, int, np.ufunc) -> np.ndarray
+    """
+    rolling max or min in O(n) whatever the window (van Herk / Gil-Werman): running extremes from the
+    start and from the end of every window sized block, each window spans at most two blocks
+    """
+    count = len(values)
+    out = np.full(count, NAN)
+    if count < window:
+        return out
+    fill = -np.inf if ufunc is np.maximum else np.inf
+    blocks = np.concatenate((values, np.full(-count % window, fill))).reshape(-1, window)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    out[window - 1:] = ufunc(suffix[:count - window + 1], prefix[window - 1:count])
+    return out
+
+
+class _WindowSum(object):
+    """
+    running sum over the last window values
+    """
+    __slots__ = ('window', 'values', 'total')
+
+    def __init__(self, window, history=()):
+        # type: (int, Sequence[float]) -> None
+        self.window = window
+        self.values = collections.deque(maxlen=window)
+        self.total = 0.0
+        for value in history[-window:] if window else history:
+            self.add(value)
+
+    def add(self, value):
+        # type: (float) -> float
+        if len(self.values) == self.window:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        return self.total
+
+    @property
+    def full(self):
+        # type: () -> bool
+        return len(self.values) == self.window
+
+
+class Indicator(object):
+    """
+    one indicator with fixed parameters
+
+    compute() does a whole history in one vectorized pass, stepper() returns an object whose
+    update(open, high, low, close, volume, notional) takes one more bar in O(1) and gives the value
+    compute() would have given for it. values are NaN until there is enough history.
+    """
+
+    # bars before a row its value depends on
+    lookback = 0
+
+    def __init__(self, **params):
+        self.params = params
+
+    @property
+    def key(self):
+        # type: () -> Tuple[Hashable, ...]
+        return (type(self).__name__,) + tuple(sorted(self.params.items()))
+
+    @property
+    def name(self):
+        # type: () -> str
+        return '_'.join([self.prefix] + [str(value) for _, value in sorted(self.params.items())
+                                         if value is not None and value is not False])
+
+    prefix = ''
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, value) for name, value in sorted(self.params.items())))
+
+    def compute(self, columns, start=0):
+        # type: (Dict[str, np.ndarray], int) -> np.ndarray
+        """
+        values of rows start.. of BarDataStorage columns, the rows before start only as history
+        """
+        lo = max(0, start - self.lookback)
+        return self._compute({name: column[lo:] for name, column in columns.items()})[start - lo:]
+
+    def _compute(self, columns):
+        # type: (Dict[str, np.ndarray]) -> np.ndarray
+        raise NotImplementedError
+
+    def stepper(self, columns):
+        # type: (Dict[str, np.ndarray]) -> object
+        """
+        incremental state carried on from the history in columns
+        """
+        raise NotImplementedError
+
+
+class VWAP(Indicator):
+    """
+    notional over volume of the last window bars, of every bar so far without a window
+    """
+    prefix = 'vwap'
+
+    def __init__(self, window=None):
+        # type: (Optional[int]) -> None
+        super(VWAP, self).__init__(window=window)
+        self.window = window
+        self.lookback = (window or 1) - 1
+
+    def compute(self, columns, start=0):
+        if self.window is not None:
+            return super(VWAP, self).compute(columns, start)
+        # running totals carried in from the history instead of a lookback
+        notional = np.cumsum(columns['notional'][start:]) + columns['notional'][:start].sum()
+        volume = np.cumsum(columns['volume'][start:]) + columns['volume'][:start].sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(volume > 0, notional / volume, NAN)
+
+    def _compute(self, columns):
+        notional = _rolling_sum(columns['notional'], self.window)
+        volume = _rolling_sum(columns['volume'], self.window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(volume > 0, notional / volume, NAN)
+
+    def stepper(self, columns):
+        return _VWAPStepper(self.window, columns)
+
+
+class _VWAPStepper(object):
+    __slots__ = ('notional', 'volume')
+
+    def __init__(self, window, columns):
+        if window is None:
+            self.notional = _WindowSum(0)
+            self.volume = _WindowSum(0)
+            self.notional.total = float(columns['notional'].sum())
+            self.volume.total = float(columns['volume'].sum())
+        else:
+            self.notional = _WindowSum(window, columns['notional'][-window:].tolist())
+            self.volume = _WindowSum(window, columns['volume'][-window:].tolist())
+
+    def update(self, open_price, high_price, low_price, close_price, volume, notional):
+        if self.notional.window:
+            self.notional.add(notional)
+            self.volume.add(volume)
+            if not self.volume.full:
+                return NAN
+        else:
+            self.notional.total += notional
+            self.volume.total += volume
+        return self.notional.total / self.volume.total if self.volume.total > 0 else NAN
+
+
+class SMA(Indicator):
+    """
+    mean of a column over the last window bars
+    """
+    prefix = 'sma'
+
+    def __init__(self, window, column='close'):
+        # type: (int, str) -> None
+        super(SMA, self).__init__(window=window, column=column)
+        self.window = window
+        self.column = column
+        self.lookback = window - 1
+
+    @property
+    def name(self):
+        # type: () -> str
+        return 'sma_{}'.format(self.window) if self.column == 'close' else 'sma_{}_{}'.format(self.column, self.window)
+
+    def _compute(self, columns):
+        return _rolling_sum(columns[self.column], self.window) / self.window
+
+    def stepper(self, columns):
+        return _SMAStepper(self.window, self.column, columns)
+
+
+class _SMAStepper(object):
+    __slots__ = ('sum', 'index')
+
+    def __init__(self, window, column, columns):
+        self.sum = _WindowSum(window, columns[column][-window:].tolist())
+        self.index = ('open', 'high', 'low', 'close', 'volume', 'notional').index(column)
+
+    def update(self, *bar):
+        total = self.sum.add(bar[self.index])
+        return total / self.sum.window if self.sum.full else NAN
+
+
+class RollingHigh(Indicator):
+    """
+    highest high of the last window bars
+    """
+    prefix = 'high'
+    column = 'high'
+    ufunc = np.maximum
+
+    def __init__(self, window):
+        # type: (int) -> None
+        super(RollingHigh, self).__init__(window=window)
+        self.window = window
+        self.lookback = window - 1
+
+    def _compute(self, columns):
+        return _rolling_extreme(columns[self.column], self.window, self.ufunc)
+
+    def stepper(self, columns):
+        return _ExtremeStepper(self.window, self.ufunc is np.maximum, columns[self.column][-self.window:].tolist())
+
+
+class RollingLow(RollingHigh):
+    """
+    lowest low of the last window bars
+    """
+    prefix = 'low'
+    column = 'low'
+    ufunc = np.minimum
+
+
+class _ExtremeStepper(object):
+    """
+    monotonic deque of (bar, value) candidates, amortized O(1) per bar
+    """
+    __slots__ = ('window', 'highest', 'candidates', 'count')
+
+    def __init__(self, window, highest, history):
+        # type: (int, bool, List[float]) -> None
+        self.window = window
+        self.highest = highest
+        self.candidates = collections.deque()
+        self.count = 0
+        for value in history:
+            self._add(value)
+
+    def _add(self, value):
+        candidates = self.candidates
+        if self.highest:
+            while candidates and candidates[-1][1] <= value:
+                candidates.pop()
+        else:
+            while candidates and candidates[-1][1] >= value:
+                candidates.pop()
+        candidates.append((self.count, value))
+        if candidates[0][0] <= self.count - self.window:
+            candidates.popleft()
+        self.count += 1
+        return candidates[0][1] if self.count >= self.window else NAN
+
+    def update(self, open_price, high_price, low_price, close_price, volume, notional):
+        return self._add(high_price if self.highest else low_price)
+
+
+class Returns(Indicator):
+    """
+    close over the close period bars before, less one, or the log of the ratio
+    """
+    prefix = 'return'
+
+    def __init__(self, period=1, log=False):
+        # type: (int, bool) -> None
+        super(Returns, self).__init__(period=period, log=log)
+        self.period = period
+        self.log = log
+        self.lookback = period
+
+    @property
+    def name(self):
+        # type: () -> str
+        return '{}return_{}'.format('log_' if self.log else '', self.period)
+
+    def _compute(self, columns):
+        close = columns['close']
+        out = np.full(len(close), NAN)
+        ratio = close[self.period:] / close[:-self.period]
+        out[self.period:] = np.log(ratio) if self.log else ratio - 1
+        return out
+
+    def stepper(self, columns):
+        return _ReturnsStepper(self.period, self.log, columns['close'][-self.period:].tolist())
+
+
+class _ReturnsStepper(object):
+    __slots__ = ('closes', 'log')
+
+    def __init__(self, period, log, history):
+        self.closes = collections.deque(history, maxlen=period)
+        self.log = log
+
+    def update(self, open_price, high_price, low_price, close_price, volume, notional):
+        closes = self.closes
+        value = NAN
+        if len(closes) == closes.maxlen:
+            ratio = close_price / closes[0]
+            value = math.log(ratio) if self.log else ratio - 1
+        closes.append(close_price)
+        return value
+
+
+class Volatility(Indicator):
+    """
+    sample standard deviation of the log returns of the last window bars, per bar, not annualized
+    """
+    prefix = 'volatility'
+
+    def __init__(self, window):
+        # type: (int) -> None
+        assert window >= 2, 'volatility needs a window of at least 2'
+        super(Volatility, self).__init__(window=window)
+        self.window = window
+        self.lookback = window
+
+    def _compute(self, columns):
+        close = columns['close']
+        out = np.full(len(close), NAN)
+        if len(close) < 2:
+            return out
+        returns = np.log(close[1:] / close[:-1])
+        window = self.window
+        first = _rolling_sum(returns, window)
+        second = _rolling_sum(returns * returns, window)
+        variance = (second - first * first / window) / (window - 1)
+        out[1:] = np.sqrt(np.maximum(variance, 0.0))
+        return out
+
+    def stepper(self, columns):
+        close = columns['close'][-self.window - 1:]
+        return _VolatilityStepper(self.window, np.log(close[1:] / close[:-1]).tolist(),
+                                  float(close[-1]) if len(close) else None)
+
+
+class _VolatilityStepper(object):
+    __slots__ = ('first', 'second', 'last_close')
+
+    def __init__(self, window, returns, last_close):
+        self.first = _WindowSum(window, returns)
+        self.second = _WindowSum(window, [value * value for value in returns])
+        self.last_close = last_close
+
+    def update(self, open_price, high_price, low_price, close_price, volume, notional):
+        last_close, self.last_close = self.last_close, close_price
+        if last_close is None:
+            return NAN
+        value = math.log(close_price / last_close)
+        first = self.first.add(value)
+        second = self.second.add(value * value)
+        if not self.first.full:
+            return NAN
+        window = self.first.window
+        return math.sqrt(max((second - first * first / window) / (window - 1), 0.0))
+
+
+class _Series(object):
+    """
+    indicator values of one ticker and period in arrays that grow by doubling, so live bars append in
+    O(1) amortized
+    """
+
+    def __init__(self, keys, capacity=1024):
+        # type: (Sequence[Tuple], int) -> None
+        self.size = 0
+        self.time = np.empty(capacity, dtype=np.int64)
+        self.values = {key: np.empty(capacity) for key in keys}  # type: Dict[Tuple, np.ndarray]
+        # the bar columns the values were computed from, until steppers are built from them
+        self.columns = {name: np.empty(0) for name in BarDataStorage.COLUMNS}  # type: Optional[Dict[str, np.ndarray]]
+        self.steppers = None  # type: Optional[Dict[Tuple, object]]
+
+    def _reserve(self, count):
+        capacity = len(self.time)
+        if self.size + count <= capacity:
+            return
+        while capacity < self.size + count:
+            capacity = max(capacity * 2, 1024)
+        grown = np.empty(capacity, dtype=np.int64)
+        grown[:self.size] = self.time[:self.size]
+        self.time = grown
+        for key, values in self.values.items():
+            grown = np.empty(capacity)
+            grown[:self.size] = values[:self.size]
+            self.values[key] = grown
+
+    @property
+    def last_time(self):
+        # type: () -> Optional[int]
+        return int(self.time[self.size - 1]) if self.size else None
+
+    def extend(self, time, values):
+        # type: (np.ndarray, Dict[Tuple, np.ndarray]) -> None
+        self._reserve(len(time))
+        self.time[self.size:self.size + len(time)] = time
+        for key, column in values.items():
+            self.values[key][self.size:self.size + len(time)] = column
+        self.size += len(time)
+
+    def append(self, time, values):
+        # type: (int, Dict[Tuple, float]) -> None
+        self._reserve(1)
+        self.time[self.size] = time
+        for key, value in values.items():
+            self.values[key][self.size] = value
+        self.size += 1
+
+
+class IndicatorEngine(object):
+    """
+    a declared set of indicators over bars of any number of tickers and periods
+
+    compute(storage) runs every indicator over the storage's columns in one vectorized pass each and
+    caches the results by (ticker, period) and indicator key, the class and its parameters. computing
+    the same storage again after bars were appended only computes the new rows. update() and on_bar()
+    take one closed live bar and update every indicator in O(1), a backtest computing over history and
+    live trading feeding bars get the same values.
+    """
+
+    def __init__(self, indicators):
+        # type: (Sequence[Indicator]) -> None
+        self.indicators = list(indicators)
+        names = [indicator.name for indicator in self.indicators]
+        assert len(set(names)) == len(names), 'indicator names must be unique, got ' + str(names)
+        self._series = {}  # type: Dict[Tuple[str, str], _Series]
+
+    def _new_series(self):
+        # type: () -> _Series
+        return _Series([indicator.key for indicator in self.indicators])
+
+    def compute(self, storage, period=None):
+        # type: (BarDataStorage, Optional[str]) -> Dict[str, np.ndarray]
+        """
+        every indicator over the storage by name, views into the cache that stay valid until the next
+        compute or update of the same ticker and period
+        :param period: defaults to the period of the storage's bar span
+        """
+        key = (storage.ticker, period or period_name(storage.bar_span))
+        time = storage.time
+        series = self._series.get(key)
+        if series is None or series.size > len(time) or (series.size and time[series.size - 1] != series.last_time):
+            # new, or the history changed under it
+            series = self._series[key] = self._new_series()
+
+        start = series.size
+        if start < len(time):
+            columns = {name: storage.column(name) for name in BarDataStorage.COLUMNS}
+            series.extend(time[start:], {
+                indicator.key: indicator.compute(columns, start) for indicator in self.indicators
+            })
+            series.columns = columns
+            series.steppers = None
+
+        return self.values(*key)
+
+    def values(self, ticker, period='1min'):
+        # type: (str, str) -> Dict[str, np.ndarray]
+        series = self._series.get((ticker, period))
+        if series is None:
+            return {indicator.name: np.empty(0) for indicator in self.indicators}
+        return {indicator.name: series.values[indicator.key][:series.size] for indicator in self.indicators}
+
+    def cached(self, ticker, period, indicator):
+        # type: (str, str, Indicator) -> Optional[np.ndarray]
+        series = self._series.get((ticker, period))
+        if series is None or indicator.key not in series.values:
+            return None
+        return series.values[indicator.key][:series.size]
+
+    def times(self, ticker, period='1min'):
+        # type: (str, str) -> np.ndarray
+        series = self._series.get((ticker, period))
+        return series.time[:series.size] if series is not None else np.empty(0, dtype=np.int64)
+
+    def update(self, ticker, period, time, open_price, high_price, low_price, close_price, volume, notional):
+        # type: (str, str, int, float, float, float, float, float, float) -> Dict[str, float]
+        """
+        one more closed bar, time in epoch seconds after the last bar of ticker and period
+        :return: the value of every indicator for it by name
+        """
+        series = self._series.get((ticker, period))
+        if series is None:
+            series = self._series[(ticker, period)] = self._new_series()
+        if series.size and time <= series.last_time:
+            raise ValueError('bar at {} is not after the last bar at {}'.format(time, series.last_time))
+
+        if series.steppers is None:
+            series.steppers = {indicator.key: indicator.stepper(series.columns) for indicator in self.indicators}
+            series.columns = None
+
+        values = {
+            key: stepper.update(open_price, high_price, low_price, close_price, volume, notional)
+            for key, stepper in series.steppers.items()
+        }
+        series.append(time, values)
+        return {indicator.name: values[indicator.key] for indicator in self.indicators}
+
+    def on_bar(self, bar_data):
+        # type: (BarData) -> Dict[str, float]
+        """
+        update() from a BarData, fits BarAggregator's on_bar
+        """
+        return self.update(
+            bar_data.ticker, period_name(bar_data.bar_span), to_epoch(bar_data.bar_start_time), bar_data.open_price,
+            bar_data.high_price, bar_data.low_price, bar_data.close_price, bar_data.volume, bar_data.notional
+        )
+
+    def invalidate(self, ticker=None, period=None):
+        # type: (Optional[str], Optional[str]) -> None
+        """
+        drop cached values, e.g. after bars were replaced in the middle of a storage
+        """
+        for key in list(self._series):
+            if (ticker is None or key[0] == ticker) and (period is None or key[1] == period):
+                del self._series[key]
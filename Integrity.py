@@ -0,0 +1,404 @@
+import contextlib
+import datetime
+import json
+import os
+import time
+import zlib
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from BarArchive import BarArchive
+from BarCache import Interval, merge_intervals, subtract_intervals
+from BarStorage import BarDataStorage, bar_offset, bar_start
+
+INTEGRITY_FILE = 'integrity.json'
+
+# offending bar times kept per check, the counts are always exact
+MAX_LISTED = 100
+
+
+class IntegrityReport(object):
+    """
+    outcome of check_bars: missing ranges, duplicate, out of order and misaligned rows and bars whose
+    prices contradict each other
+
+    gaps are [start, end) epoch second ranges without a bar. they are not errors by themselves, a quiet
+    minute has no kline, so ok only looks at the rest and complete at the gaps.
+    """
+
+    def __init__(
+            self,
+            count=0,  # type: int
+            first=None,  # type: Optional[int]
+            last=None,  # type: Optional[int]
+            bar_span=60,  # type: int
+            gaps=(),  # type: Sequence[Interval]
+            duplicate_count=0,  # type: int
+            out_of_order_count=0,  # type: int
+            misaligned_count=0,  # type: int
+            bad_ohlc_count=0,  # type: int
+            bad_ohlc_times=(),  # type: Sequence[int]
+            checksum_ok=True  # type: bool
+    ):
+        self.count = count
+        self.first = first
+        self.last = last
+        self.bar_span = bar_span
+        self.gaps = [(int(start), int(end)) for start, end in gaps]
+        self.duplicate_count = duplicate_count
+        self.out_of_order_count = out_of_order_count
+        self.misaligned_count = misaligned_count
+        self.bad_ohlc_count = bad_ohlc_count
+        self.bad_ohlc_times = [int(value) for value in bad_ohlc_times]
+        self.checksum_ok = checksum_ok
+
+    @property
+    def missing_count(self):
+        # type: () -> int
+        return sum((end - start) // self.bar_span for start, end in self.gaps)
+
+    @property
+    def ok(self):
+        # type: () -> bool
+        return self.checksum_ok and not (
+            self.duplicate_count or self.out_of_order_count or self.misaligned_count or self.bad_ohlc_count
+        )
+
+    @property
+    def complete(self):
+        # type: () -> bool
+        return not self.gaps
+
+    def to_dict(self):
+        # type: () -> Dict
+        return {
+            'count': self.count,
+            'first': self.first,
+            'last': self.last,
+            'bar_span': self.bar_span,
+            'gaps': [list(gap) for gap in self.gaps],
+            'duplicate_count': self.duplicate_count,
+            'out_of_order_count': self.out_of_order_count,
+            'misaligned_count': self.misaligned_count,
+            'bad_ohlc_count': self.bad_ohlc_count,
+            'bad_ohlc_times': self.bad_ohlc_times,
+            'checksum_ok': self.checksum_ok
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        # type: (Dict) -> IntegrityReport
+        return cls(**values)
+
+    def summary(self):
+        # type: () -> str
+        parts = ['{} bars'.format(self.count)]
+        if self.gaps:
+            parts.append('{} missing in {} gaps'.format(self.missing_count, len(self.gaps)))
+        for name in ('duplicate', 'out_of_order', 'misaligned', 'bad_ohlc'):
+            value = getattr(self, name + '_count')
+            if value:
+                parts.append('{} {}'.format(value, name.replace('_', ' ')))
+        if not self.checksum_ok:
+            parts.append('checksum mismatch')
+        return ', '.join(parts)
+
+    def __repr__(self):
+        return 'IntegrityReport({})'.format(self.summary())
+
+
+def check_bars(time, open_price, high_price, low_price, close_price, volume=None,
+               bar_span=datetime.timedelta(minutes=1), start=None, end=None):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray], datetime.timedelta, Optional[int], Optional[int]) -> IntegrityReport
+    """
+    vectorized integrity pass over bar columns in the order they were stored, nothing is copied
+    unless the times are out of order
+    :param start: with end, the [start, end) epoch second range the bars should cover, missing head
+        and tail count as gaps too. without them only the holes between the first and last bar do
+    """
+    time = np.asarray(time, dtype=np.int64)
+    span = int(bar_span.total_seconds())
+    offset = bar_offset(bar_span)
+
+    step = np.diff(time)
+    out_of_order_count = int(np.count_nonzero(step < 0))
+    ordered = np.sort(time) if out_of_order_count else time
+    if out_of_order_count:
+        step = np.diff(ordered)
+    repeated = step == 0
+    duplicate_count = int(np.count_nonzero(repeated))
+    if duplicate_count:
+        ordered = ordered[np.concatenate(([True], ~repeated))]
+        step = np.diff(ordered)
+
+    holes = np.flatnonzero(step > span)
+    gaps = list(zip((ordered[holes] + span).tolist(), ordered[holes + 1].tolist()))
+    if start is not None and end is not None:
+        if not len(ordered):
+            gaps = [(start, end)]
+        else:
+            # the first bar that starts in the range, days and weeks need not start where it does
+            if ordered[0] > bar_start(start + span - 1, bar_span):
+                gaps.insert(0, (start, int(ordered[0])))
+            if ordered[-1] + span < end:
+                gaps.append((int(ordered[-1]) + span, end))
+        # bars outside the range do not make gaps inside it
+        gaps = [(max(gap_start, start), min(gap_end, end)) for gap_start, gap_end in gaps
+                if gap_end > start and gap_start < end]
+
+    high = np.asarray(high_price)
+    low = np.asarray(low_price)
+    bad = (high < low) | ~np.isfinite(high) | ~np.isfinite(low)
+    for price in (open_price, close_price):
+        price = np.asarray(price)
+        bad |= (price > high) | (price < low) | ~np.isfinite(price)
+    if volume is not None:
+        bad |= np.asarray(volume) < 0
+    bad_rows = np.flatnonzero(bad)
+
+    return IntegrityReport(
+        count=len(time),
+        first=int(ordered[0]) if len(ordered) else None,
+        last=int(ordered[-1]) if len(ordered) else None,
+        bar_span=span,
+        gaps=gaps,
+        duplicate_count=duplicate_count,
+        out_of_order_count=out_of_order_count,
+        misaligned_count=int(np.count_nonzero((time - offset) % span)),
+        bad_ohlc_count=len(bad_rows),
+        bad_ohlc_times=time[bad_rows[:MAX_LISTED]]
+    )
+
+
+def check_storage(storage, start=None, end=None, duplicate_count=0):
+    # type: (BarDataStorage, Optional[int], Optional[int], int) -> IntegrityReport
+    """
+    check_bars over a storage, its columns are sorted and unique by construction
+    :param duplicate_count: bars the caller saw more than once on their way in, e.g. received twice in
+        one download. the storage cannot tell those from its own merges, a cache merged back in
+        replaces every row with an equal copy
+    """
+    report = check_bars(
+        storage.time, storage.open_price, storage.high_price, storage.low_price, storage.close_price,
+        storage.volume, storage.bar_span, start, end
+    )
+    report.duplicate_count = duplicate_count
+    return report
+
+
+def check_records(records, bar_span, start=None, end=None):
+    # type: (np.ndarray, datetime.timedelta, Optional[int], Optional[int]) -> IntegrityReport
+    """
+    check_bars over BarArchive records
+    """
+    return check_bars(
+        records['time'], records['open'], records['high'], records['low'], records['close'], records['volume'],
+        bar_span, start, end
+    )
+
+
+@contextlib.contextmanager
+def _locked(path, stale_after=10.0):
+    # type: (str, float) -> Iterator[None]
+    """
+    an exclusive lock on a file next to path. flock where there is one, the kernel lets go of it when
+    the holder dies. elsewhere the lock file is created exclusively and only taken over once its own
+    mtime is stale_after seconds old, however long the waiter has been waiting
+    """
+    lock_path = path + '.lock'
+    if fcntl is not None:
+        with open(lock_path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return
+
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > stale_after:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                # released in the meantime
+                continue
+            time.sleep(0.005)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+
+def file_checksum(file_path, chunk_size=1 << 20):
+    # type: (str, int) -> str
+    checksum = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            checksum = zlib.crc32(chunk, checksum)
+    return '{:08x}'.format(checksum)
+
+
+class IntegrityIndex(object):
+    """
+    integrity.json in a data directory: the checksum, size, mtime and IntegrityReport of every file
+    checked there
+
+    known() trusts a file whose size and mtime are unchanged since it was checked, without reading it.
+    verify() only reads and checks the rest, a file that was touched but still has its checksum keeps
+    its report. save() merges into what is on disk, so processes writing files into the same directory
+    do not drop each other's entries.
+    """
+
+    def __init__(self, directory):
+        # type: (str) -> None
+        self.directory = directory
+        self.path = os.path.join(directory, INTEGRITY_FILE)
+        self.files = self._load()  # type: Dict[str, Dict]
+        self._changed = set()
+
+    def _load(self):
+        # type: () -> Dict[str, Dict]
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)['files']
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with _locked(self.path):
+            files = self._load()
+            files.update((file_name, self.files[file_name]) for file_name in self._changed)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'files': files}, f, indent=1, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+        self.files = files
+        self._changed.clear()
+
+    def _stat(self, file_name):
+        # type: (str) -> Tuple[int, int]
+        stat = os.stat(os.path.join(self.directory, file_name))
+        return stat.st_size, stat.st_mtime_ns
+
+    def known(self, file_name):
+        # type: (str) -> Optional[IntegrityReport]
+        """
+        the stored report if the file has not changed since, None if it has to be checked
+        """
+        entry = self.files.get(file_name)
+        if entry is None or not os.path.exists(os.path.join(self.directory, file_name)):
+            return None
+        if tuple(self._stat(file_name)) != (entry['size'], entry['mtime_ns']):
+            return None
+        return IntegrityReport.from_dict(entry['report'])
+
+    def known_good(self, file_name):
+        # type: (str) -> bool
+        report = self.known(file_name)
+        return report is not None and report.ok
+
+    def record(self, file_name, report, checksum=None):
+        # type: (str, IntegrityReport, Optional[str]) -> None
+        size, mtime_ns = self._stat(file_name)
+        self.files[file_name] = {
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'crc32': checksum or file_checksum(os.path.join(self.directory, file_name)),
+            'checked': int(time.time()),
+            'report': report.to_dict()
+        }
+        self._changed.add(file_name)
+
+    def verify(self, file_name, check, expected_checksum=None, full=False):
+        # type: (str, Callable[[str], IntegrityReport], Optional[str], bool) -> Tuple[IntegrityReport, bool]
+        """
+        :param check: runs the checks on the file at the given path
+        :param expected_checksum: what the file should hash to, e.g. from the writer's own index
+        :param full: recompute the checksum and rerun the checks even for unchanged files
+        :return: the report and whether the file had to be read
+        """
+        if not full:
+            report = self.known(file_name)
+            if report is not None:
+                return report, False
+
+        file_path = os.path.join(self.directory, file_name)
+        checksum = file_checksum(file_path)
+        entry = self.files.get(file_name)
+        if not full and entry is not None and entry['crc32'] == checksum:
+            # touched but not changed
+            report = IntegrityReport.from_dict(entry['report'])
+        else:
+            report = check(file_path)
+        report.checksum_ok = expected_checksum is None or expected_checksum == checksum
+        self.record(file_name, report, checksum)
+        return report, True
+
+
+def verify_archive(archive, start=None, end=None, full=False):
+    # type: (BarArchive, Optional[int], Optional[int], bool) -> Dict[str, IntegrityReport]
+    """
+    IntegrityReport of every partition overlapping [start, end) epoch seconds, partitions the archive's
+    integrity.json already knows unchanged are not read
+    """
+    index = IntegrityIndex(archive.directory)
+    bar_span = archive.bar_span
+    reports = {}
+    checked = False
+    for file_name in archive.partitions(start, end):
+        meta = archive.index['partitions'][file_name]
+        reports[file_name], read = index.verify(
+            file_name,
+            lambda file_path: check_records(archive.records(os.path.basename(file_path)), bar_span),
+            meta.get('crc32'),
+            full
+        )
+        checked |= read
+    if checked:
+        index.save()
+    return reports
+
+
+def archive_gaps(archive, start, end, reports=None):
+    # type: (BarArchive, int, int, Optional[Dict[str, IntegrityReport]]) -> List[Interval]
+    """
+    [start, end) epoch second ranges without bars in the archive: holes inside partitions plus ranges
+    no partition covers, ready to be turned into requests
+    """
+    if reports is None:
+        reports = verify_archive(archive, start, end)
+    span = int(archive.bar_span.total_seconds())
+    covered = []
+    gaps = []
+    for file_name, report in reports.items():
+        meta = archive.index['partitions'][file_name]
+        covered.append((meta['first'], meta['last'] + span))
+        gaps += report.gaps
+    gaps += subtract_intervals(start, end, merge_intervals(covered))
+    return [(max(gap_start, start), min(gap_end, end)) for gap_start, gap_end in merge_intervals(gaps)
+            if gap_end > start and gap_start < end]
+
+
+def load_verified(archive, start=None, end=None, full=False):
+    # type: (BarArchive, Optional[int], Optional[int], bool) -> Tuple[BarDataStorage, Dict[str, IntegrityReport]]
+    """
+    archive.load without the partitions that fail verification
+    :return: the storage and the reports of the partitions left out
+    """
+    reports = verify_archive(archive, start, end, full)
+    bad = {file_name: report for file_name, report in reports.items() if not report.ok}
+    return archive.load(start, end, exclude=bad), bad
@@ -0,0 +1,289 @@
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from BarStorage import BarDataStorage
+from DataStructure import BarData, Instruction, Report, TradeSide
+
+
+class Position(object):
+    """
+    long and short book of one ticker, amounts and costs are kept apart like huobi contract positions
+
+    costs are the average cost of what is still open times its amount, margin the margin still held
+    """
+    __slots__ = (
+        'ticker', 'long_amount', 'long_cost', 'long_margin', 'short_amount', 'short_cost', 'short_margin',
+        'realized_pnl', 'last_price'
+    )
+
+    def __init__(self, ticker):
+        # type: (str) -> None
+        self.ticker = ticker
+        self.long_amount = 0
+        self.long_cost = 0.0
+        self.long_margin = 0.0
+        self.short_amount = 0
+        self.short_cost = 0.0
+        self.short_margin = 0.0
+        self.realized_pnl = 0.0
+        self.last_price = float('NaN')
+
+    @property
+    def net_amount(self):
+        # type: () -> int
+        return self.long_amount - self.short_amount
+
+    @property
+    def long_average_price(self):
+        # type: () -> float
+        return self.long_cost / self.long_amount if self.long_amount else float('NaN')
+
+    @property
+    def short_average_price(self):
+        # type: () -> float
+        return self.short_cost / self.short_amount if self.short_amount else float('NaN')
+
+    @property
+    def unrealized_pnl(self):
+        # type: () -> float
+        """
+        against last_price, zero while flat or before the first mark
+        """
+        if not self.long_amount and not self.short_amount:
+            return 0.0
+        long_pnl = self.long_amount * self.last_price - self.long_cost
+        short_pnl = self.short_cost - self.short_amount * self.last_price
+        return long_pnl + short_pnl
+
+    @property
+    def margin(self):
+        # type: () -> float
+        return self.long_margin + self.short_margin
+
+    @property
+    def pnl(self):
+        # type: () -> float
+        return self.realized_pnl + self.unrealized_pnl
+
+
+def _carried(amount, add, start_amount=0, start_value=0.0):
+    # type: (np.ndarray, np.ndarray, float, float) -> np.ndarray
+    """
+    value carried by an average cost book after every fill, e.g. cost or margin
+
+    an open (amount > 0) adds add, a close keeps the value in proportion to the amount left:
+    value[t] = value[t - 1] * held[t] / held[t - 1]. the recurrence is solved by a prefix scan over
+    (ratio, added) pairs in log2(n) vectorized steps. every ratio is at most 1 and one that closes the
+    book is 0, so nothing is scaled up and the rounding stays at a few ulps however long the book is
+    never flat.
+    """
+    if not len(amount):
+        return np.zeros(0)
+    held = start_amount + np.cumsum(amount)
+    held_before = np.concatenate(([start_amount], held[:-1])).astype(np.float64)
+
+    opening = amount > 0
+    ratio = np.ones(len(amount))
+    closing = ~opening & (held_before > 0)
+    ratio[closing] = held[closing] / held_before[closing]
+    value = np.where(opening, add, 0.0)
+    # what was open before the batch comes in through the first fill
+    value[0] += ratio[0] * start_value
+
+    # after the pass with width w, value[t] and ratio[t] compose fills t - 2 * w + 1..t
+    width = 1
+    while width < len(value):
+        value[width:] = value[width:] + ratio[width:] * value[:-width]
+        ratio[width:] = ratio[width:] * ratio[:-width]
+        width *= 2
+    return value
+
+
+class Ledger(object):
+    """
+    positions, average costs, realized and unrealized pnl and margin per ticker, updated per Report
+
+    on_report and mark are O(1). apply_arrays books a whole fill history at once with the same average
+    cost rules. margin comes from Report.Margin when set, else margin_rate times the notional of an open,
+    and is released in proportion on closes.
+    """
+
+    def __init__(self, margin_rate=None):
+        # type: (Optional[float]) -> None
+        self.margin_rate = margin_rate
+        self.positions = {}  # type: Dict[str, Position]
+
+    def position(self, ticker):
+        # type: (str) -> Position
+        position = self.positions.get(ticker)
+        if position is None:
+            position = self.positions[ticker] = Position(ticker)
+        return position
+
+    def _open_margin(self, report):
+        # type: (Report) -> float
+        if report.Margin is not None:
+            return report.Margin
+        if self.margin_rate is not None:
+            return abs(report.Notional) * self.margin_rate
+        return 0.0
+
+    def on_report(self, report):
+        # type: (Report) -> float
+        """
+        book one fill
+        :return: the pnl it realized
+        """
+        position = self.position(report.Ticker)
+        side = report.Side
+        amount = abs(report.Amount)
+        notional = abs(report.Notional)
+        realized = 0.0
+        if not amount:
+            return realized
+
+        if side is TradeSide.LongOpen:
+            position.long_amount += amount
+            position.long_cost += notional
+            position.long_margin += self._open_margin(report)
+        elif side is TradeSide.ShortOpen:
+            position.short_amount += amount
+            position.short_cost += notional
+            position.short_margin += self._open_margin(report)
+        elif side is TradeSide.LongClose:
+            if amount > position.long_amount:
+                raise ValueError(
+                    'closing {} long {} with only {} open'.format(amount, report.Ticker, position.long_amount)
+                )
+            kept = (position.long_amount - amount) / position.long_amount
+            realized = notional - position.long_cost * (1 - kept)
+            position.long_amount -= amount
+            position.long_cost *= kept
+            position.long_margin *= kept
+        elif side is TradeSide.ShortClose:
+            if amount > position.short_amount:
+                raise ValueError(
+                    'closing {} short {} with only {} open'.format(amount, report.Ticker, position.short_amount)
+                )
+            kept = (position.short_amount - amount) / position.short_amount
+            realized = position.short_cost * (1 - kept) - notional
+            position.short_amount -= amount
+            position.short_cost *= kept
+            position.short_margin *= kept
+        else:
+            raise ValueError('invalid trade side {}'.format(side))
+
+        position.realized_pnl += realized
+        position.last_price = notional / amount
+        return realized
+
+    def apply(self, reports):
+        # type: (Iterable[Report]) -> None
+        for report in reports:
+            self.on_report(report)
+
+    def mark(self, ticker, price):
+        # type: (str, float) -> None
+        self.position(ticker).last_price = price
+
+    def on_bar(self, bar_data):
+        # type: (BarData) -> None
+        self.position(bar_data.ticker).last_price = bar_data.close_price
+
+    def mark_storage(self, storage):
+        # type: (BarDataStorage) -> None
+        """
+        mark against the last close of a storage
+        """
+        if len(storage):
+            self.mark(storage.ticker, float(storage.close_price[-1]))
+
+    def apply_arrays(self, ticker, side, amount, notional, margin=None):
+        # type: (str, object, np.ndarray, np.ndarray, Optional[np.ndarray]) -> np.ndarray
+        """
+        book many fills of one ticker in order, vectorized
+        :param side: TradeSide values or members, array like
+        :param margin: margin of every fill, defaults to margin_rate times notional
+        :return: the pnl realized by every fill
+        """
+        side = np.array([getattr(value, 'value', value) for value in side], dtype=np.int8) \
+            if not isinstance(side, np.ndarray) else side
+        amount = np.abs(np.asarray(amount, dtype=np.float64))
+        notional = np.abs(np.asarray(notional, dtype=np.float64))
+        if margin is None:
+            margin = notional * (self.margin_rate or 0.0)
+        margin = np.asarray(margin, dtype=np.float64)
+
+        position = self.position(ticker)
+        realized = np.zeros(len(amount))
+        books = (
+            (TradeSide.LongOpen, TradeSide.LongClose, 1.0, 'long'),
+            (TradeSide.ShortOpen, TradeSide.ShortClose, -1.0, 'short')
+        )
+        for open_side, close_side, sign, book in books:
+            fills = np.flatnonzero((side == open_side.value) | (side == close_side.value))
+            if not len(fills):
+                continue
+            signed = np.where(side[fills] == open_side.value, amount[fills], -amount[fills])
+            start_amount = getattr(position, book + '_amount')
+            if start_amount + np.cumsum(signed).min() < 0:
+                raise ValueError('{} {} book closes more than it holds'.format(ticker, book))
+
+            cost = _carried(signed, notional[fills], start_amount, getattr(position, book + '_cost'))
+            cost_before = np.concatenate(([getattr(position, book + '_cost')], cost[:-1]))
+            held_margin = _carried(signed, margin[fills], start_amount, getattr(position, book + '_margin'))
+
+            closing = signed < 0
+            realized[fills[closing]] = sign * (notional[fills][closing] - (cost_before - cost)[closing])
+
+            setattr(position, book + '_amount', type(start_amount)(start_amount + signed.sum()))
+            setattr(position, book + '_cost', float(cost[-1]))
+            setattr(position, book + '_margin', float(held_margin[-1]))
+
+        position.realized_pnl += float(realized.sum())
+        if len(amount) and amount[-1]:
+            position.last_price = float(notional[-1] / amount[-1])
+        return realized
+
+    @staticmethod
+    def reserved_margin(instructions):
+        # type: (Iterable[Instruction]) -> float
+        """
+        estimated margin of the unfilled part of live orders, e.g. OrderManager.live()
+        """
+        reserved = 0.0
+        for instruction in instructions:
+            if instruction.Amount:
+                reserved += instruction.Margin * (instruction.Amount - instruction.FilledAmount) / instruction.Amount
+        return reserved
+
+    @property
+    def realized_pnl(self):
+        # type: () -> float
+        return sum(position.realized_pnl for position in self.positions.values())
+
+    @property
+    def unrealized_pnl(self):
+        # type: () -> float
+        return sum(position.unrealized_pnl for position in self.positions.values())
+
+    @property
+    def margin(self):
+        # type: () -> float
+        return sum(position.margin for position in self.positions.values())
+
+    def summary(self):
+        # type: () -> Dict[str, Dict[str, float]]
+        return {
+            ticker: {
+                'long_amount': position.long_amount,
+                'long_average_price': position.long_average_price,
+                'short_amount': position.short_amount,
+                'short_average_price': position.short_average_price,
+                'realized_pnl': position.realized_pnl,
+                'unrealized_pnl': position.unrealized_pnl,
+                'margin': position.margin
+            }
+            for ticker, position in self.positions.items()
+        }
@@ -0,0 +1,351 @@
+import functools
+import json
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import websocket
+
+import HuobiClient
+from BarArchive import RECORD_DTYPE
+from FrameDecoder import FrameDecoder
+from FrameJournal import FrameJournal, ReplaySocket, replay_journal
+from HuobiClient import HUOBI_WS_URL, kline_topic
+from OrderBook import DEFAULT_LEVELS, MarketDepth, OrderBook, depth_topic, mbp_topic
+
+TRADE_DTYPE = np.dtype([
+    ('time', '<i8'),  # milliseconds
+    ('trade_id', '<i8'),
+    ('price', '<f8'),
+    ('amount', '<f8'),
+    ('direction', 'i1')  # 1 buy, -1 sell
+])
+
+BBO_DTYPE = np.dtype([
+    ('time', '<i8'),  # milliseconds
+    ('seq_id', '<i8'),
+    ('bid_price', '<f8'),
+    ('bid_amount', '<f8'),
+    ('ask_price', '<f8'),
+    ('ask_amount', '<f8')
+])
+
+
+def trade_topic(ticker):
+    # type: (str) -> str
+    return "market.{}.trade.detail".format(ticker)
+
+
+def bbo_topic(ticker):
+    # type: (str) -> str
+    return "market.{}.bbo".format(ticker)
+
+
+class RingBuffer(object):
+    """
+    fixed capacity record buffer, allocated once, the oldest records are overwritten when it is full
+    """
+
+    def __init__(self, dtype, capacity):
+        # type: (np.dtype, int) -> None
+        assert capacity > 0, 'capacity must be positive'
+
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.total = 0  # records ever pushed
+
+        self._records = np.zeros(capacity, dtype=self.dtype)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def push(self, record):
+        # type: (tuple) -> None
+        with self._lock:
+            self._records[self.total % self.capacity] = record
+            self.total += 1
+
+    def replace_last(self, record):
+        # type: (tuple) -> None
+        """
+        overwrite the newest record, e.g. another update of a kline that has not closed yet
+        """
+        with self._lock:
+            if self.total == 0:
+                self._records[0] = record
+                self.total = 1
+            else:
+                self._records[(self.total - 1) % self.capacity] = record
+
+    def extend(self, records):
+        # type: (np.ndarray) -> None
+        records = np.asarray(records, dtype=self.dtype)
+        count = len(records)
+        # only the newest capacity records stay, the rest still count towards total
+        records = records[-self.capacity:]
+        with self._lock:
+            start = (self.total + count - len(records)) % self.capacity
+            first = min(len(records), self.capacity - start)
+            self._records[start:start + first] = records[:first]
+            self._records[:len(records) - first] = records[first:]
+            self.total += count
+
+    def latest(self):
+        # type: () -> Optional[np.void]
+        with self._lock:
+            if self.total == 0:
+                return None
+            return self._records[(self.total - 1) % self.capacity].copy()
+
+    def snapshot(self, count=None):
+        # type: (Optional[int]) -> np.ndarray
+        """
+        copy of the newest count records, oldest first
+        """
+        with self._lock:
+            size = len(self)
+            count = size if count is None else min(count, size)
+            end = self.total % self.capacity
+            index = np.arange(end - count, end) % self.capacity
+            return self._records[index]
+
+
+class MarketStream(object):
+    """
+    live kline, trade detail, bbo and depth subscriptions for many tickers over one socket
+
+    every channel writes into its own RingBuffer so memory stays flat however long the stream runs.
+    bbo and depth ticks also update the ticker's OrderBook in depth, the depth channels' buffers hold
+    the best bid and ask (BBO_DTYPE) after every update. incremental mbp books ask for a snapshot on
+    subscribing and again whenever a sequence gap is found.
+    callbacks registered with on() are called on the socket thread with (channel, record) right after
+    the record is stored, keep them short. with a journal every raw frame is captured before decoding,
+    replay() feeds a capture back through the same path.
+    """
+
+    def __init__(self, url=HUOBI_WS_URL, capacity=4096, depth=None, journal=None):
+        # type: (str, int, Optional[MarketDepth], Optional[FrameJournal]) -> None
+        self.capacity = capacity
+        self.journal = journal
+        self.buffers = {}  # type: Dict[str, RingBuffer]
+        self.depth = depth if depth is not None else MarketDepth()
+        self.connected = False
+
+        self._parsers = {}  # type: Dict[str, Callable]
+        self._callbacks = {}  # type: Dict[str, List[Callable]]
+        self._snapshot_requests = {}  # type: Dict[str, str]  # incremental mbp channel to its ticker
+        self._requested = set()  # snapshots asked for and not yet received
+        self._connected_event = threading.Event()
+        self.decoder = FrameDecoder()
+
+        self.socket = websocket.WebSocketApp(
+            url=url,
+            on_open=functools.partial(self._on_open, self),
+            on_message=functools.partial(self._on_message, self),
+            on_error=self._on_error,
+            on_close=functools.partial(self._on_close, self)
+        )
+        self.socket_thread = None  # type: Optional[threading.Thread]
+
+    def _subscribe(self, channel, dtype, parser, capacity):
+        if channel not in self.buffers:
+            self.buffers[channel] = RingBuffer(dtype, capacity or self.capacity)
+            self._parsers[channel] = parser
+            if self.connected:
+                self._send_sub(channel)
+        return channel
+
+    def subscribe_kline(self, ticker, period='1min', capacity=None):
+        # type: (str, str, Optional[int]) -> str
+        return self._subscribe(kline_topic(ticker, period), RECORD_DTYPE, self._store_kline, capacity)
+
+    def subscribe_trades(self, ticker, capacity=None):
+        # type: (str, Optional[int]) -> str
+        return self._subscribe(trade_topic(ticker), TRADE_DTYPE, self._store_trades, capacity)
+
+    def subscribe_bbo(self, ticker, capacity=None):
+        # type: (str, Optional[int]) -> str
+        return self._subscribe(
+            bbo_topic(ticker), BBO_DTYPE, functools.partial(self._store_bbo, self.depth, ticker), capacity
+        )
+
+    def subscribe_depth(self, ticker, step='step0', capacity=None):
+        # type: (str, str, Optional[int]) -> str
+        """
+        full book every second, step0 is unaggregated
+        """
+        return self._subscribe(
+            depth_topic(ticker, step), BBO_DTYPE, functools.partial(self._store_depth, self.depth, ticker), capacity
+        )
+
+    def subscribe_mbp(self, ticker, levels=DEFAULT_LEVELS, refresh=False, capacity=None):
+        # type: (str, int, bool, Optional[int]) -> str
+        """
+        market by price, a full refresh of levels every 100ms, or with refresh false only the changed
+        levels as they change on top of a snapshot
+        """
+        channel = mbp_topic(ticker, levels, refresh)
+        if refresh:
+            return self._subscribe(
+                channel, BBO_DTYPE, functools.partial(self._store_depth, self.depth, ticker), capacity
+            )
+        self._snapshot_requests[channel] = ticker
+        return self._subscribe(channel, BBO_DTYPE, functools.partial(self._store_mbp, channel, ticker), capacity)
+
+    def book(self, ticker):
+        # type: (str) -> OrderBook
+        return self.depth.book(ticker)
+
+    def on(self, channel, callback):
+        # type: (str, Callable[[str, np.void], None]) -> None
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    def buffer(self, channel):
+        # type: (str) -> RingBuffer
+        return self.buffers[channel]
+
+    def snapshot(self, channel, count=None):
+        # type: (str, Optional[int]) -> np.ndarray
+        return self.buffers[channel].snapshot(count)
+
+    def latest(self, channel):
+        # type: (str) -> Optional[np.void]
+        return self.buffers[channel].latest()
+
+    def start(self, connect_timeout=30.0):
+        # type: (Optional[float]) -> None
+        # looked up now, callers set HuobiClient.HTTP_PROXY after importing it
+        proxy = HuobiClient.HTTP_PROXY
+        self.socket_thread = threading.Thread(
+            target=self.socket.run_forever,
+            kwargs={'http_proxy_host': proxy[0], 'http_proxy_port': proxy[1], 'proxy_type': 'http'},
+            daemon=True
+        )
+        self.socket_thread.start()
+        if not self._connected_event.wait(connect_timeout):
+            self.socket.close()
+            raise TimeoutError('could not connect to {} within {} seconds'.format(self.socket.url, connect_timeout))
+
+    def stop(self):
+        self.socket.close()
+        if self.socket_thread is not None:
+            self.socket_thread.join()
+            self.socket_thread = None
+        self.depth.flush()
+        if self.journal is not None:
+            self.journal.flush()
+
+    def replay(self, file_path, pacing=None):
+        # type: (str, Optional[float]) -> int
+        """
+        feed a journal into the subscribed channels as if it came off the socket, subscribe first
+        :param pacing: None as fast as the frames decode, 1.0 at the recorded pace, see replay_journal
+        :return: the number of frames
+        """
+        socket = ReplaySocket(self.socket.url)
+        return replay_journal(file_path, functools.partial(self._on_message, self, socket), pacing)
+
+    def _send_sub(self, channel):
+        self.socket.send(json.dumps({"sub": channel, "id": str(uuid.uuid1())}))
+        if channel in self._snapshot_requests:
+            self._request_snapshot(channel)
+
+    def _request_snapshot(self, channel):
+        # the reply carries data instead of tick and rep instead of ch, see _on_message
+        self._requested.add(channel)
+        self.socket.send(json.dumps({"req": channel, "id": str(uuid.uuid1())}))
+
+    @staticmethod
+    def _on_open(self, socket):
+        self.connected = True
+        for channel in self.buffers:
+            self._send_sub(channel)
+        self._connected_event.set()
+
+    @staticmethod
+    def _on_close(self, socket, *args):
+        self.connected = False
+        self._requested.clear()
+        self._connected_event.clear()
+
+    @staticmethod
+    def _on_error(socket, error):
+        print(error)
+        socket.close()
+
+    @staticmethod
+    def _on_message(self, socket, message):
+        if self.journal is not None:
+            self.journal.append(message)
+        ping, result = self.decoder.decode(message)
+        if ping is not None:
+            socket.send(json.dumps({"pong": ping}))
+            return
+
+        channel = result.get('ch')
+        if channel is not None:
+            parser = self._parsers.get(channel)
+            if parser is None:
+                return
+            parser(self.buffers[channel], result['tick'], result.get('ts'))
+        elif result.get('rep') in self._snapshot_requests and 'data' in result:
+            channel = result['rep']
+            self._requested.discard(channel)
+            book = self.depth.on_depth(self._snapshot_requests[channel], result['data'], result.get('ts'))
+            self._push_top(self.buffers[channel], book)
+        else:
+            # sub acknowledgements and errors
+            if result.get('status') == 'error':
+                print('Subscription error: ' + str(result.get('err-msg')))
+            return
+
+        callbacks = self._callbacks.get(channel)
+        if callbacks:
+            record = self.buffers[channel].latest()
+            for callback in callbacks:
+                callback(channel, record)
+
+    @staticmethod
+    def _store_kline(buffer, tick, time_ms=None):
+        # type: (RingBuffer, Dict, Optional[int]) -> None
+        record = (tick['id'], tick['open'], tick['high'], tick['low'], tick['close'], tick['amount'], tick['vol'])
+        latest = buffer.latest()
+        # a kline is pushed on every trade until it closes, only a new bar start takes a new slot
+        if latest is not None and latest['time'] == tick['id']:
+            buffer.replace_last(record)
+        else:
+            buffer.push(record)
+
+    @staticmethod
+    def _store_trades(buffer, tick, time_ms=None):
+        # type: (RingBuffer, Dict, Optional[int]) -> None
+        buffer.extend(np.array([
+            (trade['ts'], trade['tradeId'], trade['price'], trade['amount'], 1 if trade['direction'] == 'buy' else -1)
+            for trade in tick['data']
+        ], dtype=TRADE_DTYPE))
+
+    @staticmethod
+    def _push_top(buffer, book):
+        # type: (RingBuffer, OrderBook) -> None
+        bid_price, bid_size, ask_price, ask_size = book.best()
+        buffer.push((book.time, -1 if book.seq is None else book.seq, bid_price, bid_size, ask_price, ask_size))
+
+    @staticmethod
+    def _store_bbo(depth, ticker, buffer, tick, time_ms=None):
+        # type: (MarketDepth, str, RingBuffer, Dict, Optional[int]) -> None
+        buffer.push((tick['quoteTime'], tick['seqId'], tick['bid'], tick['bidSize'], tick['ask'], tick['askSize']))
+        depth.on_bbo(ticker, tick)
+
+    @staticmethod
+    def _store_depth(depth, ticker, buffer, tick, time_ms=None):
+        # type: (MarketDepth, str, RingBuffer, Dict, Optional[int]) -> None
+        MarketStream._push_top(buffer, depth.on_depth(ticker, tick, time_ms))
+
+    def _store_mbp(self, channel, ticker, buffer, tick, time_ms=None):
+        # type: (str, str, RingBuffer, Dict, Optional[int]) -> None
+        if self.depth.on_mbp(ticker, tick, time_ms):
+            self._push_top(buffer, self.depth.book(ticker))
+        elif channel not in self._requested and self.connected:
+            self._request_snapshot(channel)
@@ -0,0 +1,271 @@
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+class LatencyReservoir(object):
+    """
+    the latest capacity samples in a ring, percentiles are only computed when a snapshot asks for them
+    """
+
+    def __init__(self, capacity=4096):
+        # type: (int) -> None
+        self._samples = np.zeros(capacity)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        # type: (float) -> None
+        self._samples[self.count % len(self._samples)] = value
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def summary(self, percentiles=PERCENTILES):
+        # type: (Sequence[int]) -> Dict[str, float]
+        summary = {'count': self.count, 'mean': self.total / self.count if self.count else 0.0, 'max': self.max}
+        samples = self._samples[:min(self.count, len(self._samples))]
+        for percentile, value in zip(percentiles, np.percentile(samples, percentiles) if len(samples) else
+                                     [0.0] * len(percentiles)):
+            summary['p{}'.format(percentile)] = float(value)
+        return summary
+
+
+class Metrics(object):
+    """
+    counters, gauges, latency percentiles and progress, emitted to sinks at most once per interval
+
+    incr, observe and progress only touch a dict and a few numbers. tick() is what callers sprinkle in
+    their loops, it costs one clock read unless interval has passed, then a snapshot goes to every sink.
+    sources are callables returning extra gauges, read only when a snapshot is taken, e.g. the counters
+    a FrameDecoder keeps anyway.
+    """
+
+    def __init__(self, sinks=(), interval=1.0, name=''):
+        # type: (Sequence[Sink], float, str) -> None
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.name = name
+
+        self.counters = {}  # type: Dict[str, float]
+        self.gauges = {}  # type: Dict[str, float]
+        self.latencies = {}  # type: Dict[str, LatencyReservoir]
+        self.sources = []  # type: List[Callable[[], Dict[str, float]]]
+        self._progress = None  # type: Optional[Dict]
+
+        self.started = time.monotonic()
+        self._next_emit = self.started + interval
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        # type: (str, float) -> None
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        # type: (str, float) -> None
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        # type: (str, float) -> None
+        reservoir = self.latencies.get(name)
+        if reservoir is None:
+            reservoir = self.latencies[name] = LatencyReservoir()
+        reservoir.add(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        # type: (str) -> Iterator[None]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def progress(self, current, total, unit=''):
+        # type: (float, float, str) -> None
+        self._progress = {'current': current, 'total': total, 'unit': unit}
+
+    def sum_counters(self, counters):
+        # type: (Iterable[Dict[str, float]]) -> None
+        """
+        replace the counters with the sum of several sets, e.g. the latest snapshots of worker processes
+        """
+        totals = {}  # type: Dict[str, float]
+        for one in counters:
+            for name, value in one.items():
+                totals[name] = totals.get(name, 0) + value
+        self.counters = totals
+
+    def add_source(self, source):
+        # type: (Callable[[], Dict[str, float]]) -> None
+        self.sources.append(source)
+
+    def snapshot(self):
+        # type: () -> Dict
+        elapsed = time.monotonic() - self.started
+        # one copy of each, the socket thread can add names while these are built
+        counters = dict(self.counters)
+        latencies = dict(self.latencies)
+        gauges = dict(self.gauges)
+        for source in self.sources:
+            gauges.update(source())
+        snapshot = {
+            'name': self.name,
+            'time': time.time(),
+            'elapsed': elapsed,
+            'counters': counters,
+            'rates': {name: value / elapsed if elapsed else 0.0 for name, value in counters.items()},
+            'gauges': gauges,
+            'latency': {name: reservoir.summary() for name, reservoir in latencies.items()}
+        }
+        if self._progress is not None:
+            snapshot['progress'] = dict(self._progress)
+        return snapshot
+
+    def tick(self):
+        # type: () -> bool
+        """
+        emit if interval has passed since the last emit
+        :return: whether a snapshot was emitted
+        """
+        if time.monotonic() < self._next_emit:
+            return False
+        self.emit()
+        return True
+
+    def emit(self):
+        with self._lock:
+            self._next_emit = time.monotonic() + self.interval
+            if not self.sinks:
+                return
+            snapshot = self.snapshot()
+            for sink in self.sinks:
+                sink.emit(snapshot)
+
+    def close(self):
+        """
+        a last snapshot whatever the interval, then close the sinks
+        """
+        self.emit()
+        for sink in self.sinks:
+            sink.close()
+
+
+class Sink(object):
+    def emit(self, snapshot):
+        # type: (Dict) -> None
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TerminalSink(Sink):
+    """
+    one line redrawn in place: progress bar, counter rates and latency percentiles
+    """
+
+    def __init__(self, output=sys.stderr, width=40, rates=None, latencies=None):
+        # type: (IO, int, Optional[Sequence[str]], Optional[Sequence[str]]) -> None
+        """
+        :param rates: counters to show as rates, all of them by default
+        :param latencies: latencies to show percentiles of, all of them by default
+        """
+        self.output = output
+        self.width = width
+        self.rates = rates
+        self.latencies = latencies
+        self._drawn = False
+        self._length = 0
+
+    def render(self, snapshot):
+        # type: (Dict) -> str
+        parts = []
+        progress = snapshot.get('progress')
+        if progress is not None:
+            fraction = min(progress['current'] / float(progress['total']), 1.0) if progress['total'] else 0.0
+            size = int(self.width * fraction)
+            parts.append('[{}{}] {:3d}% {}/{} {}'.format(
+                '=' * size, ' ' * (self.width - size), int(fraction * 100), progress['current'], progress['total'],
+                progress['unit']).rstrip())
+        for name, rate in snapshot['rates'].items():
+            if self.rates is None or name in self.rates:
+                parts.append('{:.0f} {}/s'.format(rate, name))
+        for name, latency in snapshot['latency'].items():
+            if self.latencies is None or name in self.latencies:
+                parts.append('{} p50 {:.1f}ms p99 {:.1f}ms'.format(name, latency['p50'] * 1e3, latency['p99'] * 1e3))
+        return ' | '.join(parts)
+
+    def emit(self, snapshot):
+        # type: (Dict) -> None
+        line = self.render(snapshot)
+        # pad over whatever is left of a longer previous line
+        self.output.write('\r' + line.ljust(self._length))
+        self.output.flush()
+        self._length = len(line)
+        self._drawn = True
+
+    def close(self):
+        if self._drawn:
+            self.output.write('\n')
+            self.output.flush()
+
+
+class LogSink(Sink):
+    def __init__(self, logger=None, level=logging.INFO):
+        # type: (Optional[logging.Logger], int) -> None
+        self.logger = logger if logger is not None else logging.getLogger('huobi.metrics')
+        self.level = level
+
+    def emit(self, snapshot):
+        # type: (Dict) -> None
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, '%s %s', snapshot['name'], json.dumps(snapshot, separators=(',', ':')))
+
+
+class JsonLinesSink(Sink):
+    """
+    one json object per snapshot, for dashboards and benchmark scripts
+    """
+
+    def __init__(self, output):
+        # type: (Union[str, IO]) -> None
+        self._owned = isinstance(output, str)
+        self.output = open(output, 'a') if self._owned else output
+
+    def emit(self, snapshot):
+        # type: (Dict) -> None
+        self.output.write(json.dumps(snapshot, separators=(',', ':')) + '\n')
+        self.output.flush()
+
+    def close(self):
+        if self._owned:
+            self.output.close()
+
+
+class QueueSink(Sink):
+    """
+    (key, snapshot) onto a queue, e.g. a multiprocessing one a parent process aggregates its workers from
+    """
+
+    def __init__(self, queue, key=None):
+        # type: (Any, Optional[str]) -> None
+        """
+        :param key: tells the workers apart, the snapshot name by default
+        """
+        self.queue = queue
+        self.key = key
+
+    def emit(self, snapshot):
+        # type: (Dict) -> None
+        self.queue.put((snapshot['name'] if self.key is None else self.key, snapshot))
@@ -0,0 +1,469 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_LEVELS = 20
+# updates held while waiting for the snapshot of an incremental book
+MAX_PENDING = 1000
+
+SNAPSHOT_FILE = 'columns.json'
+SNAPSHOT_VERSION = 1
+# column name, dtype, values per row (0 is one per row, else one per level)
+SNAPSHOT_COLUMNS = (
+    ('time', '<i8', 0),  # milliseconds
+    ('seq', '<i8', 0),
+    ('bid_price', '<f8', 1),
+    ('bid_size', '<f8', 1),
+    ('ask_price', '<f8', 1),
+    ('ask_size', '<f8', 1)
+)
+
+
+def depth_topic(ticker, step='step0'):
+    # type: (str, str) -> str
+    return "market.{}.depth.{}".format(ticker, step)
+
+
+def mbp_topic(ticker, levels=DEFAULT_LEVELS, refresh=False):
+    # type: (str, int, bool) -> str
+    return "market.{}.mbp.{}{}".format(ticker, 'refresh.' if refresh else '', levels)
+
+
+class _BookSide(object):
+    """
+    price levels of one side, best first, in arrays allocated once
+
+    keys are the prices times sign, ascending for both sides, so bids (sign -1) and asks (sign 1) share
+    the search. levels past capacity are dropped, a full depth feed sends them again when they come in.
+    """
+    __slots__ = ('sign', 'keys', 'sizes', 'count')
+
+    def __init__(self, sign, capacity):
+        # type: (int, int) -> None
+        self.sign = sign
+        self.keys = np.full(capacity, np.inf)
+        self.sizes = np.zeros(capacity)
+        self.count = 0
+
+    def clear(self):
+        self.keys[:self.count] = np.inf
+        self.sizes[:self.count] = 0.0
+        self.count = 0
+
+    def replace(self, levels):
+        # type: (Sequence[Sequence[float]]) -> None
+        """
+        every level at once from [[price, size], ...], best first as huobi sends them
+        """
+        self.clear()
+        count = min(len(levels), len(self.keys))
+        if count:
+            values = np.asarray(levels[:count], dtype=np.float64)
+            self.keys[:count] = values[:, 0] * self.sign
+            self.sizes[:count] = values[:, 1]
+        self.count = count
+
+    def set(self, price, size):
+        # type: (float, float) -> None
+        """
+        size at price, zero removes the level, shifting the levels behind it in place
+        """
+        key = price * self.sign
+        count = self.count
+        i = int(self.keys[:count].searchsorted(key))
+        if i < count and self.keys[i] == key:
+            if size > 0:
+                self.sizes[i] = size
+            else:
+                self.keys[i:count - 1] = self.keys[i + 1:count]
+                self.sizes[i:count - 1] = self.sizes[i + 1:count]
+                self.keys[count - 1] = np.inf
+                self.sizes[count - 1] = 0.0
+                self.count = count - 1
+        elif size > 0 and i < len(self.keys):
+            end = min(count, len(self.keys) - 1)
+            self.keys[i + 1:end + 1] = self.keys[i:end]
+            self.sizes[i + 1:end + 1] = self.sizes[i:end]
+            self.keys[i] = key
+            self.sizes[i] = size
+            self.count = end + 1
+
+    def trim(self, price):
+        # type: (float) -> None
+        """
+        drop the levels better than price, a newer best price says they are gone
+        """
+        i = int(self.keys[:self.count].searchsorted(price * self.sign))
+        if i:
+            count = self.count
+            self.keys[:count - i] = self.keys[i:count]
+            self.sizes[:count - i] = self.sizes[i:count]
+            self.keys[count - i:count] = np.inf
+            self.sizes[count - i:count] = 0.0
+            self.count = count - i
+
+    def prices(self, levels):
+        # type: (int) -> np.ndarray
+        """
+        prices of the first levels, NaN where the side has fewer
+        """
+        out = self.keys[:levels] * self.sign
+        out[self.count:] = np.nan
+        return out
+
+
+class OrderBook(object):
+    """
+    bids and asks of one ticker in preallocated numpy arrays, updated in place
+
+    full snapshots (depth.stepN, mbp.refresh.N) replace the book, incremental mbp.N updates are
+    applied level by level once a snapshot has set the sequence number, bbo updates move the best
+    levels. queries take the book's lock and read a few floats, a few microseconds each.
+    """
+
+    def __init__(self, ticker, levels=DEFAULT_LEVELS):
+        # type: (str, int) -> None
+        self.ticker = ticker
+        self.levels = levels
+        self.bids = _BookSide(-1, levels)
+        self.asks = _BookSide(1, levels)
+        self.time = 0  # milliseconds of the last update
+        self.seq = None  # type: Optional[int]
+        self.update_count = 0
+        self.gap_count = 0
+
+        self._pending = []  # type: List[Tuple[int, int, list, list, int]]
+        self._lock = threading.Lock()
+
+    @property
+    def synced(self):
+        # type: () -> bool
+        """
+        incremental updates can be applied, false until a snapshot and again after a sequence gap
+        """
+        return self.seq is not None
+
+    def apply_snapshot(self, bids, asks, time_ms, seq=None):
+        # type: (Sequence[Sequence[float]], Sequence[Sequence[float]], int, Optional[int]) -> None
+        """
+        replace every level, then apply the incremental updates held back that came after it
+        """
+        with self._lock:
+            self.bids.replace(bids)
+            self.asks.replace(asks)
+            self.time = time_ms
+            self.seq = seq
+            self.update_count += 1
+            pending, self._pending = self._pending, []
+        if seq is not None:
+            for update in pending:
+                if update[0] > seq:
+                    self.apply_update(*update)
+
+    def apply_update(self, seq, prev_seq, bids, asks, time_ms):
+        # type: (int, int, Sequence[Sequence[float]], Sequence[Sequence[float]], int) -> bool
+        """
+        one incremental update, sizes of zero remove their level
+        :return: false when the book is not synced, held until the next snapshot if it came first
+        """
+        with self._lock:
+            if self.seq is None:
+                if len(self._pending) < MAX_PENDING:
+                    self._pending.append((seq, prev_seq, bids, asks, time_ms))
+                return False
+            if seq <= self.seq:
+                return True
+            if prev_seq != self.seq:
+                # missed an update, every level is suspect until the next snapshot
+                self.seq = None
+                self.gap_count += 1
+                self._pending = [(seq, prev_seq, bids, asks, time_ms)]
+                return False
+
+            for price, size in bids:
+                self.bids.set(price, size)
+            for price, size in asks:
+                self.asks.set(price, size)
+            self.seq = seq
+            self.time = time_ms
+            self.update_count += 1
+            return True
+
+    def apply_bbo(self, bid_price, bid_size, ask_price, ask_size, time_ms):
+        # type: (float, float, float, float, int) -> None
+        with self._lock:
+            if time_ms < self.time:
+                return
+            self.bids.trim(bid_price)
+            self.bids.set(bid_price, bid_size)
+            self.asks.trim(ask_price)
+            self.asks.set(ask_price, ask_size)
+            self.time = time_ms
+            self.update_count += 1
+
+    def best(self):
+        # type: () -> Tuple[float, float, float, float]
+        """
+        bid price, bid size, ask price, ask size, NaN prices for an empty side
+        """
+        with self._lock:
+            return (
+                -self.bids.keys[0] if self.bids.count else np.nan, self.bids.sizes[0],
+                self.asks.keys[0] if self.asks.count else np.nan, self.asks.sizes[0]
+            )
+
+    def spread(self):
+        # type: () -> float
+        with self._lock:
+            if not (self.bids.count and self.asks.count):
+                return np.nan
+            return float(self.asks.keys[0] + self.bids.keys[0])
+
+    def mid(self):
+        # type: () -> float
+        with self._lock:
+            if not (self.bids.count and self.asks.count):
+                return np.nan
+            return float(self.asks.keys[0] - self.bids.keys[0]) / 2
+
+    def price(self, side, level=0):
+        # type: (str, int) -> float
+        """
+        price at level of side 'bid' or 'ask', 0 the best, NaN past the last level
+        """
+        book_side = self.bids if side == 'bid' else self.asks
+        with self._lock:
+            if level >= book_side.count:
+                return np.nan
+            return float(book_side.keys[level] * book_side.sign)
+
+    def depth(self, side, level=0):
+        # type: (str, int) -> float
+        """
+        total size of side 'bid' or 'ask' from the best level through level
+        """
+        book_side = self.bids if side == 'bid' else self.asks
+        with self._lock:
+            return float(book_side.sizes[:level + 1].sum())
+
+    def depth_within(self, side, distance):
+        # type: (str, float) -> float
+        """
+        total size of side 'bid' or 'ask' priced within distance of its best price
+        """
+        book_side = self.bids if side == 'bid' else self.asks
+        with self._lock:
+            if not book_side.count:
+                return 0.0
+            end = int(book_side.keys[:book_side.count].searchsorted(book_side.keys[0] + distance, side='right'))
+            return float(book_side.sizes[:end].sum())
+
+    def snapshot(self, levels=None):
+        # type: (Optional[int]) -> Dict[str, np.ndarray]
+        """
+        copy of the first levels of both sides plus time and seq, the row a DepthSnapshotFile stores
+        """
+        levels = self.levels if levels is None else levels
+        with self._lock:
+            return {
+                'time': self.time,
+                'seq': -1 if self.seq is None else self.seq,
+                'bid_price': self.bids.prices(levels),
+                'bid_size': self.bids.sizes[:levels].copy(),
+                'ask_price': self.asks.prices(levels),
+                'ask_size': self.asks.sizes[:levels].copy()
+            }
+
+
+class DepthSnapshotFile(object):
+    """
+    append only columnar store of book snapshots of one ticker, one file per column in directory
+
+    every column file holds fixed width little endian rows (the price and size columns one value per
+    level), so appending a snapshot is a write at the end of each and a reader maps any column alone.
+    after a crash the columns may differ in length, the shortest one decides the row count and
+    reopening for append cuts the others back to it.
+    """
+
+    def __init__(self, directory, ticker=None, levels=DEFAULT_LEVELS):
+        # type: (str, Optional[str], int) -> None
+        self.directory = directory
+        meta_path = os.path.join(directory, SNAPSHOT_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['version'] != SNAPSHOT_VERSION:
+                raise ValueError('unsupported snapshot file version {} in {}'.format(meta['version'], directory))
+        else:
+            if ticker is None:
+                raise ValueError('no snapshot file in ' + directory)
+            meta = {'version': SNAPSHOT_VERSION, 'ticker': ticker, 'levels': levels}
+            os.makedirs(directory, exist_ok=True)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+
+        self.ticker = meta['ticker']  # type: str
+        self.levels = meta['levels']  # type: int
+        self.dtypes = {
+            name: np.dtype((dtype, self.levels)) if per_level else np.dtype(dtype)
+            for name, dtype, per_level in SNAPSHOT_COLUMNS
+        }
+        self._files = None  # type: Optional[Dict]
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        # type: (str) -> str
+        return os.path.join(self.directory, name + '.bin')
+
+    def __len__(self):
+        return min(
+            os.path.getsize(self._path(name)) // dtype.itemsize if os.path.exists(self._path(name)) else 0
+            for name, dtype in self.dtypes.items()
+        )
+
+    def _open(self):
+        count = len(self)
+        self._files = {}
+        for name, dtype in self.dtypes.items():
+            f = open(self._path(name), 'ab')
+            f.truncate(count * dtype.itemsize)
+            self._files[name] = f
+
+    def append(self, snapshot):
+        # type: (Dict) -> None
+        """
+        one row from OrderBook.snapshot(), buffered until flush() or close()
+        """
+        with self._lock:
+            if self._files is None:
+                self._open()
+            for name, dtype in self.dtypes.items():
+                self._files[name].write(np.asarray(snapshot[name], dtype=dtype.base).tobytes())
+
+    def flush(self):
+        with self._lock:
+            for f in (self._files or {}).values():
+                f.flush()
+
+    def close(self):
+        with self._lock:
+            for f in (self._files or {}).values():
+                f.close()
+            self._files = None
+
+    def read(self, start=None, end=None, columns=None):
+        # type: (Optional[int], Optional[int], Optional[Sequence[str]]) -> Dict[str, np.ndarray]
+        """
+        rows with start <= time < end, times in milliseconds, columns defaults to all of them
+        """
+        self.flush()
+        count = len(self)
+        if count == 0:
+            return {name: np.empty((0,) + self.dtypes[name].shape, self.dtypes[name].base)
+                    for name in columns or self.dtypes}
+
+        time_column = np.memmap(self._path('time'), dtype=self.dtypes['time'], mode='r', shape=(count,))
+        lo = 0 if start is None else int(time_column.searchsorted(start, side='left'))
+        hi = count if end is None else int(time_column.searchsorted(end, side='left'))
+        result = {}
+        for name in columns or self.dtypes:
+            dtype = self.dtypes[name]
+            column = np.memmap(self._path(name), dtype=dtype.base, mode='r', shape=(count,) + dtype.shape)
+            result[name] = np.array(column[lo:max(lo, hi)])
+        return result
+
+
+class MarketDepth(object):
+    """
+    an OrderBook per ticker fed from huobi depth, mbp and bbo ticks, with optional snapshots
+
+    with a directory every book is snapshotted into directory/<ticker> as a DepthSnapshotFile at most
+    once per snapshot_interval seconds of exchange time, on a grid so replays record the same rows.
+    """
+
+    def __init__(self, levels=DEFAULT_LEVELS, directory=None, snapshot_interval=1.0):
+        # type: (int, Optional[str], float) -> None
+        self.levels = levels
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.books = {}  # type: Dict[str, OrderBook]
+        self.snapshot_files = {}  # type: Dict[str, DepthSnapshotFile]
+        self._next_snapshot = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def book(self, ticker):
+        # type: (str) -> OrderBook
+        book = self.books.get(ticker)
+        if book is None:
+            with self._lock:
+                book = self.books.setdefault(ticker, OrderBook(ticker, self.levels))
+        return book
+
+    def on_depth(self, ticker, tick, time_ms=None):
+        # type: (str, Dict, Optional[int]) -> OrderBook
+        """
+        a full book, depth.stepN ticks and mbp.refresh.N ticks, or the data of an mbp.N req
+        :param time_ms: ts of the message, for ticks without their own, the local clock only without either
+        """
+        book = self.book(ticker)
+        time_ms = tick.get('ts') or time_ms or int(time.time() * 1000)
+        book.apply_snapshot(tick.get('bids', ()), tick.get('asks', ()), time_ms, tick.get('seqNum'))
+        self._record(book)
+        return book
+
+    def on_mbp(self, ticker, tick, time_ms=None):
+        # type: (str, Dict, Optional[int]) -> bool
+        """
+        an incremental mbp.N tick
+        :param time_ms: ts of the message, the local clock only without one
+        :return: false when the book needs a snapshot
+        """
+        book = self.book(ticker)
+        applied = book.apply_update(
+            tick['seqNum'], tick['prevSeqNum'], tick.get('bids', ()), tick.get('asks', ()),
+            time_ms or int(time.time() * 1000)
+        )
+        if applied:
+            self._record(book)
+        return applied
+
+    def on_bbo(self, ticker, tick):
+        # type: (str, Dict) -> OrderBook
+        book = self.book(ticker)
+        book.apply_bbo(tick['bid'], tick['bidSize'], tick['ask'], tick['askSize'], tick['quoteTime'])
+        self._record(book)
+        return book
+
+    def snapshot_file(self, ticker):
+        # type: (str) -> DepthSnapshotFile
+        snapshot_file = self.snapshot_files.get(ticker)
+        if snapshot_file is None:
+            with self._lock:
+                snapshot_file = self.snapshot_files.get(ticker)
+                if snapshot_file is None:
+                    snapshot_file = self.snapshot_files[ticker] = DepthSnapshotFile(
+                        os.path.join(self.directory, ticker), ticker, self.levels
+                    )
+        return snapshot_file
+
+    def _record(self, book):
+        # type: (OrderBook) -> None
+        if self.directory is None or not book.time:
+            return
+        if book.time < self._next_snapshot.get(book.ticker, 0):
+            return
+        interval = max(int(self.snapshot_interval * 1000), 1)
+        self._next_snapshot[book.ticker] = book.time - book.time % interval + interval
+        self.snapshot_file(book.ticker).append(book.snapshot())
+
+    def flush(self):
+        for snapshot_file in list(self.snapshot_files.values()):
+            snapshot_file.flush()
+
+    def close(self):
+        for snapshot_file in list(self.snapshot_files.values()):
+            snapshot_file.close()
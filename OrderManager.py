@@ -0,0 +1,289 @@
+import collections
+import datetime
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from DataStructure import Instruction, OrderState, OrderType, Report, TradeSide
+
+HISTORY_DTYPE = np.dtype([
+    ('order_id', 'S36'),
+    ('ticker', 'S32'),
+    ('side', 'i1'),
+    ('type', 'i1'),
+    ('state', 'i1'),
+    ('amount', '<i8'),
+    ('limit_price', '<f8'),
+    ('filled_amount', '<i8'),
+    ('filled_notional', '<f8'),
+    ('average_price', '<f8'),
+    ('start_time', '<M8[us]'),
+    ('stop_time', '<M8[us]')
+])
+
+FINAL_STATES = (OrderState.Filled, OrderState.Canceled, OrderState.Invalid)
+
+
+def _unindex(index, key, order_id):
+    # type: (Dict, object, str) -> None
+    """
+    drop order_id from index[key] and the key with its last order, so the indexes do not keep every
+    ticker and state ever seen
+    """
+    order_ids = index.get(key)
+    if order_ids is not None:
+        order_ids.discard(order_id)
+        if not order_ids:
+            del index[key]
+
+
+def _datetime64(value):
+    # type: (Optional[datetime.datetime]) -> np.datetime64
+    return np.datetime64('NaT', 'us') if value is None else np.datetime64(value, 'us')
+
+
+class OrderHistory(object):
+    """
+    finished orders as one structured array row each instead of one Instruction object each
+    """
+
+    def __init__(self, capacity=1024):
+        # type: (int) -> None
+        self._records = np.empty(capacity, dtype=HISTORY_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, count):
+        capacity = len(self._records)
+        if self._size + count <= capacity:
+            return
+        while capacity < self._size + count:
+            capacity = max(capacity * 2, 1024)
+        grown = np.empty(capacity, dtype=HISTORY_DTYPE)
+        grown[:self._size] = self._records[:self._size]
+        self._records = grown
+
+    def extend(self, instructions):
+        # type: (List[Instruction]) -> None
+        self._reserve(len(instructions))
+        self._records[self._size:self._size + len(instructions)] = [
+            (
+                instruction.OrderID, instruction.Ticker, instruction.Side.value, instruction.Type.value,
+                instruction.State.value, instruction.Amount, instruction.LimitPrice, instruction.FilledAmount,
+                instruction.FilledNotional, instruction.AveragePrice, _datetime64(instruction.StartTime),
+                _datetime64(instruction.StopTime)
+            )
+            for instruction in instructions
+        ]
+        self._size += len(instructions)
+
+    @property
+    def records(self):
+        # type: () -> np.ndarray
+        return self._records[:self._size]
+
+    def find(self, order_id):
+        # type: (str) -> Optional[np.void]
+        """
+        the row of an order, a vectorized scan since spilled orders are looked up rarely
+        """
+        match = np.flatnonzero(self.records['order_id'] == order_id.encode())
+        return self.records[match[-1]] if len(match) else None
+
+    def select(self, ticker=None, state=None, side=None):
+        # type: (Optional[str], Optional[OrderState], Optional[TradeSide]) -> np.ndarray
+        records = self.records
+        mask = np.ones(len(records), dtype=bool)
+        if ticker is not None:
+            mask &= records['ticker'] == ticker.encode()
+        if state is not None:
+            mask &= records['state'] == state.value
+        if side is not None:
+            mask &= records['side'] == side.value
+        return records[mask]
+
+
+class OrderManager(object):
+    """
+    registry of Instructions indexed by OrderID, ticker, OrderState and TradeSide
+
+    order transitions go through the manager (filled, canceling, canceled, apply) so the indexes
+    follow the state of every order. finished orders stay available as objects until more than
+    keep_finished of them pile up, the oldest are then spilled into the columnar OrderHistory and
+    only show up in history_records(). a fill that still comes in for a spilled order is not booked,
+    it is counted in late_fill_count.
+    """
+
+    def __init__(self, keep_finished=1024):
+        # type: (int) -> None
+        self.keep_finished = keep_finished
+        self.history = OrderHistory()
+        self.late_fill_count = 0
+
+        self._orders = {}  # type: Dict[str, Instruction]
+        self._finished = collections.OrderedDict()  # type: collections.OrderedDict
+        self._by_ticker = collections.defaultdict(set)  # type: Dict[str, Set[str]]
+        self._by_state = collections.defaultdict(set)  # type: Dict[OrderState, Set[str]]
+        self._by_side = collections.defaultdict(set)  # type: Dict[TradeSide, Set[str]]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def __getitem__(self, order_id):
+        # type: (str) -> Instruction
+        return self._orders[order_id]
+
+    def get(self, order_id, default=None):
+        # type: (str, Optional[Instruction]) -> Optional[Instruction]
+        return self._orders.get(order_id, default)
+
+    def add(self, instruction):
+        # type: (Instruction) -> Instruction
+        if instruction.Type is OrderType.CancelOrder:
+            raise ValueError('cancel instructions are not orders, use canceling()')
+
+        with self._lock:
+            order_id = instruction.OrderID
+            if order_id in self._orders:
+                raise KeyError('duplicate order id ' + order_id)
+            self._orders[order_id] = instruction
+            self._by_ticker[instruction.Ticker].add(order_id)
+            self._by_state[instruction.State].add(order_id)
+            self._by_side[instruction.Side].add(order_id)
+            if instruction.State in FINAL_STATES:
+                self._finish(order_id)
+        return instruction
+
+    def _transition(self, instruction, state_before):
+        # type: (Instruction, OrderState) -> None
+        state = instruction.State
+        if state is state_before:
+            return
+        order_id = instruction.OrderID
+        _unindex(self._by_state, state_before, order_id)
+        self._by_state[state].add(order_id)
+        if state in FINAL_STATES:
+            self._finish(order_id)
+
+    def _finish(self, order_id):
+        self._finished[order_id] = None
+        if len(self._finished) > self.keep_finished:
+            # in batches, one history row at a time would copy a tuple list per order
+            self.spill(len(self._finished) - self.keep_finished // 2)
+
+    def spill(self, count=None):
+        # type: (Optional[int]) -> int
+        """
+        move the oldest finished orders, all of them by default, into the columnar history
+        """
+        with self._lock:
+            count = len(self._finished) if count is None else min(count, len(self._finished))
+            spilled = []
+            for _ in range(count):
+                order_id = self._finished.popitem(last=False)[0]
+                instruction = self._orders.pop(order_id)
+                _unindex(self._by_ticker, instruction.Ticker, order_id)
+                _unindex(self._by_state, instruction.State, order_id)
+                _unindex(self._by_side, instruction.Side, order_id)
+                spilled.append(instruction)
+            self.history.extend(spilled)
+        return count
+
+    def filled(self, order_id, amount, notional, filled_datetime):
+        # type: (str, int, float, datetime.datetime) -> Optional[Instruction]
+        """
+        :return: the order, None for an order already spilled to history
+        """
+        with self._lock:
+            instruction = self._orders.get(order_id)
+            if instruction is None:
+                if self.history.find(order_id) is None:
+                    raise KeyError('unknown order id ' + order_id)
+                self.late_fill_count += 1
+                return None
+            state_before = instruction.State
+            instruction.filled(amount, notional, filled_datetime)
+            self._transition(instruction, state_before)
+        return instruction
+
+    def apply(self, report):
+        # type: (Report) -> Optional[Instruction]
+        """
+        book a fill on the order it belongs to, see filled
+        """
+        return self.filled(report.OrderID, report.Amount, report.Notional, report.TradeTime)
+
+    def apply_all(self, reports):
+        # type: (Iterable[Report]) -> None
+        for report in reports:
+            self.apply(report)
+
+    def canceling(self, order_id, canceling_datetime):
+        # type: (str, datetime.datetime) -> Instruction
+        """
+        :return: the cancel instruction to send
+        """
+        with self._lock:
+            instruction = self._orders[order_id]
+            state_before = instruction.State
+            cancel_instruction = instruction.canceling(canceling_datetime)
+            self._transition(instruction, state_before)
+        return cancel_instruction
+
+    def canceled(self, order_id, canceled_datetime):
+        # type: (str, datetime.datetime) -> Instruction
+        with self._lock:
+            instruction = self._orders[order_id]
+            state_before = instruction.State
+            instruction.canceled(canceled_datetime)
+            self._transition(instruction, state_before)
+        return instruction
+
+    def order_ids(self, ticker=None, state=None, side=None):
+        # type: (Optional[str], Optional[OrderState], Optional[TradeSide]) -> Set[str]
+        with self._lock:
+            indexes = []
+            if ticker is not None:
+                indexes.append(self._by_ticker.get(ticker, set()))
+            if state is not None:
+                indexes.append(self._by_state.get(state, set()))
+            if side is not None:
+                indexes.append(self._by_side.get(side, set()))
+            if not indexes:
+                return set(self._orders)
+            # intersect starting from the smallest index
+            indexes.sort(key=len)
+            return indexes[0].intersection(*indexes[1:])
+
+    def orders(self, ticker=None, state=None, side=None):
+        # type: (Optional[str], Optional[OrderState], Optional[TradeSide]) -> List[Instruction]
+        """
+        orders held as objects matching every given key, e.g. orders('eosusdt', OrderState.PartFilled)
+        """
+        with self._lock:
+            return [self._orders[order_id] for order_id in self.order_ids(ticker, state, side)]
+
+    def live(self, ticker=None):
+        # type: (Optional[str]) -> List[Instruction]
+        """
+        orders that can still fill
+        """
+        with self._lock:
+            return [
+                instruction for instruction in self.orders(ticker) if instruction.State not in FINAL_STATES
+            ]
+
+    def history_records(self, ticker=None, state=None, side=None):
+        # type: (Optional[str], Optional[OrderState], Optional[TradeSide]) -> np.ndarray
+        """
+        spilled orders matching every given key as HISTORY_DTYPE records
+        """
+        with self._lock:
+            return self.history.select(ticker, state, side)
@@ -1,17 +1,18 @@
 import datetime
-import gzip
 import json
 import uuid
 
 import websocket
 
-import time
+from FrameDecoder import FrameDecoder
+
+decoder = FrameDecoder()
 
 
 def on_message(ws, message):
-    result = gzip.decompress(message).decode('utf-8')
-    if "ping" in result:
-        ws.send(json.dumps({"pong": time.time()}))
+    ping, result = decoder.decode(message)
+    if ping is not None:
+        ws.send(json.dumps({"pong": ping}))
     else:
         # todo: save data
         print(result)
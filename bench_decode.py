@@ -0,0 +1,79 @@
+import datetime
+import gzip
+import json
+import time
+
+from BarStorage import BarDataStorage
+from FrameDecoder import JSON_PARSER, FrameDecoder, kline_columns
+from HuobiStandIn import synthetic_klines
+
+
+def make_frames(count=1000, ping_every=10):
+    frames = []
+    start = 1546300800
+    for i in range(count):
+        if i % ping_every == 0:
+            message = {'ping': int(time.time() * 1000)}
+        else:
+            message = {
+                'id': str(i),
+                'rep': 'market.eosusdt.kline.1min',
+                'status': 'ok',
+                'data': synthetic_klines('eosusdt', '1min', start, start + 299 * 60)
+            }
+            start += 300 * 60
+        frames.append(gzip.compress(json.dumps(message, separators=(',', ':')).encode('utf-8')))
+    return frames
+
+
+def legacy_decode(frames, storage):
+    # the decode path of BarDataReplay before FrameDecoder
+    for frame in frames:
+        result = gzip.decompress(frame).decode('utf-8')
+        if "ping" in result:
+            json.dumps({"pong": datetime.datetime.now().timestamp()})
+        else:
+            data = json.loads(result)['data']
+            storage.extend(
+                time=[tick_dict['id'] for tick_dict in data],
+                open_price=[tick_dict['open'] for tick_dict in data],
+                high_price=[tick_dict['high'] for tick_dict in data],
+                low_price=[tick_dict['low'] for tick_dict in data],
+                close_price=[tick_dict['close'] for tick_dict in data],
+                volume=[tick_dict['amount'] for tick_dict in data],
+                notional=[tick_dict['vol'] for tick_dict in data]
+            )
+
+
+def frame_decoder_decode(frames, storage):
+    decoder = FrameDecoder()
+    for frame in frames:
+        ping, result = decoder.decode(frame)
+        if ping is not None:
+            json.dumps({"pong": ping})
+        else:
+            storage.extend(**kline_columns(result['data']))
+
+
+def bench(decode, frames, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        storage = BarDataStorage(ticker='eosusdt')
+        started = time.perf_counter()
+        decode(frames, storage)
+        best = min(best, time.perf_counter() - started)
+    return len(frames) / best
+
+
+def main():
+    frames = make_frames()
+    before = bench(legacy_decode, frames)
+    after = bench(frame_decoder_decode, frames)
+    print('json parser: ' + JSON_PARSER)
+    print('before: {:.0f} frames/s'.format(before))
+    print('after:  {:.0f} frames/s ({:.2f}x)'.format(after, after / before))
+    return {'before_frames_per_second': before, 'after_frames_per_second': after, 'json_parser': JSON_PARSER}
+
+
+if __name__ == '__main__':
+    main()
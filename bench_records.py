@@ -0,0 +1,129 @@
+import datetime
+import time
+import tracemalloc
+
+import numpy as np
+
+from BarStorage import from_epoch
+from DataStructure import BarData, Report, TradeSide
+
+
+class LegacyBarData:
+    # BarData as it was before __slots__
+    def __init__(self, ticker, high_price, low_price, open_price, close_price, bar_start_time, bar_span, volume,
+                 notional):
+        self.ticker = ticker
+        self.high_price = high_price
+        self.low_price = low_price
+        self.open_price = open_price
+        self.close_price = close_price
+        self.bar_start_time = bar_start_time
+        self.bar_span = bar_span
+        self.volume = volume
+        self.notional = notional
+
+
+class LegacyReport:
+    # Report as it was before __slots__
+    def __init__(self, ticker, side, amount, notional, trade_time, order_id, note):
+        self.__ticker = ticker
+        self.__side = side
+        self.__amount = amount
+        self.__notional = notional
+        self.__trade_time = trade_time
+        self.__order_id = order_id
+        self.__note = note
+        self.__margin = None
+
+    # noinspection PyPep8Naming
+    @property
+    def Notional(self):
+        return self.__notional
+
+
+def measure(build):
+    # timed without tracemalloc, it slows every allocation down several times
+    started = time.perf_counter()
+    build()
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    objects = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objects, seconds, size
+
+
+def access_seconds(objects, read):
+    started = time.perf_counter()
+    for obj in objects:
+        read(obj)
+    return time.perf_counter() - started
+
+
+def bench_bars(count):
+    # every variant starts from storage columns, as BarDataStorage.bar() and __iter__ do
+    span = datetime.timedelta(minutes=1)
+    bar_time = np.arange(count, dtype=np.int64) * 60 + 1546300800
+    price = np.random.rand(count)
+
+    def legacy():
+        return [
+            LegacyBarData('eosusdt', float(price[i]), float(price[i]), float(price[i]), float(price[i]),
+                          from_epoch(int(bar_time[i])), span, float(price[i]), float(price[i]))
+            for i in range(count)
+        ]
+
+    def slotted():
+        return [
+            BarData('eosusdt', float(price[i]), float(price[i]), float(price[i]), float(price[i]),
+                    from_epoch(int(bar_time[i])), span, float(price[i]), float(price[i]))
+            for i in range(count)
+        ]
+
+    def bulk():
+        return BarData.from_arrays('eosusdt', span, bar_time, price, price, price, price, price, price)
+
+    results = {}
+    for name, build in (('legacy', legacy), ('slots', slotted), ('slots_from_arrays', bulk)):
+        objects, seconds, size = measure(build)
+        results[name] = {
+            'construct_per_second': count / seconds,
+            'bytes_per_object': size / count,
+            'reads_per_second': count / access_seconds(objects, lambda bar: bar.close_price),
+        }
+    return results
+
+
+def bench_reports(count):
+    now = datetime.datetime.now()
+    order_ids = [str(i) for i in range(count)]
+
+    def legacy():
+        return [LegacyReport('eosusdt', TradeSide.LongOpen, 1, 1.0, now, order_id, '') for order_id in order_ids]
+
+    def slotted():
+        return [Report('eosusdt', TradeSide.LongOpen, 1, 1.0, now, order_id, '') for order_id in order_ids]
+
+    results = {}
+    for name, build in (('legacy', legacy), ('slots', slotted)):
+        objects, seconds, size = measure(build)
+        results[name] = {
+            'construct_per_second': count / seconds,
+            'bytes_per_object': size / count,
+            'reads_per_second': count / access_seconds(objects, lambda report: report.Notional),
+        }
+    return results
+
+
+def main(count=200000):
+    results = {'BarData': bench_bars(count), 'Report': bench_reports(count)}
+    for record, variants in results.items():
+        for name, result in variants.items():
+            print('{:8} {:18} {:>10.0f} built/s {:>7.1f} bytes each {:>11.0f} reads/s'.format(
+                record, name, result['construct_per_second'], result['bytes_per_object'], result['reads_per_second']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
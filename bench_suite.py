@@ -0,0 +1,303 @@
+"""
+self contained benchmark suite, no network needed: request_data runs against a local HuobiStandIn
+
+    python bench_suite.py                          all benchmarks, json on stdout
+    python bench_suite.py --only decode csv        a subset
+    python bench_suite.py --output results.json --baseline previous.json
+
+with --baseline every higher-is-better figure is compared to the earlier run and the exit status is 1
+when one dropped by more than --tolerance.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import BlockFile
+import HuobiClient
+import bench_decode
+import bench_records
+from BarArchive import BarArchive
+from BarStorage import BarDataStorage
+from DataStructure import Report, TradeSide
+from FrameDecoder import JSON_PARSER
+from HuobiStandIn import HuobiStandIn, synthetic_klines
+from Ledger import Ledger
+from Metrics import Metrics
+
+# the stand in serves every day as utc midnight to midnight
+HuobiClient.LOCAL_TIMEZONE = datetime.timezone.utc
+
+
+def best_of(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def synthetic_storage(ticker, days):
+    # type: (str, int) -> BarDataStorage
+    start = 1546300800
+    data = synthetic_klines(ticker, '1min', start, start + days * 86400 - 60, max_bars=days * 1440)
+    storage = BarDataStorage(ticker=ticker, capacity=len(data))
+    HuobiClient.extend_klines(storage, data)
+    return storage
+
+
+def bench_request_data(days=10, latency=0.005, jitter=0.002, queue_size=5):
+    # the stand in serves from a thread of this process, its json and gzip work is part of the figures
+    with HuobiStandIn(ping_interval=0.5, latency=latency, jitter=jitter, seed=0, compresslevel=1) as stand_in:
+        replay = HuobiClient.BarDataReplay(
+            'eosusdt', datetime.date(2019, 1, 1), datetime.date(2019, 1, days), url=stand_in.url
+        )
+        metrics = Metrics(name='request_data')
+        started = time.perf_counter()
+        replay.request_data(queue_size=queue_size, metrics=metrics)
+        seconds = time.perf_counter() - started
+
+    round_trip = metrics.latencies['round_trip'].summary()
+    return {
+        'bars': len(replay.bar_data_storage),
+        'seconds': seconds,
+        'bars_per_second': len(replay.bar_data_storage) / seconds,
+        'requests_per_second': round_trip['count'] / seconds,
+        'round_trip_p50_ms': round_trip['p50'] * 1e3,
+        'round_trip_p99_ms': round_trip['p99'] * 1e3,
+        'stand_in_latency_ms': latency * 1e3,
+        'stand_in_jitter_ms': jitter * 1e3
+    }
+
+
+def bench_decode_frames(count=1000, repeat=3):
+    frames = bench_decode.make_frames(count)
+    legacy = bench_decode.bench(bench_decode.legacy_decode, frames, repeat)
+    decoder = bench_decode.bench(bench_decode.frame_decoder_decode, frames, repeat)
+    return {
+        'frames_per_second': decoder,
+        'legacy_frames_per_second': legacy,
+        'speedup': decoder / legacy
+    }
+
+
+def bench_csv(days=30, repeat=3):
+    storage = synthetic_storage('eosusdt', days)
+    replay = HuobiClient.BarDataReplay('eosusdt', datetime.date(2019, 1, 1), datetime.date(2019, 1, days))
+    replay.bar_data_storage.merge(storage)
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'eosusdt.csv')
+        write = best_of(lambda: replay.to_csv(path), repeat)
+        read = best_of(lambda: replay.from_csv(path), repeat)
+        size = os.path.getsize(path)
+
+    return {
+        'bars': len(storage),
+        'to_csv_bars_per_second': len(storage) / write,
+        'from_csv_bars_per_second': len(storage) / read,
+        'file_megabytes': size / 1e6
+    }
+
+
+def bench_archive(days=90, repeat=3):
+    storage = synthetic_storage('eosusdt', days)
+    results = {'bars': len(storage)}
+    start = datetime.datetime(2019, 1, 15, 9, 30)
+    end = datetime.datetime(2019, 1, 15, 16)
+
+    with tempfile.TemporaryDirectory() as root:
+        for mode, block_rows in (('raw', None), ('blocks', BlockFile.DEFAULT_BLOCK_ROWS)):
+            archive = BarArchive(os.path.join(root, mode), 'eosusdt', '1min', 'month', block_rows)
+            write = best_of(lambda: archive.write(storage), 1)
+            load = best_of(archive.load, repeat)
+            query = best_of(lambda: archive.load(start, end), repeat * 10)
+            size = sum(os.path.getsize(os.path.join(archive.directory, name)) for name in archive.partitions())
+            results[mode + '_write_bars_per_second'] = len(storage) / write
+            results[mode + '_load_bars_per_second'] = len(storage) / load
+            results[mode + '_query_ms'] = query * 1e3
+            results[mode + '_megabytes'] = size / 1e6
+
+    results['compression_ratio'] = results['raw_megabytes'] / results['blocks_megabytes']
+    return results
+
+
+def bench_journal(days=10, repeat=3):
+    # capture a session against the stand in once, then time decoding and storing it again from disk
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'session.journal')
+        with HuobiStandIn(ping_interval=0.5, seed=0, compresslevel=1) as stand_in:
+            captured = HuobiClient.BarDataReplay(
+                'eosusdt', datetime.date(2019, 1, 1), datetime.date(2019, 1, days), url=stand_in.url
+            )
+            captured.request_data(metrics=Metrics(name='request_data'), journal=path)
+
+        replays = []
+
+        def replay():
+            replays.append(HuobiClient.BarDataReplay(
+                'eosusdt', datetime.date(2019, 1, 1), datetime.date(2019, 1, days), url=stand_in.url
+            ))
+            return replays[-1].replay(path)
+
+        frames = replay()
+        seconds = best_of(replay, repeat)
+        size = os.path.getsize(path)
+
+    replayed = replays[-1].bar_data_storage
+    return {
+        'frames': frames,
+        'bars': len(replayed),
+        'bars_match': bool(np.array_equal(replayed.time, captured.bar_data_storage.time)),
+        'replay_frames_per_second': frames / seconds,
+        'replay_bars_per_second': len(replayed) / seconds,
+        'journal_megabytes': size / 1e6
+    }
+
+
+def never_flat_fills(count, seed=0):
+    """
+    one long book that always keeps at least a lot open, where the vectorized ledger has to carry its
+    average cost through every fill
+    """
+    rng = np.random.default_rng(seed)
+    sides, amounts, held = [TradeSide.LongOpen], [5], 5
+    for _ in range(count - 1):
+        if held > 1 and rng.random() < 0.5:
+            amount = int(rng.integers(1, held))
+            sides.append(TradeSide.LongClose)
+            held -= amount
+        else:
+            amount = int(rng.integers(1, 5))
+            sides.append(TradeSide.LongOpen)
+            held += amount
+        amounts.append(amount)
+    return sides, amounts, list(np.array(amounts) * rng.uniform(90, 110, len(amounts)))
+
+
+def bench_ledger(count=200000, tolerance=1e-8):
+    # apply_arrays has to agree with booking the same fills one Report at a time
+    sides, amounts, notionals = never_flat_fills(count)
+    reports = [Report('eosusdt', side, amount, notional, None, None, '')
+               for side, amount, notional in zip(sides, amounts, notionals)]
+    vectorized, per_report = Ledger(margin_rate=0.1), Ledger(margin_rate=0.1)
+    arrays_seconds = best_of(lambda: vectorized.apply_arrays('eosusdt', sides, amounts, notionals), 1)
+    report_seconds = best_of(lambda: per_report.apply(reports), 1)
+
+    a, b = vectorized.position('eosusdt'), per_report.position('eosusdt')
+    difference = max(abs(a.realized_pnl - b.realized_pnl) / max(abs(b.realized_pnl), 1.0),
+                     abs(a.long_cost - b.long_cost) / b.long_cost,
+                     abs(a.long_margin - b.long_margin) / b.long_margin)
+
+    # a 2 lot long closing and reopening one lot over and over, every close halves what is carried
+    cycles = Ledger()
+    cycles.apply_arrays('eosusdt', [TradeSide.LongOpen] + [TradeSide.LongClose, TradeSide.LongOpen] * 3000,
+                        [2] + [1, 1] * 3000, [10.0] + [5.1, 5.0] * 3000)
+    position = cycles.position('eosusdt')
+    difference = max(difference, abs(position.long_cost - 10.0) / 10.0, abs(position.realized_pnl - 300.0) / 300.0)
+    assert difference < tolerance, 'apply_arrays is off on_report by {:.3g}'.format(difference)
+    return {
+        'fills': count,
+        'max_relative_difference': difference,
+        'apply_arrays_fills_per_second': count / arrays_seconds,
+        'on_report_fills_per_second': count / report_seconds
+    }
+
+
+def bench_constructors(count=100000):
+    results = {}
+    for record, variants in (('bar_data', bench_records.bench_bars(count)),
+                             ('report', bench_records.bench_reports(count))):
+        for variant, result in variants.items():
+            if variant == 'legacy':
+                continue
+            for name, value in result.items():
+                results['{}_{}_{}'.format(record, variant, name)] = value
+    return results
+
+
+BENCHMARKS = {
+    'request_data': bench_request_data,
+    'decode': bench_decode_frames,
+    'csv': bench_csv,
+    'archive': bench_archive,
+    'journal': bench_journal,
+    'ledger': bench_ledger,
+    'constructors': bench_constructors
+}
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'json_parser': JSON_PARSER,
+        'machine': platform.machine(),
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    }
+
+
+def run(names=None):
+    results = {}
+    for name in names or BENCHMARKS:
+        # the client code prints progress, keep stdout for the json
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = BENCHMARKS[name]()
+        print('{}: {}'.format(name, json.dumps(results[name])), file=sys.stderr)
+    return {'environment': environment(), 'results': results}
+
+
+def regressions(current, baseline, tolerance=0.2):
+    """
+    higher is better figures (the *_per_second ones and speedups) that fell below (1 - tolerance) of baseline
+    """
+    found = []
+    for name, result in current['results'].items():
+        for key, value in result.items():
+            if not (key.endswith('_per_second') or key == 'speedup'):
+                continue
+            before = baseline.get('results', {}).get(name, {}).get(key)
+            if before and value < before * (1 - tolerance):
+                found.append({'benchmark': name, 'metric': key, 'baseline': before, 'current': value,
+                              'change': value / before - 1})
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='huobi client benchmark suite')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--output', help='write the results here instead of stdout')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed drop before it is a regression')
+    args = parser.parse_args(argv)
+
+    report = run(args.only)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = regressions(report, json.load(f), args.tolerance)
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+    if report.get('regressions'):
+        for regression in report['regressions']:
+            print('regression: {benchmark} {metric} {change:+.1%}'.format(**regression), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the modules live at the repository root, next to Test.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import HuobiClient  # noqa: E402
+from BarStorage import BarDataStorage  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def utc_days(monkeypatch):
+    """
+    request_range takes dates in LOCAL_TIMEZONE, utc keeps the expected windows independent of the host
+    """
+    monkeypatch.setattr(HuobiClient, 'LOCAL_TIMEZONE', datetime.timezone.utc)
+    monkeypatch.setattr(HuobiClient, 'HTTP_PROXY', (None, None))
+
+
+@pytest.fixture
+def stand_in():
+    HuobiStandIn = pytest.importorskip('HuobiStandIn')
+    with HuobiStandIn.HuobiStandIn(ping_interval=None, push_interval=0.05) as server:
+        yield server
+
+
+def random_storage(count=5000, ticker='eosusdt', start=1546300800, seed=1, bar_span=datetime.timedelta(minutes=1)):
+    """
+    a random walk of whole bars, prices quoted to 4 decimals like huobi's
+    """
+    random = np.random.default_rng(seed)
+    close = np.round(5.0 + np.cumsum(random.normal(0, 0.01, count)), 4)
+    open_ = np.round(np.concatenate(([5.0], close[:-1])), 4)
+    high = np.round(np.maximum(open_, close) + random.uniform(0, 0.01, count), 4)
+    low = np.round(np.minimum(open_, close) - random.uniform(0, 0.01, count), 4)
+    volume = np.round(random.uniform(100, 1000, count), 2)
+    span = int(bar_span.total_seconds())
+    return BarDataStorage.from_arrays(
+        ticker, bar_span, start + np.arange(count) * span, open_, high, low, close, volume, volume * close
+    )
@@ -0,0 +1,60 @@
+import datetime
+
+import numpy as np
+import pytest
+
+pytest.importorskip('websockets')
+
+from AsyncDownloader import ParallelBarDownloader  # noqa: E402
+from HuobiStandIn import HuobiStandIn, synthetic_klines  # noqa: E402
+
+DAY = datetime.date(2019, 1, 1)
+DAY_START = 1546300800
+
+
+def expected_close(ticker, start, count):
+    klines = []
+    while len(klines) < count:
+        klines += synthetic_klines(ticker, '1min', start + len(klines) * 60, start + count * 60 - 60)
+    return np.array([kline['close'] for kline in klines])
+
+
+def test_every_ticker_gets_the_whole_day(stand_in):
+    tickers = ['btcusdt', 'ethusdt', 'eosusdt']
+    downloader = ParallelBarDownloader(tickers, DAY, DAY, connections=2, url=stand_in.url)
+    storages = downloader.run()
+
+    assert downloader.stats['failures'] == 0
+    assert downloader.stats['bars'] == 3 * 1440
+    for ticker in tickers:
+        storage = storages[ticker]
+        assert len(storage) == 1440
+        assert storage.time[0] == DAY_START
+        assert np.all(np.diff(storage.time) == 60)
+        assert np.allclose(storage.close_price, expected_close(ticker, DAY_START, 1440))
+
+
+def test_dropped_requests_are_retried():
+    with HuobiStandIn(ping_interval=None, drop_rate=0.3, seed=7) as server:
+        downloader = ParallelBarDownloader(
+            ['btcusdt'], DAY, DAY, connections=2, url=server.url, response_timeout=0.5, retries=10
+        )
+        storage = downloader.run()['btcusdt']
+
+    assert server.dropped_count > 0
+    assert downloader.stats['retries'] >= server.dropped_count
+    assert downloader.stats['failures'] == 0
+    assert len(storage) == 1440
+
+
+def test_connection_queue_size_caps_requests_in_flight():
+    # the stand in throttles a connection past max_pending outstanding requests, like huobi does
+    with HuobiStandIn(ping_interval=None, latency=0.05, max_pending=2) as server:
+        downloader = ParallelBarDownloader(
+            ['btcusdt', 'ethusdt'], DAY, DAY, connections=2, connection_queue_size=2, url=server.url
+        )
+        storages = downloader.run()
+
+    assert server.throttled_count == 0
+    assert downloader.stats['retries'] == 0
+    assert all(len(storage) == 1440 for storage in storages.values())
@@ -0,0 +1,132 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from Backtest import BarBacktest, run_signals
+from BarStorage import BarDataStorage
+from DataStructure import Instruction, OrderState, OrderType, TradeSide
+from Ledger import Ledger
+
+MINUTE = datetime.timedelta(minutes=1)
+
+
+def storage_of(rows):
+    """
+    bars from (open, high, low, close, volume) rows a minute apart
+    """
+    rows = np.array(rows, dtype=np.float64)
+    return BarDataStorage.from_arrays(
+        'eosusdt', MINUTE, np.arange(len(rows)) * 60, rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4],
+        rows[:, 3] * rows[:, 4]
+    )
+
+
+def submit_at(index, *orders):
+    def strategy(backtest, i):
+        if i == index:
+            for instruction in orders:
+                backtest.submit(instruction)
+    return strategy
+
+
+def buy(order_type, amount, price):
+    return Instruction('eosusdt', TradeSide.LongOpen, order_type, amount, price)
+
+
+BARS = [
+    (10.0, 10.5, 9.5, 10.0, 100),
+    (10.0, 10.2, 9.8, 10.1, 100),  # never reaches 9.5
+    (9.4, 9.6, 9.0, 9.2, 100),  # opens through 9.5
+    (9.2, 9.3, 8.5, 9.0, 100),
+]
+
+
+def test_limit_rests_until_touched_and_fills_at_the_open_through_it():
+    order = buy(OrderType.LimitOrder, 5, 9.5)
+    backtest = BarBacktest(storage_of(BARS), submit_at(0, order))
+    reports = backtest.run()
+
+    assert order.State is OrderState.Filled
+    assert len(reports) == 1
+    assert reports[0].TradeTime == datetime.datetime(1970, 1, 1, 0, 2)
+    assert reports[0].Notional == pytest.approx(5 * 9.4)
+    assert backtest.position == 5
+
+
+@pytest.mark.parametrize('order_type', [OrderType.FOK, OrderType.FAK])
+def test_fok_and_fak_are_canceled_when_the_next_bar_does_not_reach_them(order_type):
+    order = buy(order_type, 5, 9.5)
+    backtest = BarBacktest(storage_of(BARS), submit_at(0, order))
+
+    assert backtest.run() == []
+    assert order.State is OrderState.Canceled
+
+
+def test_fak_fills_what_the_volume_cap_allows_and_cancels_the_rest():
+    order = buy(OrderType.FAK, 30, 9.5)
+    backtest = BarBacktest(storage_of(BARS), submit_at(1, order), max_participation=0.2)
+    reports = backtest.run()
+
+    assert [report.Amount for report in reports] == [20]
+    assert order.State is OrderState.Canceled
+    assert order.FilledAmount == 20
+
+
+def test_fok_fills_completely_or_not_at_all():
+    too_big = buy(OrderType.FOK, 30, 9.5)
+    fits = buy(OrderType.FOK, 20, 9.5)
+    backtest = BarBacktest(storage_of(BARS), submit_at(1, too_big), max_participation=0.2)
+    assert backtest.run() == []
+    assert too_big.State is OrderState.Canceled
+
+    backtest = BarBacktest(storage_of(BARS), submit_at(1, fits), max_participation=0.2)
+    assert [report.Amount for report in backtest.run()] == [20]
+    assert fits.State is OrderState.Filled
+
+
+def test_orders_of_one_bar_share_the_volume_cap():
+    first, second = buy(OrderType.LimitOrder, 15, 9.5), buy(OrderType.LimitOrder, 15, 9.5)
+    backtest = BarBacktest(storage_of(BARS), submit_at(1, first, second), max_participation=0.2)
+    backtest.run()
+
+    assert first.FilledAmount == 15
+    assert second.FilledAmount == 15
+    # 5 in the bar that opened through the limit, the other 10 in the next one
+    assert [report.Amount for report in backtest.reports] == [15, 5, 10]
+
+
+@pytest.mark.filterwarnings('ignore:Invalid trade amount')
+def test_cancel_before_the_next_bar_stops_the_fill():
+    order = buy(OrderType.LimitOrder, 5, 9.5)
+
+    def strategy(backtest, i):
+        if i == 0:
+            backtest.submit(order)
+        elif i == 1:
+            backtest.cancel(order)
+
+    backtest = BarBacktest(storage_of(BARS), strategy)
+    assert backtest.run() == []
+    assert order.State is OrderState.Canceled
+
+
+def test_market_and_cancel_orders_are_refused():
+    backtest = BarBacktest(storage_of(BARS), lambda backtest, i: None)
+    with pytest.raises(ValueError):
+        backtest.submit(Instruction('eosusdt', TradeSide.LongOpen, OrderType.Manual, 1, 9.5))
+
+
+def test_run_signals_trades_at_the_next_open_and_books_like_the_ledger():
+    storage = storage_of(BARS)
+    result = run_signals(storage, np.array([2, 2, -1, 0]))
+
+    assert result.position.tolist() == [0, 2, 2, -1]
+    assert result.trade_index.tolist() == [1, 3]
+    assert result.trade_amount.tolist() == [2, -3]
+    assert result.equity[-1] == pytest.approx(2 * (9.2 - 10.0) + -1 * (9.0 - 9.2))
+
+    ledger = Ledger()
+    ledger.apply(result.reports())
+    ledger.mark('eosusdt', storage.close_price[-1])
+    assert ledger.realized_pnl + ledger.unrealized_pnl == pytest.approx(result.equity[-1])
@@ -0,0 +1,87 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from BarAggregator import BarAggregator, aggregate_trades
+from BarStorage import BarDataStorage, bar_start
+
+SECOND = datetime.timedelta(seconds=1)
+MINUTE = datetime.timedelta(minutes=1)
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+WEEK = datetime.timedelta(weeks=1)
+
+
+def random_trades(count=20000, start=1546300800.0, seed=3):
+    random = np.random.default_rng(seed)
+    time = start + np.cumsum(random.exponential(30.0, count))
+    price = np.round(5.0 + np.cumsum(random.normal(0, 0.01, count)), 4)
+    volume = np.round(random.uniform(0.1, 10.0, count), 2)
+    return time, price, volume
+
+
+def all_bars(aggregator, bar_span):
+    """
+    finished bars plus the open one
+    """
+    aggregator.flush()
+    return aggregator.storages[bar_span]
+
+
+def assert_same_bars(actual, expected):
+    assert len(actual) == len(expected)
+    for name in BarDataStorage.COLUMNS:
+        np.testing.assert_allclose(actual.column(name), expected.column(name), rtol=1e-12, err_msg=name)
+
+
+@pytest.mark.parametrize('bar_span', [SECOND, MINUTE, HOUR, DAY, WEEK])
+def test_update_and_batches_give_the_vectorized_bars(bar_span):
+    time, price, volume = random_trades()
+    expected = aggregate_trades(time, price, volume, bar_span, 'eosusdt')
+
+    one_by_one = BarAggregator('eosusdt', [bar_span])
+    for trade in zip(time, price, volume):
+        one_by_one.update(*trade)
+    batched = BarAggregator('eosusdt', [bar_span])
+    for chunk in np.array_split(np.arange(len(time)), 7):
+        batched.on_trades(time[chunk], price[chunk], volume[chunk])
+
+    assert_same_bars(all_bars(one_by_one, bar_span), expected)
+    assert_same_bars(all_bars(batched, bar_span), expected)
+
+
+@pytest.mark.parametrize('bar_span', [DAY, WEEK])
+def test_day_and_week_bars_start_on_huobi_boundaries(bar_span):
+    time, price, volume = random_trades()
+    bars = aggregate_trades(time, price, volume, bar_span)
+
+    assert all(bar_start(int(start), bar_span) == start for start in bars.time)
+    # midnight in utc+8, weeks from monday
+    assert set((bars.time + 8 * 3600) % 86400) == {0}
+    if bar_span == WEEK:
+        starts = [datetime.datetime.fromtimestamp(start + 8 * 3600, datetime.timezone.utc) for start in bars.time]
+        assert {start.weekday() for start in starts} == {0}
+
+
+def test_late_trades_are_counted_and_dropped():
+    aggregator = BarAggregator('eosusdt', [MINUTE])
+    aggregator.update(1546300800.0, 1.0, 1.0)
+    aggregator.update(1546300870.0, 2.0, 1.0)
+    aggregator.update(1546300810.0, 9.0, 1.0)
+    aggregator.on_trades([1546300805.0, 1546300875.0], [9.0, 3.0], [1.0, 1.0])
+
+    assert aggregator.late_count == 2
+    bars = all_bars(aggregator, MINUTE)
+    assert bars.high_price.tolist() == [1.0, 3.0] and bars.volume.tolist() == [1.0, 2.0]
+
+
+def test_on_trades_takes_lists_and_keeps_the_last_bar_open():
+    bars = []
+    aggregator = BarAggregator('eosusdt', [MINUTE], on_bar=bars.append)
+    aggregator.on_trades([0.5, 10, 61, 62], [1, 3, 2, 5], [1, 1, 2, 2])
+    aggregator.on_trades(np.array([63.0]), np.array([4.0]), np.array([1.0]))
+
+    assert [bar.close_price for bar in bars] == [3]
+    partial = aggregator.partial(MINUTE)
+    assert (partial.open_price, partial.high_price, partial.close_price, partial.volume) == (2, 5, 4, 5)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from BarArchive import RECORD_DTYPE, BarArchive, BarArchiveError, read_header
+from BlockFile import decode_block, decode_column, encode_block, encode_column
+from BarStorage import BarDataStorage
+from conftest import random_storage
+
+DAY_START = 1546300800
+
+
+def assert_same_bars(actual, expected):
+    for name in BarDataStorage.COLUMNS:
+        np.testing.assert_array_equal(actual.column(name), expected.column(name), err_msg=name)
+
+
+@pytest.mark.parametrize('partition, block_rows', [('day', None), ('month', None), ('day', 512), ('month', 4096)])
+def test_write_then_load_gives_the_bars_back(tmp_path, partition, block_rows):
+    storage = random_storage(3 * 1440 + 100)
+    archive = BarArchive(str(tmp_path), 'eosusdt', '1min', partition, block_rows)
+    written = archive.write(storage)
+
+    assert len(written) == (4 if partition == 'day' else 1)
+    assert_same_bars(BarArchive(str(tmp_path), 'eosusdt', '1min').load(), storage)
+    part = BarArchive(str(tmp_path), 'eosusdt', '1min').load(DAY_START + 600, DAY_START + 86400 + 60)
+    assert part.time[0] == DAY_START + 600 and part.time[-1] == DAY_START + 86400
+    assert len(part) == 1440 - 10 + 1
+
+
+def test_rewriting_replaces_the_archived_bars(tmp_path):
+    storage = random_storage(200)
+    archive = BarArchive(str(tmp_path), 'eosusdt', '1min')
+    archive.write(storage)
+    update = random_storage(50, start=DAY_START + 100 * 60, seed=2)
+    archive.write(update)
+
+    loaded = BarArchive(str(tmp_path), 'eosusdt', '1min').load()
+    assert len(loaded) == 200
+    np.testing.assert_array_equal(loaded.close_price[100:150], update.close_price)
+    np.testing.assert_array_equal(loaded.close_price[:100], storage.close_price[:100])
+
+
+def test_header_holds_the_ticker(tmp_path):
+    path = BarArchive(str(tmp_path), 'btc3lusdt', '1min').write(random_storage(10, ticker='btc3lusdt'))[0]
+    assert read_header(path)['ticker'] == 'btc3lusdt'
+
+
+def test_tickers_longer_than_the_header_field_are_refused(tmp_path):
+    with pytest.raises(ValueError):
+        BarArchive(str(tmp_path), 'x' * 17, '1min')
+
+
+def test_an_existing_archive_refuses_another_layout(tmp_path):
+    BarArchive(str(tmp_path), 'eosusdt', '1min', 'month').write(random_storage(10))
+
+    assert BarArchive(str(tmp_path), 'eosusdt', '1min').partition == 'month'
+    with pytest.raises(BarArchiveError):
+        BarArchive(str(tmp_path), 'eosusdt', '1min', 'day')
+    with pytest.raises(BarArchiveError):
+        BarArchive(str(tmp_path), 'eosusdt', '1min', block_rows=4096)
+
+
+@pytest.mark.parametrize('values', [
+    [1.5, -0.0, 2.25, 0.0],
+    [0.1, 0.2, 0.3, 1e-4],
+    [np.nan, 1.0, np.inf, -np.inf],
+    [1e300, -1e-300, 5e-324, 3.0],
+    [],
+])
+def test_float_columns_round_trip_bit_for_bit(values):
+    column = np.array(values, dtype=np.float64)
+    decoded = decode_column(encode_column(column), len(column), column.dtype)
+    np.testing.assert_array_equal(decoded.view('<u8'), column.view('<u8'))
+
+
+def test_time_column_round_trips_with_gaps_and_steps_back():
+    column = np.array([DAY_START, DAY_START + 60, DAY_START + 6000, DAY_START - 60, 0], dtype=np.int64)
+    np.testing.assert_array_equal(decode_column(encode_column(column), len(column), column.dtype), column)
+
+
+def test_blocks_round_trip():
+    storage = random_storage(1000)
+    records = np.empty(len(storage), dtype=RECORD_DTYPE)
+    for name in RECORD_DTYPE.names:
+        records[name] = storage.column(name)
+    decoded = decode_block(encode_block(records), len(records), RECORD_DTYPE)
+    assert decoded.tobytes() == records.tobytes()
@@ -0,0 +1,58 @@
+import datetime
+
+from BarCache import BarCache, epoch_windows, merge_intervals, subtract_intervals
+from conftest import random_storage
+
+DAY_START = 1546300800
+
+
+def test_merge_intervals_joins_overlapping_and_touching():
+    assert merge_intervals([(50, 60), (0, 10), (10, 20), (15, 30), (40, 40)]) == [(0, 30), (50, 60)]
+    assert merge_intervals([]) == []
+
+
+def test_subtract_intervals_leaves_the_gaps():
+    covered = [(10, 20), (30, 40)]
+    assert subtract_intervals(0, 50, covered) == [(0, 10), (20, 30), (40, 50)]
+    assert subtract_intervals(12, 18, covered) == []
+    assert subtract_intervals(15, 35, covered) == [(20, 30)]
+    assert subtract_intervals(0, 50, []) == [(0, 50)]
+
+
+def test_epoch_windows_cover_every_bar_start_once():
+    windows = epoch_windows(DAY_START, DAY_START + 86400, 300)
+    assert windows[0] == (DAY_START, DAY_START + 299 * 60)
+    assert windows[-1][1] == DAY_START + 86400 - 60
+    starts = [start for first, last in windows for start in range(first, last + 60, 60)]
+    assert starts == list(range(DAY_START, DAY_START + 86400, 60))
+
+
+def test_day_windows_start_on_huobi_days():
+    day = datetime.timedelta(days=1)
+    windows = epoch_windows(DAY_START, DAY_START + 10 * 86400, 300, day)
+    # the first utc+8 midnight at or after the start
+    assert windows == [(DAY_START + 16 * 3600, DAY_START + 16 * 3600 + 9 * 86400)]
+
+
+def test_coverage_survives_a_new_cache(tmp_path):
+    cache = BarCache(str(tmp_path))
+    storage = random_storage(120)
+    cache.store(storage, '1min', [(DAY_START, DAY_START + 7200)])
+    cache.mark_covered('eosusdt', '1min', [(DAY_START + 10800, DAY_START + 14400)])
+
+    reopened = BarCache(str(tmp_path))
+    assert reopened.coverage('eosusdt', '1min') == [(DAY_START, DAY_START + 7200), (DAY_START + 10800, DAY_START + 14400)]
+    assert reopened.missing('eosusdt', '1min', DAY_START, DAY_START + 18000) == [
+        (DAY_START + 7200, DAY_START + 10800), (DAY_START + 14400, DAY_START + 18000)
+    ]
+    assert reopened.gap_windows('eosusdt', '1min', DAY_START, DAY_START + 10800) == [
+        (DAY_START + 7200, DAY_START + 10800 - 60)
+    ]
+    assert len(reopened.load('eosusdt', '1min')) == 120
+
+
+def test_bars_still_open_are_not_covered(tmp_path):
+    cache = BarCache(str(tmp_path))
+    far_future = 4102444800
+    cache.mark_covered('eosusdt', '1min', [(DAY_START, far_future)])
+    assert cache.coverage('eosusdt', '1min')[0][1] < far_future
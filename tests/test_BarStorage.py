@@ -0,0 +1,71 @@
+import datetime
+
+import numpy as np
+
+from BarStorage import BarDataStorage, bar_start, from_epoch, to_epoch
+
+MINUTE = datetime.timedelta(minutes=1)
+DAY = datetime.timedelta(days=1)
+WEEK = datetime.timedelta(weeks=1)
+
+
+def bars(storage, times, close):
+    count = len(times)
+    storage.extend(times, np.ones(count), np.ones(count), np.ones(count), close, np.ones(count), np.ones(count))
+
+
+def test_rows_are_sorted_on_read():
+    storage = BarDataStorage(ticker='eosusdt')
+    bars(storage, [180, 60, 120], [3.0, 1.0, 2.0])
+    storage.append(0, 1.0, 1.0, 1.0, 0.5, 1.0, 1.0)
+
+    assert storage.time.tolist() == [0, 60, 120, 180]
+    assert storage.close_price.tolist() == [0.5, 1.0, 2.0, 3.0]
+
+
+def test_the_last_write_for_a_time_wins():
+    storage = BarDataStorage(ticker='eosusdt')
+    bars(storage, [0, 60, 120], [1.0, 2.0, 3.0])
+    bars(storage, [60, 60], [20.0, 200.0])
+
+    assert len(storage) == 3
+    assert storage.close_price.tolist() == [1.0, 200.0, 3.0]
+    assert storage.replaced_count == 2
+
+
+def test_merge_replaces_overlapping_bars():
+    storage = BarDataStorage(ticker='eosusdt')
+    bars(storage, [0, 60], [1.0, 2.0])
+    other = BarDataStorage(ticker='eosusdt')
+    bars(other, [60, 120], [20.0, 30.0])
+    storage.merge(other)
+
+    assert storage.time.tolist() == [0, 60, 120]
+    assert storage.close_price.tolist() == [1.0, 20.0, 30.0]
+
+
+def test_slice_is_half_open_and_a_view_stays_sorted():
+    storage = BarDataStorage(ticker='eosusdt')
+    bars(storage, np.arange(10) * 60, np.arange(10.0))
+
+    assert storage.slice(120, 300).time.tolist() == [120, 180, 240]
+    assert storage[::-1].time.tolist() == (np.arange(10) * 60).tolist()
+    assert 180 in storage and 190 not in storage
+    assert storage[from_epoch(180)].close_price == 3.0
+
+
+def test_to_epoch_takes_naive_datetimes_as_utc():
+    assert to_epoch(datetime.datetime(2019, 1, 1)) == 1546300800
+    assert to_epoch(datetime.date(2019, 1, 1)) == 1546300800
+    assert to_epoch(datetime.datetime(2019, 1, 1, 8, tzinfo=datetime.timezone(datetime.timedelta(hours=8)))) == 1546300800
+
+
+def test_days_and_weeks_start_at_utc8_midnight():
+    # 2019-01-01 00:00 utc is 08:00 in utc+8, its day started 8 hours earlier
+    assert bar_start(1546300800, DAY) == 1546300800 - 8 * 3600
+    assert bar_start(1546300800 + 16 * 3600, DAY) == 1546300800 + 16 * 3600
+    # 2018-12-31 is a monday
+    monday = to_epoch(datetime.datetime(2018, 12, 31)) - 8 * 3600
+    assert bar_start(monday + 6 * 86400, WEEK) == monday
+    assert bar_start(monday - 1, WEEK) == monday - 7 * 86400
+    assert bar_start(np.array([59, 60, 61]), MINUTE).tolist() == [0, 60, 60]
@@ -0,0 +1,84 @@
+import os
+import struct
+
+import pytest
+
+from FrameJournal import (
+    HEADER_SIZE, RECORD_FORMAT, FrameJournal, FrameJournalError, read_journal, replay_journal
+)
+
+FRAMES = [b'first', b'', b'\x1f\x8b' + bytes(range(256)), b'last frame']
+
+
+def write_frames(file_path, frames=FRAMES):
+    with FrameJournal(file_path) as journal:
+        for i, frame in enumerate(frames):
+            journal.append(frame, received=1000 + i)
+    return journal
+
+
+def test_frames_come_back_in_order(tmp_path):
+    file_path = str(tmp_path / 'frames.journal')
+    journal = write_frames(file_path)
+
+    assert journal.frame_count == len(FRAMES) and journal.byte_count == sum(map(len, FRAMES))
+    assert [(received, bytes(frame)) for received, frame in read_journal(file_path)] == [
+        (1000 + i, frame) for i, frame in enumerate(FRAMES)
+    ]
+
+
+@pytest.mark.parametrize('cut', [1, struct.calcsize(RECORD_FORMAT) + 3])
+def test_torn_last_record_is_truncated_on_reopen(tmp_path, cut):
+    file_path = str(tmp_path / 'frames.journal')
+    write_frames(file_path)
+    size = os.path.getsize(file_path)
+    with open(file_path, 'r+b') as f:
+        f.truncate(size - len(FRAMES[-1]) - struct.calcsize(RECORD_FORMAT) + cut)
+
+    assert [bytes(frame) for _, frame in read_journal(file_path)] == FRAMES[:-1]
+    with FrameJournal(file_path) as journal:
+        journal.append(b'after the crash', received=2000)
+
+    assert [bytes(frame) for _, frame in read_journal(file_path)] == FRAMES[:-1] + [b'after the crash']
+
+
+def test_header_only_journal_reopens_empty(tmp_path):
+    file_path = str(tmp_path / 'frames.journal')
+    write_frames(file_path, [])
+    assert os.path.getsize(file_path) == HEADER_SIZE
+
+    with FrameJournal(file_path) as journal:
+        journal.append(b'one')
+    assert [bytes(frame) for _, frame in read_journal(file_path)] == [b'one']
+
+
+def test_other_files_are_refused(tmp_path):
+    file_path = str(tmp_path / 'frames.journal')
+    with open(file_path, 'wb') as f:
+        f.write(b'NOPE' + b'\0' * HEADER_SIZE)
+    with pytest.raises(FrameJournalError):
+        FrameJournal(file_path)
+
+    with open(file_path, 'wb') as f:
+        f.write(b'HJ')
+    with pytest.raises(FrameJournalError):
+        list(read_journal(file_path))
+
+
+def test_appends_after_close_are_counted_not_written(tmp_path):
+    file_path = str(tmp_path / 'frames.journal')
+    journal = write_frames(file_path)
+    journal.append(b'late')
+    journal.flush()
+
+    assert journal.late_count == 1 and journal.frame_count == len(FRAMES)
+    assert len(list(read_journal(file_path))) == len(FRAMES)
+
+
+def test_replay_calls_back_every_frame(tmp_path):
+    file_path = str(tmp_path / 'frames.journal')
+    write_frames(file_path)
+    frames = []
+
+    assert replay_journal(file_path, lambda frame: frames.append(bytes(frame))) == len(FRAMES)
+    assert frames == FRAMES
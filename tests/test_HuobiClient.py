@@ -0,0 +1,87 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+import HuobiClient
+from HuobiClient import BarDataReplay, request_range, request_windows
+from Metrics import Metrics
+from conftest import random_storage
+
+DAY = datetime.date(2019, 1, 1)
+DAY_START = 1546300800
+
+
+def replay_of(storage, start_date=DAY, end_date=DAY):
+    replay = BarDataReplay(storage.ticker, start_date, end_date)
+    replay.bar_data_storage.merge(storage)
+    return replay
+
+
+def test_request_range_is_in_the_given_timezone():
+    assert request_range(DAY, DAY) == (DAY_START, DAY_START + 86400)
+    utc8 = datetime.timezone(datetime.timedelta(hours=8))
+    assert request_range(DAY, DAY, utc8) == (DAY_START - 8 * 3600, DAY_START + 16 * 3600)
+    assert BarDataReplay('eosusdt', DAY, DAY, timezone=utc8).request_range() == request_range(DAY, DAY, utc8)
+
+
+def test_request_windows_cover_the_day_without_overlap():
+    windows = request_windows(DAY, DAY, request_size=300)
+
+    assert windows[0][0] == DAY_START and windows[-1][1] == DAY_START + 86400 - 60
+    assert all(windows[i][1] + 60 == windows[i + 1][0] for i in range(len(windows) - 1))
+    assert sum((end - start) // 60 + 1 for start, end in windows) == 1440
+
+
+def test_request_data_against_the_stand_in(stand_in):
+    replay = BarDataReplay(['btcusdt', 'ethusdt'], DAY, DAY, url=stand_in.url)
+    replay.request_data(connect_timeout=10.0, response_timeout=10.0, metrics=Metrics())
+
+    assert not replay.failed_requests
+    for ticker in replay.tickers:
+        storage = replay.storage(ticker)
+        assert len(storage) == 1440 and storage.time[0] == DAY_START
+        report = replay.check(ticker)
+        assert report.ok and report.duplicate_count == 0
+
+
+def test_file_name_carries_ticker_period_and_days():
+    replay = BarDataReplay('eosusdt', DAY, datetime.date(2019, 1, 31), periods=('1min', '60min'))
+
+    assert replay.file_name('.csv') == 'eosusdt_20190101_20190131.csv'
+    assert replay.file_name('.csv', period='60min') == 'eosusdt_60min_20190101_20190131.csv'
+
+
+def test_to_csv_leaves_nothing_else_unless_asked(tmp_path):
+    replay = replay_of(random_storage(1440))
+    replay.to_csv(str(tmp_path / 'plain.csv'))
+    assert os.listdir(str(tmp_path)) == ['plain.csv']
+
+    replay.to_csv(str(tmp_path / 'checked.csv'), record_integrity=True)
+    assert {'checked.csv', 'integrity.json'} <= set(os.listdir(str(tmp_path)))
+
+    loaded = BarDataReplay('eosusdt', DAY, DAY)
+    loaded.from_csv(str(tmp_path / 'checked.csv'), verify=True)
+    assert loaded.integrity[('eosusdt', '1min')].ok
+    np.testing.assert_allclose(loaded.bar_data_storage.close_price, replay.bar_data_storage.close_price)
+    assert loaded.bar_data_storage.time.tolist() == replay.bar_data_storage.time.tolist()
+
+
+def test_archive_round_trip(tmp_path):
+    storage = random_storage(3 * 1440)
+    replay = replay_of(storage, DAY, datetime.date(2019, 1, 3))
+    assert len(replay.to_archive(str(tmp_path), block_rows=512)) == 3
+
+    loaded = BarDataReplay('eosusdt', datetime.date(2019, 1, 2), datetime.date(2019, 1, 2))
+    loaded.from_archive(str(tmp_path))
+    assert loaded.bar_data_storage.time.tolist() == storage.time[1440:2880].tolist()
+    np.testing.assert_array_equal(loaded.bar_data_storage.close_price, storage.close_price[1440:2880])
+
+    queried = HuobiClient.query('eosusdt', DAY_START + 600, DAY_START + 1200, root=str(tmp_path))
+    assert queried.time.tolist() == storage.time[10:20].tolist()
+
+
+def test_unsupported_period_is_refused():
+    with pytest.raises(AssertionError):
+        BarDataReplay('eosusdt', DAY, DAY, periods=('2min',))
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from BarStorage import BarDataStorage
+from Indicators import SMA, VWAP, IndicatorEngine, Returns, RollingHigh, RollingLow, Volatility
+from conftest import random_storage
+
+INDICATORS = [
+    VWAP(20), VWAP(), SMA(20), SMA(10, column='volume'), RollingHigh(20), RollingLow(60), Returns(),
+    Returns(5, log=True), Volatility(20)
+]
+
+
+def head_of(storage, count):
+    head = BarDataStorage(ticker=storage.ticker, bar_span=storage.bar_span)
+    head.extend(*(storage.column(name)[:count] for name in BarDataStorage.COLUMNS))
+    return head
+
+
+def assert_same_values(actual, expected):
+    for name in expected:
+        np.testing.assert_allclose(actual[name], expected[name], rtol=1e-9, atol=1e-12, equal_nan=True, err_msg=name)
+
+
+@pytest.mark.parametrize('split', [1, 30, 2500])
+def test_steppers_give_what_compute_gives(split):
+    storage = random_storage(3000)
+    full = {name: values.copy() for name, values in IndicatorEngine(INDICATORS).compute(storage).items()}
+
+    engine = IndicatorEngine(INDICATORS)
+    engine.compute(head_of(storage, split))
+    columns = {name: storage.column(name) for name in BarDataStorage.COLUMNS}
+    for i in range(split, len(storage)):
+        engine.update('eosusdt', '1min', int(columns['time'][i]), *(float(columns[name][i]) for name in BarDataStorage.COLUMNS[1:]))
+
+    assert_same_values(engine.values('eosusdt'), full)
+
+
+def test_compute_after_appending_only_adds_the_new_rows():
+    storage = random_storage(3000)
+    full = {name: values.copy() for name, values in IndicatorEngine(INDICATORS).compute(storage).items()}
+
+    engine = IndicatorEngine(INDICATORS)
+    head = head_of(storage, 1000)
+    engine.compute(head)
+    head.extend(*(storage.column(name)[1000:] for name in BarDataStorage.COLUMNS))
+    assert_same_values(engine.compute(head), full)
+
+
+def test_values_against_plain_loops():
+    storage = random_storage(200)
+    values = IndicatorEngine(INDICATORS).compute(storage)
+    high, low, close = storage.high_price, storage.low_price, storage.close_price
+
+    for i in (0, 18, 19, 120):
+        expected = high[i - 19:i + 1].max() if i >= 19 else np.nan
+        np.testing.assert_equal(values['high_20'][i], expected)
+        expected = close[i - 19:i + 1].mean() if i >= 19 else np.nan
+        np.testing.assert_allclose(values['sma_20'][i], expected, equal_nan=True)
+    assert values['low_60'][100] == low[41:101].min()
+    assert values['return_1'][5] == pytest.approx(close[5] / close[4] - 1)
+    assert np.isnan(values['return_1'][0])
+
+
+def test_bars_must_come_in_order():
+    engine = IndicatorEngine([SMA(2)])
+    engine.update('eosusdt', '1min', 60, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+    with pytest.raises(ValueError):
+        engine.update('eosusdt', '1min', 60, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
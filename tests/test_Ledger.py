@@ -0,0 +1,115 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from DataStructure import Report, TradeSide
+from Ledger import Ledger, _carried
+
+NOW = datetime.datetime(2019, 1, 1)
+
+
+def report(side, amount, price, margin=None):
+    fill = Report('eosusdt', side, amount, amount * price, NOW, 'order', '')
+    if margin is not None:
+        fill.set_margin(margin)
+    return fill
+
+
+def random_fills(count, seed):
+    """
+    long and short opens and closes that never close more than is held
+    """
+    random = np.random.default_rng(seed)
+    sides, amounts, prices = [], [], []
+    held = {TradeSide.LongOpen: 0, TradeSide.ShortOpen: 0}
+    closes = {TradeSide.LongOpen: TradeSide.LongClose, TradeSide.ShortOpen: TradeSide.ShortClose}
+    for _ in range(count):
+        book = TradeSide.LongOpen if random.random() < 0.5 else TradeSide.ShortOpen
+        if held[book] and random.random() < 0.5:
+            amount = int(random.integers(1, held[book] + 1))
+            held[book] -= amount
+            sides.append(closes[book])
+        else:
+            amount = int(random.integers(1, 10))
+            held[book] += amount
+            sides.append(book)
+        amounts.append(amount)
+        prices.append(round(float(random.uniform(4, 6)), 4))
+    return sides, np.array(amounts), np.array(prices)
+
+
+def test_average_cost_and_realized_pnl():
+    ledger = Ledger()
+    ledger.on_report(report(TradeSide.LongOpen, 2, 10.0))
+    ledger.on_report(report(TradeSide.LongOpen, 2, 12.0))
+    realized = ledger.on_report(report(TradeSide.LongClose, 1, 15.0))
+
+    position = ledger.position('eosusdt')
+    assert realized == pytest.approx(4.0)
+    assert position.long_amount == 3
+    assert position.long_average_price == pytest.approx(11.0)
+    ledger.mark('eosusdt', 12.0)
+    assert position.unrealized_pnl == pytest.approx(3.0)
+
+
+def test_closing_more_than_is_held_raises():
+    ledger = Ledger()
+    ledger.on_report(report(TradeSide.ShortOpen, 1, 10.0))
+    with pytest.raises(ValueError):
+        ledger.on_report(report(TradeSide.ShortClose, 2, 10.0))
+    with pytest.raises(ValueError):
+        ledger.apply_arrays('eosusdt', [TradeSide.LongClose], [1], [10.0])
+
+
+def test_margin_is_released_in_proportion():
+    ledger = Ledger(margin_rate=0.1)
+    ledger.on_report(report(TradeSide.LongOpen, 4, 10.0))
+    ledger.on_report(report(TradeSide.LongClose, 1, 10.0))
+    assert ledger.margin == pytest.approx(3.0)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_apply_arrays_matches_on_report(seed):
+    sides, amounts, prices = random_fills(5000, seed)
+    one_by_one = Ledger(margin_rate=0.05)
+    realized = [one_by_one.on_report(report(side, amount, price))
+                for side, amount, price in zip(sides, amounts.tolist(), prices.tolist())]
+
+    batched = Ledger(margin_rate=0.05)
+    # in two batches, the second starts from what the first left open
+    half = len(sides) // 2
+    batch_realized = np.concatenate([
+        batched.apply_arrays('eosusdt', sides[:half], amounts[:half], amounts[:half] * prices[:half]),
+        batched.apply_arrays('eosusdt', sides[half:], amounts[half:], amounts[half:] * prices[half:])
+    ])
+
+    np.testing.assert_allclose(batch_realized, realized, rtol=1e-9, atol=1e-9)
+    expected, actual = one_by_one.position('eosusdt'), batched.position('eosusdt')
+    for name in ('long_amount', 'short_amount', 'long_cost', 'short_cost', 'long_margin', 'short_margin', 'realized_pnl'):
+        assert getattr(actual, name) == pytest.approx(getattr(expected, name), rel=1e-9, abs=1e-9), name
+
+
+def test_prefix_scan_stays_exact_on_a_book_that_is_never_flat():
+    # open two lots and close one, over and over, the book never goes back to zero
+    count = 200000
+    amount = np.tile([2, -1], count // 2).astype(np.float64)
+    add = np.where(amount > 0, 20.0, 0.0)
+    value = _carried(amount, add)
+
+    reference = np.empty(count)
+    held, carried = 0.0, 0.0
+    for i in range(count):
+        if amount[i] > 0:
+            carried += add[i]
+        else:
+            carried *= (held + amount[i]) / held
+        held += amount[i]
+        reference[i] = carried
+    np.testing.assert_allclose(value, reference, rtol=1e-10)
+
+
+def test_prefix_scan_restarts_after_going_flat():
+    amount = np.array([3.0, -3.0, 1.0, -0.5])
+    value = _carried(amount, np.array([30.0, 0.0, 12.0, 0.0]))
+    np.testing.assert_allclose(value, [30.0, 0.0, 12.0, 6.0])
@@ -0,0 +1,87 @@
+import time
+
+import numpy as np
+
+from FrameJournal import FrameJournal
+from MarketStream import BBO_DTYPE, MarketStream, RingBuffer
+
+DTYPE = np.dtype([('time', '<i8'), ('value', '<f8')])
+
+
+def records(start, count):
+    return np.array([(i, i * 0.5) for i in range(start, start + count)], dtype=DTYPE)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.02)
+
+
+def test_push_wraps_around_and_snapshot_is_oldest_first():
+    buffer = RingBuffer(DTYPE, 4)
+    for record in records(0, 10):
+        buffer.push(record)
+
+    assert len(buffer) == 4 and buffer.total == 10
+    assert buffer.snapshot()['time'].tolist() == [6, 7, 8, 9]
+    assert buffer.snapshot(2)['time'].tolist() == [8, 9]
+    assert buffer.latest()['time'] == 9
+
+
+def test_extend_across_the_end_and_past_capacity():
+    buffer = RingBuffer(DTYPE, 5)
+    buffer.extend(records(0, 3))
+    buffer.extend(records(3, 4))
+    assert buffer.snapshot()['time'].tolist() == [2, 3, 4, 5, 6]
+
+    buffer.extend(records(7, 12))
+    assert buffer.total == 19 and len(buffer) == 5
+    assert buffer.snapshot()['time'].tolist() == [14, 15, 16, 17, 18]
+
+
+def test_replace_last_updates_the_newest_record():
+    buffer = RingBuffer(DTYPE, 3)
+    assert buffer.latest() is None
+    buffer.replace_last((1, 1.0))
+    assert buffer.total == 1
+
+    buffer.extend(records(2, 3))
+    buffer.replace_last((4, 9.0))
+    assert buffer.total == 4
+    assert buffer.snapshot()['value'].tolist() == [1.0, 1.5, 9.0]
+
+
+def test_live_stream_against_the_stand_in(stand_in, tmp_path):
+    journal_path = str(tmp_path / 'frames.journal')
+    with FrameJournal(journal_path) as journal:
+        stream = MarketStream(url=stand_in.url, journal=journal)
+        kline = stream.subscribe_kline('btcusdt')
+        trades = stream.subscribe_trades('btcusdt')
+        bbo = stream.subscribe_bbo('ethusdt')
+        seen = []
+        stream.on(trades, lambda channel, record: seen.append(channel))
+        stream.start(connect_timeout=10.0)
+        try:
+            wait_for(lambda: stream.buffer(kline).total and all(stream.buffer(channel).total >= 4 for channel in (trades, bbo)))
+        finally:
+            stream.stop()
+
+    assert set(seen) == {trades}
+    assert set(stream.snapshot(trades)['direction'].tolist()) <= {1, -1}
+    latest = stream.latest(bbo)
+    assert latest.dtype == BBO_DTYPE and latest['ask_price'] > latest['bid_price']
+    assert stream.book('ethusdt').best() == (
+        latest['bid_price'], latest['bid_amount'], latest['ask_price'], latest['ask_amount']
+    )
+    # kline updates of the open bar replace each other
+    assert len(stream.buffer(kline)) <= 2
+
+    replayed = MarketStream(url=stand_in.url)
+    replayed.subscribe_kline('btcusdt')
+    replayed.subscribe_trades('btcusdt')
+    replayed.subscribe_bbo('ethusdt')
+    assert replayed.replay(journal_path) > 0
+    for channel in (kline, trades, bbo):
+        np.testing.assert_array_equal(replayed.snapshot(channel), stream.snapshot(channel))
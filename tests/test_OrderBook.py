@@ -0,0 +1,104 @@
+import os
+import random
+
+import numpy as np
+
+from OrderBook import DepthSnapshotFile, MarketDepth, OrderBook
+
+
+def small_book():
+    book = OrderBook('x', 5)
+    book.apply_snapshot([[10, 1], [9, 2], [8, 3]], [[11, 1], [12, 2]], 1000, seq=5)
+    return book
+
+
+def test_snapshot_prices_and_depth():
+    book = small_book()
+
+    assert book.spread() == 1 and book.mid() == 10.5
+    assert book.depth('bid', 1) == 3 and book.price('ask', 1) == 12
+    assert np.isnan(book.price('ask', 2))
+
+
+def test_gap_waits_for_a_snapshot_and_replays_pending_updates():
+    book = small_book()
+
+    assert not book.apply_update(8, 7, [], [], 1001)
+    assert not book.synced and book.gap_count == 1
+
+    book.apply_snapshot([[10, 1], [9, 2], [8, 3]], [[11, 1], [12, 2]], 1002, seq=7)
+    assert book.synced and book.seq == 8
+
+
+def test_update_inserts_deletes_and_keeps_the_level_count():
+    book = small_book()
+
+    assert book.apply_update(6, 5, [[9.5, 4], [10, 0]], [[11.5, 1], [13, 1], [14, 1], [15, 1], [16, 1]], 1003)
+
+    assert book.price('bid') == 9.5 and book.price('bid', 1) == 9
+    assert book.asks.count == 5 and book.price('ask', 4) == 14
+    assert book.depth_within('ask', 1.0) == 4
+
+
+def test_bbo_trims_levels_crossed_by_the_new_top():
+    book = small_book()
+
+    book.apply_bbo(9.5, 1, 11.5, 2, 1004)
+
+    assert book.best() == (9.5, 1, 11.5, 2)
+    assert book.price('bid', 1) == 9 and book.price('ask', 1) == 12
+
+
+def test_random_updates_match_a_dict_book():
+    reference = {'bid': {}, 'ask': {}}
+    book = OrderBook('y', 400)
+    book.apply_snapshot([], [], 1, seq=0)
+    rng = random.Random(0)
+    for seq in range(1, 5000):
+        bids = [[float(rng.randint(1, 300)), rng.choice([0, 0, 1.0, 2.0])] for _ in range(3)]
+        asks = [[float(rng.randint(301, 600)), rng.choice([0, 0, 1.0, 2.0])] for _ in range(3)]
+        assert book.apply_update(seq, seq - 1, bids, asks, seq)
+        for side, levels in (('bid', bids), ('ask', asks)):
+            for price, size in levels:
+                if size:
+                    reference[side][price] = size
+                else:
+                    reference[side].pop(price, None)
+
+    bids = sorted(reference['bid'].items(), reverse=True)
+    asks = sorted(reference['ask'].items())
+    assert [book.price('bid', i) for i in range(len(bids))] == [price for price, _ in bids]
+    assert [book.price('ask', i) for i in range(len(asks))] == [price for price, _ in asks]
+    assert book.depth('bid', 9) == sum(size for _, size in bids[:10])
+
+
+def test_levels_past_capacity_are_dropped():
+    book = OrderBook('z', 3)
+    book.apply_snapshot([[10 - i, 1] for i in range(6)], [[11 + i, 1] for i in range(6)], 1000, seq=1)
+
+    assert book.bids.count == 3 and book.asks.count == 3
+    assert book.price('bid', 2) == 8 and book.price('ask', 2) == 13
+
+
+def test_snapshot_file_samples_and_survives_a_torn_row(tmp_path):
+    depth = MarketDepth(levels=5, directory=str(tmp_path), snapshot_interval=1.0)
+    for i in range(100):
+        depth.on_depth('x', {
+            'ts': 1000 + i * 250,
+            'bids': [[10 - 0.1 * j, j + 1] for j in range(7)],
+            'asks': [[11 + 0.1 * j, 1] for j in range(3)]
+        })
+    snapshots = depth.snapshot_file('x')
+    records = snapshots.read()
+    assert len(records['time']) == 25 and records['bid_price'].shape == (25, 5)
+    assert np.isnan(records['ask_price'][0, 3])
+    assert len(snapshots.read(2000, 5000)['time']) == 3
+    depth.close()
+
+    with open(os.path.join(snapshots.directory, 'time.bin'), 'ab') as f:
+        f.write(b'\0' * 8)
+    reopened = DepthSnapshotFile(snapshots.directory)
+    assert len(reopened) == 25
+    reopened.append(depth.book('x').snapshot())
+    reopened.close()
+    assert len(reopened) == 26 and len(reopened.read()['seq']) == 26
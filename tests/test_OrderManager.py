@@ -0,0 +1,87 @@
+import datetime
+
+import pytest
+
+from DataStructure import Instruction, OrderState, OrderType, Report, TradeSide
+from OrderManager import OrderManager
+
+NOW = datetime.datetime(2019, 1, 1)
+
+
+def order(ticker='eosusdt', side=TradeSide.LongOpen, amount=10):
+    return Instruction(ticker, side, OrderType.LimitOrder, amount, 5.0)
+
+
+def fill(instruction, amount):
+    return Report(instruction.Ticker, instruction.Side, amount, amount * 5.0, NOW, instruction.OrderID, '')
+
+
+def test_indexes_follow_the_order_state():
+    manager = OrderManager()
+    first, second = manager.add(order()), manager.add(order('btcusdt', TradeSide.ShortOpen))
+    manager.apply(fill(first, 4))
+
+    assert manager.order_ids(state=OrderState.PartFilled) == {first.OrderID}
+    assert manager.order_ids(state=OrderState.Pending) == {second.OrderID}
+    assert manager.order_ids('btcusdt', side=TradeSide.ShortOpen) == {second.OrderID}
+    assert manager.live('eosusdt') == [first]
+
+    manager.apply(fill(first, 6))
+    assert first.State is OrderState.Filled
+    assert manager.live('eosusdt') == []
+
+
+def test_duplicate_ids_and_cancel_instructions_are_refused():
+    manager = OrderManager()
+    instruction = manager.add(order())
+    with pytest.raises(KeyError):
+        manager.add(instruction)
+    with pytest.raises(ValueError):
+        manager.add(Instruction('eosusdt', TradeSide.Cancel, OrderType.CancelOrder, 1, 0.0))
+
+
+@pytest.mark.filterwarnings('ignore:Invalid trade amount')
+def test_cancel_goes_through_canceling():
+    manager = OrderManager()
+    instruction = manager.add(order())
+    cancel = manager.canceling(instruction.OrderID, NOW)
+    assert cancel.Type is OrderType.CancelOrder and cancel.OrderID == instruction.OrderID
+    manager.canceled(instruction.OrderID, NOW)
+    assert manager.order_ids(state=OrderState.Canceled) == {instruction.OrderID}
+
+
+def test_finished_orders_spill_into_history():
+    manager = OrderManager(keep_finished=4)
+    orders = [manager.add(order()) for _ in range(10)]
+    manager.apply_all([fill(instruction, 10) for instruction in orders])
+
+    assert len(manager) + len(manager.history) == 10
+    assert len(manager.history) > 0
+    records = manager.history_records('eosusdt', OrderState.Filled)
+    assert len(records) == len(manager.history)
+    assert manager.history.find(orders[0].OrderID)['filled_amount'] == 10
+
+
+def test_late_fills_of_spilled_orders_are_counted_not_raised():
+    manager = OrderManager(keep_finished=2)
+    orders = [manager.add(order()) for _ in range(6)]
+    manager.apply_all([fill(instruction, 10) for instruction in orders[:4]])
+    assert orders[0].OrderID not in manager
+
+    # a batch with a late fill in the middle is booked to the end
+    manager.apply_all([fill(orders[4], 5), fill(orders[0], 1), fill(orders[5], 5)])
+    assert manager.late_fill_count == 1
+    assert orders[5].FilledAmount == 5
+    with pytest.raises(KeyError):
+        manager.filled('unknown', 1, 5.0, NOW)
+
+
+def test_empty_index_sets_are_dropped():
+    manager = OrderManager(keep_finished=0)
+    for ticker in ('a', 'b', 'c'):
+        instruction = manager.add(order(ticker))
+        manager.apply(fill(instruction, 10))
+    manager.spill()
+
+    assert len(manager) == 0
+    assert manager._by_ticker == {} and manager._by_state == {} and manager._by_side == {}